@@ -48,6 +48,8 @@ class BaseFilePickerCtrl():
         self.set_no = set_no
         self.required = required
         self.data = None
+        # 読み込んだ時のファイルのパス・サイズ・更新日時
+        self.data_stat = None
         self.astr_path = None
         self.target_paths = []
 
@@ -295,13 +297,19 @@ class BaseFilePickerCtrl():
 
             file_name, input_ext = os.path.splitext(os.path.basename(file_path))
 
+            # ファイルが前回読み込んだ時から変わっていない場合、ハッシュ値も計算せずにそのまま使う
+            file_stat = MFileUtils.get_file_stat(file_path)
+            if self.data and self.data_stat == file_stat:
+                logger.info("%s%s 読み込み成功: %s", display_set_no, self.title, os.path.basename(file_path))
+                return True
+
             # 拡張子別にリーダー生成
             if input_ext.lower() == ".vmd":
                 reader = VmdReader(file_path)
             elif input_ext.lower() == ".vpd":
                 reader = VpdReader(file_path)
             elif input_ext.lower() == ".pmx":
-                reader = PmxReader(file_path, is_check=is_check)
+                reader = PmxReader(file_path, is_check=is_check, is_lazy=True)
             else:
                 logger.error("%s%s 読み込み失敗(拡張子不正): %s", display_set_no, self.title, os.path.basename(file_path), decoration=MLogger.DECORATION_BOX)
                 return False
@@ -313,11 +321,14 @@ class BaseFilePickerCtrl():
             if new_data_digest and ((self.data and self.data.digest != new_data_digest) or not self.data):
                 # ハッシュが取得できてて、過去データがないかハッシュが違う場合、読み込み
                 self.data = reader.read_data()
-                    
+                # 読み込めた場合だけ、ファイルの状態を保持する
+                self.data_stat = file_stat if self.data and not isinstance(self.data, Exception) else None
+
                 logger.info("%s%s 読み込み成功: %s", display_set_no, self.title, os.path.basename(file_path))
                 return True
             elif new_data_digest and self.data and self.data.digest == new_data_digest:
                 # ハッシュが同じ場合、そのままスルー
+                self.data_stat = file_stat
                 logger.info("%s%s 読み込み成功: %s", display_set_no, self.title, os.path.basename(file_path))
                 return True
         except MKilledException:
@@ -107,7 +107,8 @@ class SizingWorkerThread(BaseWorkerThread):
                 monitor=self.frame.file_panel_ctrl.console_ctrl, \
                 is_file=False, \
                 outout_datetime=logger.outout_datetime, \
-                max_workers=(1 if self.is_exec_saving else min(32, os.cpu_count() + 4)))
+                max_workers=(1 if self.is_exec_saving else min(32, os.cpu_count() + 4)), \
+                is_process=(not self.is_exec_saving and len(data_set_list) > 1))
             
             self.result = SizingService(self.options).execute() and self.result
 
@@ -3,6 +3,7 @@
 import _pickle as cPickle
 from abc import ABCMeta, abstractmethod
 from collections import OrderedDict
+import itertools
 import math
 import numpy as np
 
@@ -13,6 +14,9 @@ from utils.MLogger import MLogger # noqa
 
 logger = MLogger(__name__, level=MLogger.DEBUG)
 
+# ボーン構造の更新バージョン(全モデルで一意に採番する)
+VERSION_COUNTER = itertools.count()
+
 
 # 頂点構造 ----------------------------
 class Vertex():
@@ -186,6 +190,10 @@ class Material():
 
 # ボーン構造-----------------------
 class Bone():
+    # コンパイル済みボーン構造(PmxSkeleton)に反映される属性
+    SKELETON_ATTRS = {"name", "position", "parent_index", "flag", "tail_position", "tail_index", "effect_index", "effect_factor", "fixed_axis",
+                      "local_x_vector", "local_z_vector", "ik", "index"}
+
     def __init__(self, name, english_name, position, parent_index, layer, flag, tail_position=None, tail_index=-1, effect_index=-1, effect_factor=0.0, fixed_axis=None,
                  local_x_vector=None, local_z_vector=None, external_key=-1, ik=None):
         self.name = name
@@ -243,6 +251,18 @@ class Bone():
         self.BONEFLAG_IS_AFTER_PHYSICS_DEFORM = 0x1000
         self.BONEFLAG_IS_EXTERNAL_PARENT_DEFORM = 0x2000
     
+    # ボーン構造に反映される属性が変更された場合、登録先のボーン辞書の更新バージョンを進める
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in Bone.SKELETON_ATTRS and self.__dict__.get("owner") is not None:
+            self.owner.touch()
+
+    # 登録先は引き継がない(登録し直した時に設定する)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("owner", None)
+        return state
+
     def copy(self):
         return cPickle.loads(cPickle.dumps(self, -1))
 
@@ -331,11 +351,25 @@ class Morph():
         self.english_name = english_name
         self.panel = panel
         self.morph_type = morph_type
+        # 読み込みを後回しにしたオフセットの読み込み処理(読み込み済みの場合、None)
+        self.offsets_loader = None
         self.offsets = offsets or []
         # 表示枠チェック時にONにするので、デフォルトはFalse
         self.display = False
         self.related_names = []
 
+    # オフセット(読み込みを後回しにしている場合、最初に参照した時に読み込む)
+    @property
+    def offsets(self):
+        if self.offsets_loader:
+            self.offsets_loader(self)
+        return self.__offsets
+
+    @offsets.setter
+    def offsets(self, offsets):
+        self.__offsets = offsets
+        self.offsets_loader = None
+
     def __str__(self):
         return "<Morph name:{0}, english_name:{1}, panel:{2}, morph_type:{3}, offsets(len): {4}".format(
                self.name, self.english_name, self.panel, self.morph_type, len(self.offsets))
@@ -874,6 +908,258 @@ class Joint():
                    self.spring_constant_translation, self.spring_constant_rotation)
 
 
+# ボーン辞書-----------------------
+# ボーンの登録・削除、ボーン構造に反映される属性の変更で更新バージョン(version)を進める
+# コンパイル済みボーン構造は、このバージョンが変わった時に生成し直す
+# (position.setX()等、値を直接書き換えた場合は検知できないので、代入し直すかtouch()を呼ぶ)
+class PmxBoneDict(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.version = next(VERSION_COUNTER)
+        self.update(*args, **kwargs)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def __setitem__(self, bone_name, bone):
+        bone.owner = self
+        super().__setitem__(bone_name, bone)
+        self.touch()
+
+    def __delitem__(self, bone_name):
+        super().__delitem__(bone_name)
+        self.touch()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self.touch()
+        return result
+
+    def clear(self):
+        super().clear()
+        self.touch()
+
+    def update(self, *args, **kwargs):
+        for bone_name, bone in dict(*args, **kwargs).items():
+            self[bone_name] = bone
+
+    def setdefault(self, bone_name, bone=None):
+        if bone_name not in self:
+            self[bone_name] = bone
+        return self[bone_name]
+
+    # 更新バージョンを進める
+    def touch(self):
+        self.version = next(VERSION_COUNTER)
+
+
+# コンパイル済みボーン構造-----------------------
+# ボーンを親から順(トポロジカル順)に並べて整数IDを振り、親・付与親・軸・IKリンク等を配列で保持する
+# 毎フレームの処理でボーン名の辞書を引いたり、ボーン名の文字列判定をしないで済むようにする
+class PmxSkeleton():
+    def __init__(self, model):
+        # 生成元のボーン辞書の更新バージョン
+        self.version = model.bones.version
+        # 親から順のボーン名
+        self.names = self.sort_bone_names(model)
+        # ボーン名：ID
+        self.ids = {bone_name: bidx for bidx, bone_name in enumerate(self.names)}
+
+        bones = [model.bones[bone_name] for bone_name in self.names]
+
+        # PMX上のボーンINDEX
+        self.bone_indexes = np.array([bone.index for bone in bones], dtype=np.int64)
+        # 親ボーンのID(親がない場合、-1)
+        self.parent_ids = np.array([self.ids.get(self.get_parent_name(model, bone), -1) for bone in bones], dtype=np.int64)
+        # ボーン位置
+        self.positions = np.array([bone.position.data() for bone in bones], dtype=np.float64).reshape(-1, 3)
+        # 親ボーンからの相対位置(親がない場合、ボーン位置)
+        self.offsets = self.positions - np.where(self.parent_ids[:, np.newaxis] >= 0, self.positions[self.parent_ids], 0)
+        # ローカルX軸(PmxModel.get_local_x_axisと同じ)
+        self.local_x_axes = self.calc_local_x_axes(model, bones)
+        # ボーンに設定されているローカル軸
+        self.local_x_vectors = np.array([bone.local_x_vector.data() for bone in bones], dtype=np.float64).reshape(-1, 3)
+        self.local_z_vectors = np.array([bone.local_z_vector.data() for bone in bones], dtype=np.float64).reshape(-1, 3)
+        # 軸制限
+        self.fixed_axes = np.array([bone.fixed_axis.data() for bone in bones], dtype=np.float64).reshape(-1, 3)
+        self.has_fixed_axes = np.any(self.fixed_axes != 0, axis=1)
+        # 左右どちらのボーンか(軸制限の回転補正用)
+        self.is_rights = np.array(["右" in bone_name for bone_name in self.names], dtype=np.bool_)
+        self.is_lefts = np.array(["左" in bone_name for bone_name in self.names], dtype=np.bool_)
+
+        # 回転付与親のID(回転付与がない場合、-1)
+        self.effect_ids = np.array([self.get_id_by_index(model, bone.effect_index) if bone.getExternalRotationFlag() else -1 for bone in bones], dtype=np.int64)
+        # 移動付与親のID(移動付与がない場合、-1)
+        self.effect_translation_ids = np.array([self.get_id_by_index(model, bone.effect_index) if bone.getExternalTranslationFlag() else -1 for bone in bones], dtype=np.int64)
+        # 付与率
+        self.effect_factors = np.array([bone.effect_factor for bone in bones], dtype=np.float64)
+        # 回転付与親を辿った平坦な一覧(effect_chain_starts[n]からeffect_chain_starts[n+1]の手前までが、n番目のボーンの付与親(近い方から))
+        # 付与率は、付与親から見た子ボーン(一つ手前)の付与率
+        effect_chains = [self.calc_effect_chain(bidx) for bidx in range(len(bones))]
+        self.effect_chain_starts = np.cumsum([0] + [len(effect_chain) for effect_chain in effect_chains]).astype(np.int64)
+        self.effect_chain_ids = np.array([effect_idx for effect_chain in effect_chains for effect_idx, _ in effect_chain], dtype=np.int64)
+        self.effect_chain_factors = np.array([effect_factor for effect_chain in effect_chains for _, effect_factor in effect_chain], dtype=np.float64)
+
+        # IKボーンのID
+        self.ik_ids = np.array([bidx for bidx, bone in enumerate(bones) if bone.getIkFlag() and bone.ik], dtype=np.int64)
+        ik_bones = [bones[bidx] for bidx in self.ik_ids]
+        # IKターゲットのID
+        self.ik_target_ids = np.array([self.get_id_by_index(model, bone.ik.target_index) for bone in ik_bones], dtype=np.int64)
+        # IKのループ回数と単位角
+        self.ik_loops = np.array([bone.ik.loop for bone in ik_bones], dtype=np.int64)
+        self.ik_limit_radians = np.array([bone.ik.limit_radian for bone in ik_bones], dtype=np.float64)
+        # IKリンク(ik_link_starts[n]からik_link_starts[n+1]の手前までが、n番目のIKのリンク)
+        ik_links = [link for bone in ik_bones for link in bone.ik.link]
+        self.ik_link_starts = np.cumsum([0] + [len(bone.ik.link) for bone in ik_bones]).astype(np.int64)
+        self.ik_link_ids = np.array([self.get_id_by_index(model, link.bone_index) for link in ik_links], dtype=np.int64)
+        self.ik_link_limit_flags = np.array([link.limit_angle == 1 for link in ik_links], dtype=np.bool_)
+        self.ik_link_limit_mins = np.array([link.limit_min.data() for link in ik_links], dtype=np.float64).reshape(-1, 3)
+        self.ik_link_limit_maxs = np.array([link.limit_max.data() for link in ik_links], dtype=np.float64).reshape(-1, 3)
+
+        for arr in [self.bone_indexes, self.parent_ids, self.positions, self.offsets, self.local_x_axes, self.local_x_vectors, self.local_z_vectors,
+                    self.fixed_axes, self.has_fixed_axes, self.is_rights, self.is_lefts, self.effect_ids, self.effect_translation_ids, self.effect_factors,
+                    self.effect_chain_starts, self.effect_chain_ids, self.effect_chain_factors,
+                    self.ik_ids, self.ik_target_ids, self.ik_loops, self.ik_limit_radians, self.ik_link_starts, self.ik_link_ids,
+                    self.ik_link_limit_flags, self.ik_link_limit_mins, self.ik_link_limit_maxs]:
+            # 各処理で共有するので、書き換え不可
+            arr.flags.writeable = False
+
+    def size(self):
+        return len(self.names)
+
+    # ボーン名のID(ない場合、-1)
+    def index(self, bone_name: str):
+        return self.ids.get(bone_name, -1)
+
+    # ボーンリンクのID配列(リンクの順番)
+    def get_link_ids(self, links: BoneLinks):
+        return np.array([self.index(lname) for lname in links.all().keys()], dtype=np.int64)
+
+    # 指定ボーンから親を辿った、一番親からのID配列
+    def get_parent_ids(self, bone_name: str):
+        bidx = self.index(bone_name)
+        parent_ids = []
+        while bidx >= 0:
+            parent_ids.append(bidx)
+            bidx = self.parent_ids[bidx]
+
+        return np.array(parent_ids[::-1], dtype=np.int64)
+
+    # 指定IKボーンのリンクID配列(IKターゲットに近い方から)
+    def get_ik_link_ids(self, bone_name: str):
+        ik_idxs = np.flatnonzero(self.ik_ids == self.index(bone_name))
+        if len(ik_idxs) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        return self.ik_link_ids[self.ik_link_starts[ik_idxs[0]]:self.ik_link_starts[ik_idxs[0] + 1]]
+
+    # 指定ボーンの回転付与親を辿ったID配列(付与親に近い方から)
+    def get_effect_ids(self, bone_name: str):
+        return self.get_effect_chain(bone_name)[0]
+
+    # 指定ボーンの回転付与親を辿ったID配列と、それぞれの付与率の配列(付与親に近い方から)
+    def get_effect_chain(self, bone_name: str):
+        bidx = self.index(bone_name)
+        if bidx < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        return self.effect_chain_ids[self.effect_chain_starts[bidx]:self.effect_chain_starts[bidx + 1]], \
+            self.effect_chain_factors[self.effect_chain_starts[bidx]:self.effect_chain_starts[bidx + 1]]
+
+    # 回転付与親を辿った(ID, 付与率)のリスト(最大100段)
+    def calc_effect_chain(self, bidx: int):
+        effect_chain = []
+        effect_parent_idx = bidx
+        effect_idx = self.effect_ids[bidx]
+
+        while effect_idx >= 0 and len(effect_chain) < 100:
+            effect_chain.append((effect_idx, self.effect_factors[effect_parent_idx]))
+            effect_parent_idx = effect_idx
+            effect_idx = self.effect_ids[effect_idx]
+
+        return effect_chain
+
+    # ローカルX軸
+    def get_local_x_axis(self, bone_name: str):
+        bidx = self.index(bone_name)
+        if bidx < 0:
+            return MVector3D()
+
+        return MVector3D(self.local_x_axes[bidx])
+
+    # PMX上のボーンINDEXのID(ない場合、-1)
+    def get_id_by_index(self, model, bone_index: int):
+        if bone_index not in model.bone_indexes:
+            return -1
+
+        return self.index(model.bone_indexes[bone_index])
+
+    # 親ボーン名(親がない場合、None)
+    @classmethod
+    def get_parent_name(cls, model, bone: Bone):
+        if bone.parent_index >= 0 and bone.parent_index in model.bone_indexes and model.bone_indexes[bone.parent_index] != bone.name:
+            return model.bone_indexes[bone.parent_index]
+
+        return None
+
+    # 親が先になるように並べたボーン名リスト(それ以外はモデルの登録順)
+    @classmethod
+    def sort_bone_names(cls, model):
+        bone_names = []
+        visited = set()
+
+        for bone_name in model.bones.keys():
+            # まだ登録されていない親を辿る(循環している場合、そこで打ち切る)
+            parent_names = []
+            pname = bone_name
+            while pname and pname in model.bones and pname not in visited and pname not in parent_names:
+                parent_names.append(pname)
+                pname = cls.get_parent_name(model, model.bones[pname])
+
+            for pname in reversed(parent_names):
+                visited.add(pname)
+                bone_names.append(pname)
+
+        return bone_names
+
+    # ローカルX軸の配列(子ボーンの検索は、親INDEX毎にまとめておく)
+    @classmethod
+    def calc_local_x_axes(cls, model, bones: list):
+        child_bones = {}
+        for b in model.bones.values():
+            child_bones.setdefault(b.parent_index, []).append(b)
+
+        local_x_axes = np.zeros((len(bones), 3), dtype=np.float64)
+
+        for bidx, bone in enumerate(bones):
+            to_pos = MVector3D()
+
+            if bone.fixed_axis != MVector3D():
+                # 軸制限がある場合、親からの向きを保持
+                local_x_axes[bidx] = bone.fixed_axis.normalized().data()
+                continue
+
+            from_pos = bone.position
+            if bone.tail_position != MVector3D():
+                # 表示先が相対パスの場合、保持
+                to_pos = from_pos + bone.tail_position
+            elif bone.tail_index >= 0 and bone.tail_index in model.bone_indexes and model.bones[model.bone_indexes[bone.tail_index]].position != bone.position:
+                # 表示先が指定されているの場合、保持
+                to_pos = model.bones[model.bone_indexes[bone.tail_index]].position
+            else:
+                # 表示先がない場合、とりあえず子ボーンのどれかを選択
+                for b in child_bones.get(bone.index, []):
+                    if b.index in model.bone_indexes and model.bones[model.bone_indexes[b.index]].position != bone.position:
+                        to_pos = model.bones[model.bone_indexes[b.index]].position
+                        break
+
+            # 軸制限の指定が無い場合、子の方向
+            local_x_axes[bidx] = (to_pos - from_pos).normalized().data()
+
+        return local_x_axes
+
+
+# モデル構造-----------------------
 class PmxModel():
     def __init__(self):
         self.path = ''
@@ -892,7 +1178,7 @@ class PmxModel():
         # 材質データ（キー：材質INDEX、値：材質名）
         self.material_indexes = {}
         # ボーンデータ
-        self.bones = {}
+        self.bones = PmxBoneDict()
         # ボーンINDEXデータ（キー：ボーンINDEX、値：ボーン名）
         self.bone_indexes = {}
         # モーフデータ(順番保持)
@@ -927,6 +1213,26 @@ class PmxModel():
         self.elbow_entity_vertex = {}
         # 左右ひじ手首中間頂点
         self.elbow_middle_entity_vertex = {}
+        # コンパイル済みボーン構造(get_skeletonで生成)
+        self.skeleton = None
+        # 読み込みを後回しにしたセクションの読み込み処理(キー：セクション名)
+        self.lazy_loaders = {}
+
+    # 読み込みを後回しにしたセクションを読み込む(未指定の場合、全セクション)
+    def load_sections(self, *section_names):
+        for section_name in (section_names or list(self.lazy_loaders.keys())):
+            if section_name in self.lazy_loaders:
+                self.lazy_loaders[section_name](self)
+                # 読み込めたセクションだけ、読み込み済みにする
+                del self.lazy_loaders[section_name]
+
+    # コンパイル済みボーン構造
+    # 初回に生成して保持する。ボーンの追加・削除・変更で更新バージョンが変わった場合は生成し直す
+    def get_skeleton(self):
+        if not self.skeleton or self.skeleton.version != self.bones.version:
+            self.skeleton = PmxSkeleton(self)
+
+        return self.skeleton
     
     # ローカルX軸の取得
     def get_local_x_axis(self, bone_name: str):
@@ -1,24 +1,55 @@
 # -*- coding: utf-8 -*-
 #
+import os
+import gc
+import copy
+import contextlib
+import functools
+import pickle
 import struct
-import hashlib
+import tempfile
 from collections import OrderedDict
 
+import numpy as np
+
 from mmd.PmxData import PmxModel, Vertex, Material, Bone, Morph, DisplaySlot, RigidBody, Joint
 from module.MMath import MRect, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
+from utils import MFileUtils
 from utils.MException import MParseException # noqa
 from utils.MLogger import MLogger # noqa
 from utils.MException import SizingException, MKilledException
 
 logger = MLogger(__name__, level=1)
 
+# 解析済みモデルのキャッシュ形式のバージョン(PmxModelの構造や、読み込み時に計算する値が変わったら上げる)
+PMX_CACHE_VERSION = 2
+PMX_CACHE_HEADER = b"PMXCACHE" + struct.pack("<I", PMX_CACHE_VERSION)
+PMX_CACHE_EXT = ".pmxc"
+# キャッシュディレクトリの上限サイズ(超えた分は最終使用日時が古いものから削除する)
+PMX_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# 頂点のデフォーム種別
+DEFORM_TYPES = {Vertex.Bdef1: 0, Vertex.Bdef2: 1, Vertex.Bdef4: 2, Vertex.Sdef: 3, Vertex.Qdef: 4}
+# 列形式で保持するモーフオフセット(モーフ種別: (オフセットクラス, 値の次元数))
+COLUMNAR_MORPH_TYPES = {1: (Morph.VertexMorphOffset, 3), 3: (Morph.UVMorphData, 4), 4: (Morph.UVMorphData, 4), 5: (Morph.UVMorphData, 4), \
+                        6: (Morph.UVMorphData, 4), 7: (Morph.UVMorphData, 4)}
+
 
 class PmxReader():
-    def __init__(self, file_path, is_check=True):
+    def __init__(self, file_path, is_check=True, cache_dir=None, cache_max_bytes=PMX_CACHE_MAX_BYTES, is_lazy=False):
         self.file_path = file_path
         self.is_check = is_check
+        # is_lazy: サイジングで使わないセクション(面・テクスチャ・材質・モーフオフセット・ジョイント)を、使う時まで読み込まない
+        self.is_lazy = is_lazy
+        # 後から読み込む時に、ファイルが変わっていないか確認するための状態
+        self.file_stat = None
+        # 解析済みモデルのキャッシュ先(未指定の場合、キャッシュしない)
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
         self.offset = 0
         self.buffer = None
+        self.digest = None
+        self.content_digest = None
         self.vertex_index_size = 0
         self.texture_index_size = 0
         self.material_index_size = 0
@@ -28,10 +59,9 @@ class PmxReader():
 
     def read_model_name(self):
         model_name = ""
-        with open(self.file_path, "rb") as f:
-            # PMXファイルをバイナリ読み込み
-            self.buffer = f.read()
-            # logger.test("hashlib.algorithms_available: %s", hashlib.algorithms_available)
+        # PMXファイルをメモリマップで開く(ヘッダ部分しか読み込まない)
+        with self.mapped_buffer(is_release=False):
+            self.offset = 0
 
             # pmx宣言
             signature = self.unpack(4, "4s")
@@ -96,15 +126,32 @@ class PmxReader():
         return model_name
 
     def read_data(self):
+        if not self.cache_dir:
+            return self.parse_data()
+
+        # 同じ内容のモデルを解析済みであれば、キャッシュから復元する
+        pmx = self.read_cache()
+        if pmx:
+            return pmx
+
+        pmx = self.parse_data()
+        if isinstance(pmx, PmxModel):
+            self.write_cache(pmx)
+
+        return pmx
+
+    def parse_data(self):
         # Pmxモデル生成
         pmx = PmxModel()
         pmx.path = self.file_path
 
         try:
-            # PMXファイルをバイナリ読み込み
-            with open(self.file_path, "rb") as f:
-                self.buffer = f.read()
-                # logger.test("hashlib.algorithms_available: %s", hashlib.algorithms_available)
+            # PMXファイルをメモリマップで開く(ハッシュ値も同じマップから計算し、読み込みが終わったら手放す)
+            with self.mapped_buffer():
+                self.offset = 0
+
+                if self.is_lazy:
+                    self.file_stat = MFileUtils.get_file_stat(self.file_path)
 
                 # pmx宣言
                 signature = self.unpack(4, "4s")
@@ -204,58 +251,20 @@ class PmxReader():
                 logger.test("vertices.keys: %s", pmx.vertices.keys())
                 logger.info("-- PMX 頂点読み込み完了")
 
-                # 面データリスト
-                for _ in range(self.read_int(4)):
-                    if self.vertex_index_size <= 2:
-                        # 頂点サイズが2以下の場合、符号なし
-                        pmx.indices.append(self.read_uint(self.vertex_index_size))
-                    else:
-                        pmx.indices.append(self.read_int(self.vertex_index_size))
-                logger.test("len(indices): %s", len(pmx.indices))
-                
-                logger.info("-- PMX 面読み込み完了")
-
-                # テクスチャデータリスト
-                for _ in range(self.read_int(4)):
-                    pmx.textures.append(self.read_text())
-                logger.test("len(textures): %s", len(pmx.textures))
-
-                logger.info("-- PMX テクスチャ読み込み完了")
-
-                # 材質データリスト
-                for material_idx in range(self.read_int(4)):
-                    material = Material(
-                        name=self.read_text(),
-                        english_name=self.read_text(),
-                        diffuse_color=self.read_RGB(),
-                        alpha=self.read_float(),
-                        specular_color=self.read_RGB(),
-                        specular_factor=self.read_float(),
-                        ambient_color=self.read_RGB(),
-                        flag=self.read_int(1),
-                        edge_color=self.read_RGBA(),
-                        edge_size=self.read_float(),
-                        texture_index=self.read_texture_index_size(),
-                        sphere_texture_index=self.read_texture_index_size(),
-                        sphere_mode=self.read_int(1),
-                        toon_sharing_flag=self.read_int(1)
-                    )
-                    material.index = material_idx
-
-                    if material.toon_sharing_flag == 0:
-                        material.toon_texture_index = self.read_texture_index_size()
-                    elif material.toon_sharing_flag == 1:
-                        material.toon_texture_index = self.read_int(1)
-                    else:
-                        raise MParseException("unknown toon_sharing_flag {0}".format(material.toon_sharing_flag))
-                    material.comment = self.read_text()
-                    material.vertex_count = self.read_int(4)
+                if self.is_lazy:
+                    # サイジングで使わないセクションは、位置だけ覚えて読み飛ばす
+                    self.defer_section(pmx, "indices", self.skip_indices)
+                    self.defer_section(pmx, "textures", self.skip_textures)
+                    self.defer_section(pmx, "materials", self.skip_materials)
+                else:
+                    self.read_indices(pmx)
+                    logger.info("-- PMX 面読み込み完了")
 
-                    pmx.materials[material.name] = material
-                    pmx.material_indexes[material.index] = material.name
-                logger.test("len(materials): %s", len(pmx.materials))
+                    self.read_textures(pmx)
+                    logger.info("-- PMX テクスチャ読み込み完了")
 
-                logger.info("-- PMX 材質読み込み完了")
+                    self.read_materials(pmx)
+                    logger.info("-- PMX 材質読み込み完了")
 
                 # サイジング用ルートボーン
                 sizing_root_bone = Bone("SIZING_ROOT_BONE", "SIZING_ROOT_BONE", MVector3D(), -1, 0, 0)
@@ -330,7 +339,7 @@ class PmxReader():
                         pmx.bones[bone.name] = bone
                         # インデックス逆引きも登録
                         pmx.bone_indexes[bone.index] = bone.name
-                
+            
                 # サイジング用ボーン ---------
                 # 頭頂ボーン
                 head_top_vertex = pmx.get_head_top_vertex()
@@ -371,7 +380,7 @@ class PmxReader():
                         right_sole_vertex = Vertex(-1, MVector3D(pmx.bones["右足先EX"].position.x(), 0, pmx.bones["右足先EX"].position.z()), MVector3D(), [], [], Vertex.Bdef1(-1), -1)
                     elif "右足ＩＫ" in pmx.bones:
                         right_sole_vertex = pmx.get_sole_vertex("右")
-                    
+                
                     if right_sole_vertex:
                         pmx.right_sole_vertex = right_sole_vertex
                         right_sole_bone = Bone("右足底実体", "right sole entity", right_sole_vertex.position.copy(), -1, 0, 0)
@@ -386,7 +395,7 @@ class PmxReader():
                         left_sole_vertex = Vertex(-1, MVector3D(pmx.bones["左足先EX"].position.x(), 0, pmx.bones["左足先EX"].position.z()), MVector3D(), [], [], Vertex.Bdef1(-1), -1)
                     elif "左足ＩＫ" in pmx.bones:
                         left_sole_vertex = pmx.get_sole_vertex("左")
-                    
+                
                     if left_sole_vertex:
                         pmx.left_sole_vertex = left_sole_vertex
                         left_sole_bone = Bone("左足底実体", "left sole entity", left_sole_vertex.position.copy(), -1, 0, 0)
@@ -575,6 +584,9 @@ class PmxReader():
                 morphs_by_panel[0] = []  # システム予約
 
                 # モーフデータリスト
+                if self.is_lazy:
+                    pmx.lazy_loaders["morph_offsets"] = self.create_section_loader("morph_offsets")
+
                 for morph_idx in range(self.read_int(4)):
                     morph = Morph(
                         name=self.read_text(),
@@ -585,35 +597,12 @@ class PmxReader():
 
                     offset_size = self.read_int(4)
 
-                    if morph.morph_type == 0:
-                        # group
-                        morph.offsets = [self.read_group_morph_data() for _ in range(offset_size)]
-                    elif morph.morph_type == 1:
-                        # vertex
-                        morph.offsets = [self.read_vertex_position_morph_offset() for _ in range(offset_size)]
-                    elif morph.morph_type == 2:
-                        # bone
-                        morph.offsets = [self.read_bone_morph_data() for _ in range(offset_size)]
-                    elif morph.morph_type == 3:
-                        # uv
-                        morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
-                    elif morph.morph_type == 4:
-                        # uv extended1
-                        morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
-                    elif morph.morph_type == 5:
-                        # uv extended2
-                        morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
-                    elif morph.morph_type == 6:
-                        # uv extended3
-                        morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
-                    elif morph.morph_type == 7:
-                        # uv extended4
-                        morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
-                    elif morph.morph_type == 8:
-                        # material
-                        morph.data = [self.read_material_morph_data() for _ in range(offset_size)]
+                    if self.is_lazy:
+                        # オフセットはモーフ合成でしか使わないので、位置だけ覚えて読み飛ばす(最初に参照した時に読み込む)
+                        morph.offsets_loader = self.create_morph_offsets_loader(offset_size)
+                        self.skip_morph_offset_data(morph.morph_type, offset_size)
                     else:
-                        raise MParseException("unknown morph type: {0}".format(morph.morph_type))
+                        self.read_morph_offset_data(morph, offset_size)
 
                     # モーフのINDEXは、先頭から順番に設定
                     morph.index = morph_idx
@@ -701,32 +690,16 @@ class PmxReader():
                 logger.info("-- PMX 剛体読み込み完了")
 
                 # ジョイントデータリスト
-                for joint_idx in range(self.read_int(4)):
-                    joint = Joint(
-                        name=self.read_text(),
-                        english_name=self.read_text(),
-                        joint_type=self.read_int(1),
-                        rigidbody_index_a=self.read_rigidbody_index_size(),
-                        rigidbody_index_b=self.read_rigidbody_index_size(),
-                        position=self.read_Vector3D(),
-                        rotation=self.read_Vector3D(),
-                        translation_limit_min=self.read_Vector3D(),
-                        translation_limit_max=self.read_Vector3D(),
-                        rotation_limit_min=self.read_Vector3D(),
-                        rotation_limit_max=self.read_Vector3D(),
-                        spring_constant_translation=self.read_Vector3D(),
-                        spring_constant_rotation=self.read_Vector3D()
-                    )
-
-                    pmx.joints[joint.name] = joint
-
-                logger.test("len(joints): %s", len(pmx.joints))
-
-                logger.info("-- PMX ジョイント読み込み完了")
+                if self.is_lazy:
+                    # 最後のセクションなので、位置だけ覚えて読まない
+                    pmx.lazy_loaders["joints"] = self.create_section_loader("joints")
+                else:
+                    self.read_joints(pmx)
+                    logger.info("-- PMX ジョイント読み込み完了")
 
-            # ハッシュを設定
-            pmx.digest = self.hexdigest()
-            logger.test("pmx: %s, hash: %s", pmx.name, pmx.digest)
+                # ハッシュを設定
+                pmx.digest = self.hexdigest()
+                logger.test("pmx: %s, hash: %s", pmx.name, pmx.digest)
 
             if self.is_check:
                 # 腕がサイジング可能かチェック
@@ -749,19 +722,252 @@ class PmxReader():
             logger.error("サイジング処理が意図せぬエラーで終了しました。\n\n%s", traceback.print_exc())
             raise e
 
+    # PMXファイルをメモリマップで開く(ハッシュ値の計算と読み込みで同じマップを使う)
+    def open_buffer(self):
+        if self.buffer is None:
+            self.buffer = MFileUtils.read_file_buffer(self.file_path)
+
+        return self.buffer
+
+    # ブロックの間、PMXファイルをメモリマップで開いておく
+    # is_release: ブロックを抜けたらマップを手放す(ヘッダだけを読む場合は、続けて読み込めるよう残しておく)
+    @contextlib.contextmanager
+    def mapped_buffer(self, is_release=True):
+        try:
+            yield self.open_buffer()
+        finally:
+            if is_release:
+                self.buffer = None
+
+    # ハッシュ値は、読み込みと同じマップから一度だけ計算する
     def hexdigest(self):
-        sha1 = hashlib.sha1()
+        if not self.digest:
+            self.content_digest, self.digest = MFileUtils.calc_digests(self.open_buffer(), self.file_path)
+
+        return self.digest
 
-        with open(self.file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(2048 * sha1.block_size), b''):
-                sha1.update(chunk)
+    # ファイルパスを含めない、内容だけのハッシュ値
+    def content_hexdigest(self):
+        if not self.content_digest:
+            self.hexdigest()
 
-        sha1.update(chunk)
+        return self.content_digest
 
-        # ファイルパスをハッシュに含める
-        sha1.update(self.file_path.encode('utf-8'))
+    # キャッシュファイルのパス(チェック有無で派生値が、遅延読み込み有無で読み込むセクションが変わるので、別々に保持する)
+    # 同じ内容のモデルは置き場所が違っても同じキャッシュを使う
+    def get_cache_path(self):
+        return os.path.join(self.cache_dir, "{0}_{1}{2}{3}".format(self.content_hexdigest(), int(self.is_check), int(self.is_lazy), PMX_CACHE_EXT))
 
-        return sha1.hexdigest()
+    # キャッシュからモデルを復元する(キャッシュがない・読めない場合はNone)
+    def read_cache(self):
+        if self.is_lazy:
+            # 後から読み込む時の確認用に、ハッシュ値を計算する前の状態を覚えておく
+            self.file_stat = MFileUtils.get_file_stat(self.file_path)
+
+        cache_path = self.get_cache_path()
+
+        try:
+            with open(cache_path, "rb") as f:
+                if f.read(len(PMX_CACHE_HEADER)) != PMX_CACHE_HEADER:
+                    raise MParseException("PMXキャッシュのバージョン不一致: {0}".format(cache_path))
+
+                payload = pickle.load(f)
+
+            pmx = payload["model"]
+            pmx.path = self.file_path
+            pmx.digest = self.hexdigest()
+            self.decode_vertices(pmx, payload["vertices"])
+            self.decode_morph_offsets(pmx, payload["morph_offsets"])
+
+            # キャッシュ作成時のファイルの場所・状態ではなく、今読み込んでいるファイルから後読みする
+            for section_name, loader in pmx.lazy_loaders.items():
+                pmx.lazy_loaders[section_name] = self.create_section_loader(section_name, offset=loader.args[-1])
+            for morph in pmx.morphs.values():
+                if morph.offsets_loader:
+                    morph.offsets_loader = self.create_morph_offsets_loader(*morph.offsets_loader.args[-2:])
+
+            # 最終使用日時を更新する(削除対象の判定に使う)
+            os.utime(cache_path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # 壊れた・古い形式のキャッシュは削除して、読み込み直す
+            logger.debug("PMXキャッシュ破棄: %s", cache_path)
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+            return None
+
+        # キャッシュから復元できたので、マップは不要
+        self.buffer = None
+
+        logger.info("-- PMX キャッシュ読み込み完了")
+
+        return pmx
+
+    # 解析済みのモデルをキャッシュに保存する
+    def write_cache(self, pmx: PmxModel):
+        cache_path = self.get_cache_path()
+
+        # 頂点とモーフオフセットは列形式にして、それ以外はそのまま保存する
+        model = copy.copy(pmx)
+        model.vertices = {}
+        model.skeleton = None
+        model.morphs = OrderedDict((morph_name, copy.copy(morph)) for morph_name, morph in pmx.morphs.items())
+        for morph in model.morphs.values():
+            if morph.morph_type in COLUMNAR_MORPH_TYPES and not morph.offsets_loader:
+                morph.offsets = []
+
+        payload = {"model": model, "vertices": self.encode_vertices(pmx), "morph_offsets": self.encode_morph_offsets(pmx)}
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # 並行して読み込む他のプロセスが書きかけのファイルを読まないよう、一時ファイルから置き換える
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(PMX_CACHE_HEADER)
+                    pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_path)
+            except Exception as e:
+                os.remove(tmp_path)
+                raise e
+
+            self.evict_cache()
+        except Exception:
+            # キャッシュに書けなくても、読み込み自体は成功しているので続行する
+            logger.warning("PMXキャッシュの保存に失敗しました。 %s", cache_path)
+
+    # キャッシュディレクトリが上限サイズを超えていたら、最終使用日時が古いものから削除する
+    def evict_cache(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(PMX_CACHE_EXT):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_size = sum([size for _, size, _ in entries])
+        for _, size, cache_path in sorted(entries):
+            if total_size <= self.cache_max_bytes:
+                break
+
+            try:
+                os.remove(cache_path)
+            except OSError:
+                # 他のプロセスが削除済み
+                pass
+            total_size -= size
+
+    # 頂点を頂点INDEX順の列にまとめる(元データが4byte小数なので、float32で欠落なく保持できる)
+    def encode_vertices(self, pmx: PmxModel):
+        # 同じ頂点が複数のボーンのリストに入っているので、重複を除く
+        vertices = sorted({v.index: v for vs in pmx.vertices.values() for v in vs}.values(), key=lambda v: v.index)
+        vertex_cnt = len(vertices)
+        extended_uv_cnt = len(vertices[0].extended_uvs) if vertex_cnt > 0 else 0
+
+        deform_indexes = np.full((vertex_cnt, 4), -1, dtype=np.int32)
+        deform_weights = np.zeros((vertex_cnt, 4), dtype=np.float32)
+        # SDEF・QDEFのパラメータは、該当する頂点の分だけ保持する
+        sdef_indexes = []
+        sdefs = []
+        for vidx, v in enumerate(vertices):
+            deform = v.deform
+            idx_list = deform.get_idx_list()
+            deform_indexes[vidx, :len(idx_list)] = idx_list
+
+            if isinstance(deform, Vertex.Bdef4):
+                deform_weights[vidx] = [deform.weight0, deform.weight1, deform.weight2, deform.weight3]
+            elif not isinstance(deform, Vertex.Bdef1):
+                deform_weights[vidx, 0] = deform.weight0
+
+            if isinstance(deform, (Vertex.Sdef, Vertex.Qdef)):
+                sdef_indexes.append(vidx)
+                sdefs.append([deform.sdef_c.data(), deform.sdef_r0.data(), deform.sdef_r1.data()])
+
+        return {
+            "index": np.array([v.index for v in vertices], dtype=np.int32),
+            "position": np.array([v.position.data() for v in vertices], dtype=np.float32).reshape(vertex_cnt, 3),
+            "normal": np.array([v.normal.data() for v in vertices], dtype=np.float32).reshape(vertex_cnt, 3),
+            "uv": np.array([v.uv for v in vertices], dtype=np.float32).reshape(vertex_cnt, 2),
+            "extended_uv": np.array([[uv.data() for uv in v.extended_uvs] for v in vertices], dtype=np.float32).reshape(vertex_cnt, extended_uv_cnt, 4),
+            "deform_type": np.array([DEFORM_TYPES[type(v.deform)] for v in vertices], dtype=np.int8),
+            "deform_index": deform_indexes,
+            "deform_weight": deform_weights,
+            "sdef_index": np.array(sdef_indexes, dtype=np.int32),
+            "sdef": np.array(sdefs, dtype=np.float32).reshape(len(sdefs), 3, 3),
+            "edge_factor": np.array([v.edge_factor for v in vertices], dtype=np.float32),
+        }
+
+    # 列から頂点を復元して、読み込み時と同じくウェイトボーンごとに分けて保持する
+    def decode_vertices(self, pmx: PmxModel, columns: dict):
+        # ベクトルは頂点毎に配列を作らず、まとめた配列の行を共有する
+        positions = list(columns["position"].astype(np.float64))
+        normals = list(columns["normal"].astype(np.float64))
+        extended_uvs = list(columns["extended_uv"].astype(np.float64))
+        sdefs = dict(zip(columns["sdef_index"].tolist(), columns["sdef"].astype(np.float64)))
+        uvs = columns["uv"].astype(np.float64).tolist()
+        edge_factors = columns["edge_factor"].astype(np.float64).tolist()
+        deform_types = columns["deform_type"].tolist()
+        deform_indexes = columns["deform_index"].tolist()
+        deform_weights = columns["deform_weight"].astype(np.float64).tolist()
+
+        # 大量のオブジェクトを一度に生成するので、その間はGCを止める
+        is_gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            for vidx, vertex_idx in enumerate(columns["index"].tolist()):
+                deform_type = deform_types[vidx]
+                idxs = deform_indexes[vidx]
+                weights = deform_weights[vidx]
+
+                if deform_type == 0:
+                    deform = Vertex.Bdef1(idxs[0])
+                elif deform_type == 1:
+                    deform = Vertex.Bdef2(idxs[0], idxs[1], weights[0])
+                elif deform_type == 2:
+                    deform = Vertex.Bdef4(idxs[0], idxs[1], idxs[2], idxs[3], weights[0], weights[1], weights[2], weights[3])
+                else:
+                    sdef = sdefs[vidx]
+                    deform = (Vertex.Sdef if deform_type == 3 else Vertex.Qdef)(idxs[0], idxs[1], weights[0], \
+                                                                                MVector3D.fromBuffer(sdef[0]), MVector3D.fromBuffer(sdef[1]), MVector3D.fromBuffer(sdef[2]))
+
+                vertex = Vertex(vertex_idx, MVector3D.fromBuffer(positions[vidx]), MVector3D.fromBuffer(normals[vidx]), uvs[vidx], \
+                                [MVector4D.fromBuffer(uv) for uv in extended_uvs[vidx]], deform, edge_factors[vidx])
+                for bone_idx in deform.get_idx_list():
+                    if bone_idx not in pmx.vertices:
+                        pmx.vertices[bone_idx] = []
+                    pmx.vertices[bone_idx].append(vertex)
+        finally:
+            if is_gc_enabled:
+                gc.enable()
+
+    # 頂点・UVモーフのオフセットを、モーフ毎の列にまとめる
+    def encode_morph_offsets(self, pmx: PmxModel):
+        morph_offsets = {}
+        for morph_name, morph in pmx.morphs.items():
+            # 読み込みを後回しにしているモーフは、キャッシュからも後読みする
+            if morph.morph_type in COLUMNAR_MORPH_TYPES and not morph.offsets_loader:
+                _, dim = COLUMNAR_MORPH_TYPES[morph.morph_type]
+                if morph.morph_type == 1:
+                    values = [offset.position_offset.data() for offset in morph.offsets]
+                else:
+                    values = [offset.uv.data() for offset in morph.offsets]
+
+                morph_offsets[morph_name] = (np.array([offset.vertex_index for offset in morph.offsets], dtype=np.int32), \
+                                             np.array(values, dtype=np.float32).reshape(len(values), dim))
+
+        return morph_offsets
+
+    # 列からモーフのオフセットを復元する
+    def decode_morph_offsets(self, pmx: PmxModel, morph_offsets: dict):
+        for morph_name, (vertex_indexes, values) in morph_offsets.items():
+            morph = pmx.morphs[morph_name]
+            offset_class, dim = COLUMNAR_MORPH_TYPES[morph.morph_type]
+            vector_class = MVector3D if dim == 3 else MVector4D
+            morph.offsets = [offset_class(vertex_idx, vector_class.fromBuffer(value)) for vertex_idx, value in zip(vertex_indexes.tolist(), values.astype(np.float64))]
 
     def calc_bone_length(self, bones, bone_indexes):
         for k, v in bones.items():
@@ -816,6 +1022,221 @@ class PmxReader():
 
                     logger.test("bone: %s, len_3d: %s", v.name, v.len_3d)
 
+    # 読み込みを後回しにするセクションの位置を覚えて、読み飛ばす
+    def defer_section(self, pmx: PmxModel, section_name: str, skip_section):
+        pmx.lazy_loaders[section_name] = self.create_section_loader(section_name)
+        skip_section()
+
+    # 現在位置のセクションを後から読み込む処理(プロセス間で受け渡せるよう、ファイルの場所と状態だけを持つ)
+    # offset: セクションの開始位置(未指定の場合、現在位置)
+    def create_section_loader(self, section_name: str, offset=None):
+        return functools.partial(PmxReader.load_section, self.file_path, self.file_stat, section_name, (self.offset if offset is None else offset))
+
+    # 現在位置のモーフオフセットを後から読み込む処理(セクションと同じく、ファイルの場所と状態だけを持つ)
+    def create_morph_offsets_loader(self, offset_size: int, offset=None):
+        return functools.partial(PmxReader.load_morph_offsets, self.file_path, self.file_stat, offset_size, (self.offset if offset is None else offset))
+
+    # 読み込みを後回しにしたモーフオフセットを、ファイルから読み込む
+    @classmethod
+    def load_morph_offsets(cls, file_path, file_stat, offset_size, offset, morph: Morph):
+        if MFileUtils.get_file_stat(file_path) != file_stat:
+            raise MParseException("PMXファイルが読み込み後に変更されています。 {0}".format(file_path))
+
+        reader = cls(file_path)
+        reader.read_model_name()
+        reader.offset = offset
+        reader.read_morph_offset_data(morph, offset_size)
+        reader.buffer = None
+
+    # 読み込みを後回しにしたセクションを、ファイルから読み込む
+    @classmethod
+    def load_section(cls, file_path, file_stat, section_name, offset, pmx: PmxModel):
+        if MFileUtils.get_file_stat(file_path) != file_stat:
+            raise MParseException("PMXファイルが読み込み後に変更されています。 {0}".format(file_path))
+
+        reader = cls(file_path)
+        # ヘッダからIndexサイズとエンコード方式を取得して、セクションの位置から読み込む
+        reader.read_model_name()
+        reader.offset = offset
+        getattr(reader, "read_{0}".format(section_name))(pmx)
+        reader.buffer = None
+
+    # 面データリスト
+    def read_indices(self, pmx: PmxModel):
+        for _ in range(self.read_int(4)):
+            if self.vertex_index_size <= 2:
+                # 頂点サイズが2以下の場合、符号なし
+                pmx.indices.append(self.read_uint(self.vertex_index_size))
+            else:
+                pmx.indices.append(self.read_int(self.vertex_index_size))
+        logger.test("len(indices): %s", len(pmx.indices))
+
+    def skip_indices(self):
+        indices_cnt = self.read_int(4)
+        self.offset += indices_cnt * self.vertex_index_size
+
+    # テクスチャデータリスト
+    def read_textures(self, pmx: PmxModel):
+        for _ in range(self.read_int(4)):
+            pmx.textures.append(self.read_text())
+        logger.test("len(textures): %s", len(pmx.textures))
+
+    def skip_textures(self):
+        for _ in range(self.read_int(4)):
+            self.skip_text()
+
+    # 材質データリスト
+    def read_materials(self, pmx: PmxModel):
+        for material_idx in range(self.read_int(4)):
+            material = Material(
+                name=self.read_text(),
+                english_name=self.read_text(),
+                diffuse_color=self.read_RGB(),
+                alpha=self.read_float(),
+                specular_color=self.read_RGB(),
+                specular_factor=self.read_float(),
+                ambient_color=self.read_RGB(),
+                flag=self.read_int(1),
+                edge_color=self.read_RGBA(),
+                edge_size=self.read_float(),
+                texture_index=self.read_texture_index_size(),
+                sphere_texture_index=self.read_texture_index_size(),
+                sphere_mode=self.read_int(1),
+                toon_sharing_flag=self.read_int(1)
+            )
+            material.index = material_idx
+
+            if material.toon_sharing_flag == 0:
+                material.toon_texture_index = self.read_texture_index_size()
+            elif material.toon_sharing_flag == 1:
+                material.toon_texture_index = self.read_int(1)
+            else:
+                raise MParseException("unknown toon_sharing_flag {0}".format(material.toon_sharing_flag))
+            material.comment = self.read_text()
+            material.vertex_count = self.read_int(4)
+
+            pmx.materials[material.name] = material
+            pmx.material_indexes[material.index] = material.name
+        logger.test("len(materials): %s", len(pmx.materials))
+
+    def skip_materials(self):
+        for _ in range(self.read_int(4)):
+            # 材質名
+            self.skip_text()
+            self.skip_text()
+            # 色(RGB, A, RGB, 係数, RGB)・描画フラグ・エッジ色(RGBA)・エッジサイズ
+            self.offset += 65
+            # テクスチャIndex・スフィアテクスチャIndex・スフィアモード
+            self.offset += self.texture_index_size * 2 + 1
+
+            toon_sharing_flag = self.read_int(1)
+            if toon_sharing_flag == 0:
+                self.offset += self.texture_index_size
+            elif toon_sharing_flag == 1:
+                self.offset += 1
+            else:
+                raise MParseException("unknown toon_sharing_flag {0}".format(toon_sharing_flag))
+
+            # メモ・面数
+            self.skip_text()
+            self.offset += 4
+
+    # モーフデータリストから、オフセットだけを読み込む
+    def read_morph_offsets(self, pmx: PmxModel):
+        morphs_by_index = {morph.index: morph for morph in pmx.morphs.values()}
+
+        for morph_idx in range(self.read_int(4)):
+            # モーフ名・パネル
+            self.skip_text()
+            self.skip_text()
+            self.offset += 1
+
+            morph_type = self.read_int(1)
+            offset_size = self.read_int(4)
+
+            if morph_idx in morphs_by_index:
+                self.read_morph_offset_data(morphs_by_index[morph_idx], offset_size)
+            else:
+                # 同じ名前のモーフが後ろにあって、登録されなかったモーフ
+                self.skip_morph_offset_data(morph_type, offset_size)
+
+    # モーフ1件分のオフセット
+    def read_morph_offset_data(self, morph: Morph, offset_size: int):
+        if morph.morph_type == 0:
+            # group
+            morph.offsets = [self.read_group_morph_data() for _ in range(offset_size)]
+        elif morph.morph_type == 1:
+            # vertex
+            morph.offsets = [self.read_vertex_position_morph_offset() for _ in range(offset_size)]
+        elif morph.morph_type == 2:
+            # bone
+            morph.offsets = [self.read_bone_morph_data() for _ in range(offset_size)]
+        elif morph.morph_type == 3:
+            # uv
+            morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
+        elif morph.morph_type == 4:
+            # uv extended1
+            morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
+        elif morph.morph_type == 5:
+            # uv extended2
+            morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
+        elif morph.morph_type == 6:
+            # uv extended3
+            morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
+        elif morph.morph_type == 7:
+            # uv extended4
+            morph.offsets = [self.read_uv_morph_data() for _ in range(offset_size)]
+        elif morph.morph_type == 8:
+            # material
+            morph.data = [self.read_material_morph_data() for _ in range(offset_size)]
+        else:
+            raise MParseException("unknown morph type: {0}".format(morph.morph_type))
+
+    # モーフ1件分のオフセットを読み飛ばす(種別毎に固定長)
+    def skip_morph_offset_data(self, morph_type: int, offset_size: int):
+        if morph_type == 0:
+            # group
+            record_size = self.morph_index_size + 4
+        elif morph_type == 1:
+            # vertex
+            record_size = self.vertex_index_size + 12
+        elif morph_type == 2:
+            # bone
+            record_size = self.bone_index_size + 12 + 16
+        elif 3 <= morph_type <= 7:
+            # uv, uv extended1～4
+            record_size = self.vertex_index_size + 16
+        elif morph_type == 8:
+            # material
+            record_size = self.material_index_size + 1 + 16 + 12 + 4 + 12 + 16 + 4 + 16 + 16 + 16
+        else:
+            raise MParseException("unknown morph type: {0}".format(morph_type))
+
+        self.offset += record_size * offset_size
+
+    # ジョイントデータリスト
+    def read_joints(self, pmx: PmxModel):
+        for joint_idx in range(self.read_int(4)):
+            joint = Joint(
+                name=self.read_text(),
+                english_name=self.read_text(),
+                joint_type=self.read_int(1),
+                rigidbody_index_a=self.read_rigidbody_index_size(),
+                rigidbody_index_b=self.read_rigidbody_index_size(),
+                position=self.read_Vector3D(),
+                rotation=self.read_Vector3D(),
+                translation_limit_min=self.read_Vector3D(),
+                translation_limit_max=self.read_Vector3D(),
+                rotation_limit_min=self.read_Vector3D(),
+                rotation_limit_max=self.read_Vector3D(),
+                spring_constant_translation=self.read_Vector3D(),
+                spring_constant_rotation=self.read_Vector3D()
+            )
+
+            pmx.joints[joint.name] = joint
+
+        logger.test("len(joints): %s", len(pmx.joints))
+
     def read_group_morph_data(self):
         return Morph.GroupMorphData(
             self.read_morph_index_size(),
@@ -925,6 +1346,11 @@ class PmxReader():
         else:
             raise MParseException("unknown deform_type: {0}".format(deform_type))
 
+    # 文字列を読み飛ばす
+    def skip_text(self):
+        format_size = self.read_int(4)
+        self.offset += format_size
+
     # 文字列の解凍（エンコーディングに基づく）
     def define_read_text(self, text_encoding):
         if text_encoding == 0:
@@ -1,37 +1,198 @@
 # -*- coding: utf-8 -*-
 #
+import bisect
+import itertools
 import math
 import numpy as np
 import struct
+import threading
 import _pickle as cPickle
+from collections.abc import MutableMapping
+from multiprocessing import shared_memory
 
 from module.OneEuroFilter import OneEuroFilter
-from module.MMath import MRect, MVector2D, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
+from module.MMath import MRect, MVector2D, MVector3D, MVector4D, MQuaternion, MQuaternionArray, MVector3DArray, MMatrix4x4 # noqa
 from utils import MBezierUtils # noqa
 from utils.MLogger import MLogger
 
 logger = MLogger(__name__, level=1)
 
+# ボーンキーフレの初期補間曲線（線形）
+DEFAULT_BONE_INTERPOLATION = [20, 20, 0, 0, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 20, 20, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 20, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 0, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 0, 0] # noqa
+
+DEFAULT_BONE_INTERPOLATION_TUPLE = tuple(DEFAULT_BONE_INTERPOLATION)
+
+# サイジング用に追加するボーン(VMDには出力しない)
+SIZING_BONE_NAMES = ["SIZING_ROOT_BONE", "頭頂", "右つま先実体", "左つま先実体", "右足底辺", "左足底辺", "右足底実体", "左足底実体", "右足ＩＫ底実体", "左足ＩＫ底実体", "右足IK親底実体", "左足IK親底実体", \
+                     "首根元", "右腕下延長", "左腕下延長", "右腕垂直", "左腕垂直", "センター実体", "左腕ひじ中間", "右腕ひじ中間", "左ひじ手首中間", "右ひじ手首中間", "左手首実体", "右手首実体"]
+
+# キーフレ辞書の更新バージョン(全辞書で一意に採番する)
+VERSION_COUNTER = itertools.count(1)
+
+# VmdBoneTrackの配列(配列名, 1行の形, 型)
+BONE_TRACK_ARRAYS = [("fnos", (), np.int64), ("positions", (3,), np.float64), ("rotations", (4,), np.float64), \
+                     ("org_positions", (3,), np.float64), ("org_rotations", (4,), np.float64), ("interpolations", (64,), np.uint8), \
+                     ("org_interpolations", (64,), np.uint8), ("key_flags", (), np.bool_), ("read_flags", (), np.bool_)]
+
+
+# 補間曲線のインターン表(同じ補間曲線は一つのタプルを共有する)
+INTERPOLATION_INTERNS = {DEFAULT_BONE_INTERPOLATION_TUPLE: DEFAULT_BONE_INTERPOLATION_TUPLE}
+# インターンする補間曲線の上限数(分割等で補間曲線が増え続けた場合、それ以降は共有しない)
+INTERPOLATION_INTERN_MAX = 65536
+
+
+# 補間曲線を変更不可のタプルにして、同じ補間曲線は同じタプルを返す
+def intern_interpolation(interpolation):
+    if isinstance(interpolation, tuple):
+        interned = INTERPOLATION_INTERNS.get(interpolation)
+        if interned is not None:
+            return interned
+
+    interpolation = tuple([int(v) for v in interpolation])
+    if len(INTERPOLATION_INTERNS) < INTERPOLATION_INTERN_MAX:
+        return INTERPOLATION_INTERNS.setdefault(interpolation, interpolation)
+    return INTERPOLATION_INTERNS.get(interpolation, interpolation)
+
 
 class VmdBoneFrame():
+    # 大量に生成するので、インスタンス辞書を持たない
+    __slots__ = ("name", "bname", "fno", "_position", "_rotation", "_org_position", "_org_rotation", "_interpolation", "_org_interpolation", \
+                 "_key", "_read", "_avoidance", "owner")
 
     def __init__(self, fno=0):
+        # 登録先のキーフレ辞書(値を代入した時に、辞書の更新バージョンを進める)
+        self.owner = None
         self.name = ''
         self.bname = ''
         self.fno = fno
-        self.position = MVector3D()
-        self.rotation = MQuaternion()
-        self.org_position = MVector3D()
-        self.org_rotation = MQuaternion()
-        self.interpolation = [20, 20, 0, 0, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 20, 20, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 20, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 0, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 0, 0] # noqa
-        self.org_interpolation = [20, 20, 0, 0, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 20, 20, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 20, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 0, 20, 20, 20, 20, 20, 107, 107, 107, 107, 107, 107, 107, 107, 0, 0, 0] # noqa
+        self._position = MVector3D()
+        self._rotation = MQuaternion()
+        # オリジナルの位置・回転(値のタプルかNoneの場合、参照された時に生成する)
+        self._org_position = None
+        self._org_rotation = None
+        # 補間曲線(インターンしたタプル)
+        self._interpolation = DEFAULT_BONE_INTERPOLATION_TUPLE
+        self._org_interpolation = DEFAULT_BONE_INTERPOLATION_TUPLE
         # 登録対象であるか否か
-        self.key = False
+        self._key = False
         # VMD読み込み処理で読み込んだキーか
-        self.read = False
+        self._read = False
         # 接触回避の方向
-        self.avoidance = ""
-    
+        self._avoidance = ""
+
+    def __getstate__(self):
+        # 登録先の辞書は、辞書側で復元する時に設定し直す
+        return (None, {attr_name: getattr(self, attr_name) for attr_name in self.__slots__ if attr_name != "owner" and hasattr(self, attr_name)})
+
+    def __setstate__(self, state):
+        self.owner = None
+        dict_state, slot_state = state if isinstance(state, tuple) else (state, None)
+        for attr_name, value in list((dict_state or {}).items()) + list((slot_state or {}).items()):
+            setattr(self, attr_name, value)
+        # 別プロセスで復元した場合も補間曲線を共有するよう、インターンし直す
+        if slot_state and "_interpolation" in slot_state:
+            self._interpolation = intern_interpolation(self._interpolation)
+        if slot_state and "_org_interpolation" in slot_state:
+            self._org_interpolation = intern_interpolation(self._org_interpolation)
+
+    # 登録先の辞書の更新バージョンを進める
+    # 値を代入した場合は自動で呼ばれる。位置・回転をsetX等で直接変更した場合は、代入し直すか、これを呼ぶこと
+    def touch(self):
+        if self.owner is not None:
+            self.owner.touch()
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        self._position = position
+        self.touch()
+
+    @property
+    def rotation(self):
+        return self._rotation
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self._rotation = rotation
+        self.touch()
+
+    @property
+    def org_position(self):
+        if not isinstance(self._org_position, MVector3D):
+            self._org_position = MVector3D() if self._org_position is None else MVector3D(*self._org_position)
+        return self._org_position
+
+    @org_position.setter
+    def org_position(self, org_position):
+        self._org_position = org_position
+        self.touch()
+
+    @property
+    def org_rotation(self):
+        if not isinstance(self._org_rotation, MQuaternion):
+            self._org_rotation = MQuaternion() if self._org_rotation is None else MQuaternion(*self._org_rotation)
+        return self._org_rotation
+
+    @org_rotation.setter
+    def org_rotation(self, org_rotation):
+        self._org_rotation = org_rotation
+        self.touch()
+
+    # オリジナルの位置(x, y, z)・回転(scalar, x, y, z)を値で保持する
+    def set_org_values(self, position_values: tuple, rotation_values: tuple):
+        self._org_position = position_values
+        self._org_rotation = rotation_values
+        self.touch()
+
+    # 補間曲線は変更不可(変更する場合は、リストにしてから代入し直すこと)
+    @property
+    def interpolation(self):
+        return self._interpolation
+
+    @interpolation.setter
+    def interpolation(self, interpolation):
+        self._interpolation = intern_interpolation(interpolation)
+        self.touch()
+
+    @property
+    def org_interpolation(self):
+        return self._org_interpolation
+
+    @org_interpolation.setter
+    def org_interpolation(self, org_interpolation):
+        self._org_interpolation = intern_interpolation(org_interpolation)
+        self.touch()
+
+    @property
+    def key(self):
+        return self._key
+
+    @key.setter
+    def key(self, key):
+        self._key = key
+        self.touch()
+
+    @property
+    def read(self):
+        return self._read
+
+    @read.setter
+    def read(self, read):
+        self._read = read
+        self.touch()
+
+    @property
+    def avoidance(self):
+        return self._avoidance
+
+    @avoidance.setter
+    def avoidance(self, avoidance):
+        self._avoidance = avoidance
+        self.touch()
+
     def set_name(self, name):
         self.name = name
         self.bname = '' if not name else name.encode('cp932').decode('shift_jis').encode('shift_jis')[:15].ljust(15, b'\x00')
@@ -40,13 +201,15 @@ class VmdBoneFrame():
         bf = VmdBoneFrame(self.fno)
         bf.name = self.name
         bf.bname = self.bname
-        bf.position = self.position.copy()
-        bf.rotation = self.rotation.copy()
-        bf.org_position = self.org_position.copy()
-        bf.org_rotation = self.org_rotation.copy()
-        bf.interpolation = cPickle.loads(cPickle.dumps(self.interpolation, -1))
-        bf.key = self.key
-        bf.read = self.read
+        bf._position = self._position.copy()
+        bf._rotation = self._rotation.copy()
+        # 値のまま保持している場合は、生成せずにそのまま引き継ぐ
+        bf._org_position = self._org_position.copy() if isinstance(self._org_position, MVector3D) else self._org_position
+        bf._org_rotation = self._org_rotation.copy() if isinstance(self._org_rotation, MQuaternion) else self._org_rotation
+        bf._interpolation = self._interpolation
+        bf._org_interpolation = self._org_interpolation
+        bf._key = self._key
+        bf._read = self._read
 
         return bf
 
@@ -170,6 +333,738 @@ class VmdShowIkFrame():
             fout.write(struct.pack('b', k.onoff))
         
 
+# ボーン単位のキーフレ辞書(key:フレーム番号)
+# 登録・削除のたびにフレーム番号の昇順インデックス(fnos)を維持し、前後キーや範囲の検索を二分探索で行う
+class VmdBoneFrameDict(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fnos = sorted(super().keys())
+        # 登録先のボーン辞書(更新した時に、ボーン辞書の更新バージョンも進める)
+        self.owner = None
+        self.version = next(VERSION_COUNTER)
+        for bf in super().values():
+            self.adopt(bf)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def __setitem__(self, fno, bf):
+        if not super().__contains__(fno):
+            bisect.insort(self.fnos, fno)
+        super().__setitem__(fno, bf)
+        self.adopt(bf)
+        self.touch()
+
+    def __delitem__(self, fno):
+        super().__delitem__(fno)
+        del self.fnos[bisect.bisect_left(self.fnos, fno)]
+        self.touch()
+
+    def pop(self, fno, *args):
+        if super().__contains__(fno):
+            del self.fnos[bisect.bisect_left(self.fnos, fno)]
+            self.touch()
+        return super().pop(fno, *args)
+
+    def popitem(self):
+        fno, bf = super().popitem()
+        del self.fnos[bisect.bisect_left(self.fnos, fno)]
+        self.touch()
+        return fno, bf
+
+    def setdefault(self, fno, bf=None):
+        if not super().__contains__(fno):
+            self[fno] = bf
+        return super().__getitem__(fno)
+
+    def update(self, *args, **kwargs):
+        for fno, bf in dict(*args, **kwargs).items():
+            self[fno] = bf
+
+    def clear(self):
+        super().clear()
+        self.fnos = []
+        self.touch()
+
+    def copy(self):
+        return self.__class__(self)
+
+    # キーフレの登録先をこの辞書にする(キーフレへの代入で、この辞書の更新バージョンが進む)
+    def adopt(self, bf):
+        if isinstance(bf, VmdBoneFrame) and not isinstance(bf, VmdBoneFrameView):
+            bf.owner = self
+
+    # 更新バージョンを進める(登録先のボーン辞書の更新バージョンも進める)
+    def touch(self):
+        self.version = next(VERSION_COUNTER)
+        if self.owner is not None:
+            self.owner.touch()
+
+    # 指定範囲内のフレーム番号リスト(昇順)
+    def get_range_fnos(self, start_fno: int, end_fno: int):
+        return self.fnos[bisect.bisect_left(self.fnos, start_fno):bisect.bisect_right(self.fnos, end_fno)]
+
+    # 指定フレーム番号の直前と直後のフレーム番号(無い場合はNone)
+    # is_key: 登録対象のキーのみ
+    # is_read: データ読み込み時のキーのみ
+    def get_prev_next_fno(self, fno: int, is_key=False, is_read=False, start_fno=0, end_fno=9999999999):
+        pidx = bisect.bisect_left(self.fnos, fno) - 1
+        nidx = bisect.bisect_right(self.fnos, fno)
+
+        prev_fno = None
+        while pidx >= 0 and self.fnos[pidx] >= start_fno:
+            if self.is_match(self.fnos[pidx], is_key, is_read) and self.fnos[pidx] <= end_fno:
+                prev_fno = self.fnos[pidx]
+                break
+            pidx -= 1
+
+        next_fno = None
+        while nidx < len(self.fnos) and self.fnos[nidx] <= end_fno:
+            if self.is_match(self.fnos[nidx], is_key, is_read) and self.fnos[nidx] >= start_fno:
+                next_fno = self.fnos[nidx]
+                break
+            nidx += 1
+
+        return prev_fno, next_fno
+
+    # 指定フレーム番号のキーが条件に合致するか
+    def is_match(self, fno: int, is_key=False, is_read=False):
+        bf = super().__getitem__(fno)
+        return (not is_key or bf.key) and (not is_read or bf.read)
+
+
+# 列指向のボーントラック(key:フレーム番号)
+# キーフレをフレーム番号・位置・回転・補間曲線・フラグの配列でまとめて保持し、参照時はVmdBoneFrameViewを返す
+# VmdBoneFrameを個別に持たないので省メモリで、トラック全体をnumpyでまとめて計算できる
+class VmdBoneTrack(MutableMapping):
+    def __init__(self, name=''):
+        self.name = name
+        self.bname = '' if not name else name.encode('cp932').decode('shift_jis').encode('shift_jis')[:15].ljust(15, b'\x00')
+        # フレーム番号(昇順・重複なし)
+        self.fnos = np.zeros(0, dtype=np.int64)
+        # 位置(N×3)
+        self.positions = np.zeros((0, 3), dtype=np.float64)
+        # 回転(N×4: w, x, y, z)
+        self.rotations = np.zeros((0, 4), dtype=np.float64)
+        # オリジナルの位置・回転
+        self.org_positions = np.zeros((0, 3), dtype=np.float64)
+        self.org_rotations = np.zeros((0, 4), dtype=np.float64)
+        # 補間曲線(N×64)
+        self.interpolations = np.zeros((0, 64), dtype=np.uint8)
+        self.org_interpolations = np.zeros((0, 64), dtype=np.uint8)
+        # 登録対象であるか否か
+        self.key_flags = np.zeros(0, dtype=np.bool_)
+        # VMD読み込み処理で読み込んだキーか
+        self.read_flags = np.zeros(0, dtype=np.bool_)
+        # 接触回避の方向(key:フレーム番号)
+        self.avoidances = {}
+        # 配列が共有メモリ上にある場合、その共有ボーン(VmdSharedBones)
+        self.shared = None
+        # 登録先のボーン辞書(更新した時に、ボーン辞書の更新バージョンも進める)
+        self.owner = None
+        # 更新バージョン
+        self.version = next(VERSION_COUNTER)
+
+    def __getstate__(self):
+        # 共有メモリの配列も値として渡すので、共有ボーンへの参照は外す
+        # 登録先のボーン辞書は、辞書側で登録し直す時に設定する
+        state = self.__dict__.copy()
+        state["shared"] = None
+        state["owner"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # 別プロセスで採番したバージョンと重複しないよう、振り直す
+        self.touch()
+
+    # 更新バージョンを進める(登録先のボーン辞書の更新バージョンも進める)
+    def touch(self):
+        self.version = next(VERSION_COUNTER)
+        if self.owner is not None:
+            self.owner.touch()
+
+    # 共有メモリ上の配列(書き換え不可)を参照している場合、自前の配列に複製して書き換えられるようにする
+    def own(self):
+        if self.shared:
+            for array_name, _, _ in BONE_TRACK_ARRAYS:
+                setattr(self, array_name, getattr(self, array_name).copy())
+            self.shared = None
+
+    # 配列からトラックを生成する（フレーム番号が重複している場合、先に出てきたキーを採用）
+    @classmethod
+    def from_arrays(cls, name: str, fnos, positions, rotations, interpolations, key_flags=None, read_flags=None, bname=None):
+        track = cls(name)
+        if bname:
+            track.bname = bname
+
+        fnos = np.asarray(fnos, dtype=np.int64).reshape(-1)
+        _, first_idxs = np.unique(fnos, return_index=True)
+
+        track.fnos = fnos[first_idxs]
+        track.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)[first_idxs]
+        track.rotations = np.asarray(rotations, dtype=np.float64).reshape(-1, 4)[first_idxs]
+        track.org_positions = track.positions.copy()
+        track.org_rotations = track.rotations.copy()
+        track.interpolations = np.clip(np.asarray(interpolations).reshape(-1, 64), 0, MBezierUtils.INTERPOLATION_MMD_MAX)[first_idxs].astype(np.uint8)
+        track.org_interpolations = np.tile(np.array(DEFAULT_BONE_INTERPOLATION_TUPLE, dtype=np.uint8), (len(track.fnos), 1))
+        track.key_flags = np.ones(len(track.fnos), dtype=np.bool_) if key_flags is None else np.asarray(key_flags, dtype=np.bool_)[first_idxs]
+        track.read_flags = np.zeros(len(track.fnos), dtype=np.bool_) if read_flags is None else np.asarray(read_flags, dtype=np.bool_)[first_idxs]
+
+        return track
+
+    # VmdBoneFrameの辞書からトラックを生成する
+    @classmethod
+    def from_frames(cls, name: str, frames):
+        # 1キーずつ行を挿入すると全体でキー数の2乗かかるので、フレーム番号順の列にまとめてから一度に生成する
+        fnos = sorted(frames.keys())
+        bfs = [frames[fno] for fno in fnos]
+
+        track = cls.from_arrays(name, fnos, [bf.position.data() for bf in bfs], \
+                                [[bf.rotation.scalar(), bf.rotation.x(), bf.rotation.y(), bf.rotation.z()] for bf in bfs], \
+                                [bf.interpolation for bf in bfs], key_flags=[bf.key for bf in bfs], read_flags=[bf.read for bf in bfs])
+        track.org_positions = np.array([bf.org_position.data() for bf in bfs], dtype=np.float64).reshape(-1, 3)
+        track.org_rotations = np.array([[bf.org_rotation.scalar(), bf.org_rotation.x(), bf.org_rotation.y(), bf.org_rotation.z()] for bf in bfs], \
+                                       dtype=np.float64).reshape(-1, 4)
+        track.org_interpolations = np.clip(np.asarray([bf.org_interpolation for bf in bfs]).reshape(-1, 64), 0, MBezierUtils.INTERPOLATION_MMD_MAX).astype(np.uint8)
+        track.avoidances = {fno: bf.avoidance for fno, bf in zip(fnos, bfs) if bf.avoidance}
+
+        if not name and len(bfs) > 0:
+            # 名前の指定がない場合、キーフレの名前を採用
+            track.name = bfs[0].name
+            track.bname = bfs[0].bname
+
+        return track
+
+    # VmdBoneFrameの辞書に戻す
+    def to_frames(self):
+        return VmdBoneFrameDict({fno: self[fno].copy() for fno in self})
+
+    def copy(self):
+        track = self.__class__(self.name)
+        track.bname = self.bname
+        track.fnos = self.fnos.copy()
+        track.positions = self.positions.copy()
+        track.rotations = self.rotations.copy()
+        track.org_positions = self.org_positions.copy()
+        track.org_rotations = self.org_rotations.copy()
+        track.interpolations = self.interpolations.copy()
+        track.org_interpolations = self.org_interpolations.copy()
+        track.key_flags = self.key_flags.copy()
+        track.read_flags = self.read_flags.copy()
+        track.avoidances = dict(self.avoidances)
+        track.touch()
+
+        return track
+
+    # 位置の配列(複製を返すので、変更はset_position_arrayで反映する)
+    def get_position_array(self, is_org=False):
+        return MVector3DArray((self.org_positions if is_org else self.positions).copy())
+
+    def set_position_array(self, positions: MVector3DArray, is_org=False):
+        self.own()
+        if is_org:
+            self.org_positions[:] = positions.data()
+        else:
+            self.positions[:] = positions.data()
+        self.touch()
+
+    # 回転の配列(回転は計算のたびに新しい配列になるので、変更はset_rotation_arrayで反映する)
+    def get_rotation_array(self, is_org=False):
+        return MQuaternionArray(self.org_rotations if is_org else self.rotations)
+
+    def set_rotation_array(self, rotations: MQuaternionArray, is_org=False):
+        self.own()
+        if is_org:
+            self.org_rotations[:] = rotations.data()
+        else:
+            self.rotations[:] = rotations.data()
+        self.touch()
+
+    # 指定フレーム番号の行INDEX(無い場合は-1)
+    def index(self, fno: int):
+        idx = int(np.searchsorted(self.fnos, fno))
+        if idx < len(self.fnos) and self.fnos[idx] == fno:
+            return idx
+        return -1
+
+    def __len__(self):
+        return len(self.fnos)
+
+    def __iter__(self):
+        return iter(self.fnos.tolist())
+
+    def __contains__(self, fno):
+        return self.index(fno) >= 0
+
+    def __getitem__(self, fno):
+        if self.index(fno) < 0:
+            raise KeyError(fno)
+        return VmdBoneFrameView(self, int(fno))
+
+    def __setitem__(self, fno, bf):
+        self.own()
+
+        idx = self.index(fno)
+        if idx < 0:
+            # 新規キーの場合、昇順を保つ位置に行を挿入する
+            idx = int(np.searchsorted(self.fnos, fno))
+            self.fnos = np.insert(self.fnos, idx, fno)
+            self.positions = np.insert(self.positions, idx, 0, axis=0)
+            self.rotations = np.insert(self.rotations, idx, 0, axis=0)
+            self.org_positions = np.insert(self.org_positions, idx, 0, axis=0)
+            self.org_rotations = np.insert(self.org_rotations, idx, 0, axis=0)
+            self.interpolations = np.insert(self.interpolations, idx, 0, axis=0)
+            self.org_interpolations = np.insert(self.org_interpolations, idx, 0, axis=0)
+            self.key_flags = np.insert(self.key_flags, idx, False)
+            self.read_flags = np.insert(self.read_flags, idx, False)
+
+        if not self.name:
+            self.name = bf.name
+            self.bname = bf.bname
+
+        self.positions[idx] = bf.position.data()
+        self.rotations[idx] = [bf.rotation.scalar(), bf.rotation.x(), bf.rotation.y(), bf.rotation.z()]
+        self.org_positions[idx] = bf.org_position.data()
+        self.org_rotations[idx] = [bf.org_rotation.scalar(), bf.org_rotation.x(), bf.org_rotation.y(), bf.org_rotation.z()]
+        self.interpolations[idx] = np.clip(bf.interpolation, 0, MBezierUtils.INTERPOLATION_MMD_MAX)
+        self.org_interpolations[idx] = np.clip(bf.org_interpolation, 0, MBezierUtils.INTERPOLATION_MMD_MAX)
+        self.key_flags[idx] = bf.key
+        self.read_flags[idx] = bf.read
+        if bf.avoidance:
+            self.avoidances[fno] = bf.avoidance
+        else:
+            self.avoidances.pop(fno, None)
+        self.touch()
+
+    def __delitem__(self, fno):
+        idx = self.index(fno)
+        if idx < 0:
+            raise KeyError(fno)
+
+        self.own()
+        self.fnos = np.delete(self.fnos, idx)
+        self.positions = np.delete(self.positions, idx, axis=0)
+        self.rotations = np.delete(self.rotations, idx, axis=0)
+        self.org_positions = np.delete(self.org_positions, idx, axis=0)
+        self.org_rotations = np.delete(self.org_rotations, idx, axis=0)
+        self.interpolations = np.delete(self.interpolations, idx, axis=0)
+        self.org_interpolations = np.delete(self.org_interpolations, idx, axis=0)
+        self.key_flags = np.delete(self.key_flags, idx)
+        self.read_flags = np.delete(self.read_flags, idx)
+        self.avoidances.pop(fno, None)
+        self.touch()
+
+    # 指定範囲内のフレーム番号リスト(昇順)
+    def get_range_fnos(self, start_fno: int, end_fno: int):
+        return self.fnos[np.searchsorted(self.fnos, start_fno, side='left'):np.searchsorted(self.fnos, end_fno, side='right')].tolist()
+
+    # 指定フレーム番号の直前と直後のフレーム番号(無い場合はNone)
+    def get_prev_next_fno(self, fno: int, is_key=False, is_read=False, start_fno=0, end_fno=9999999999):
+        mask = (self.fnos >= start_fno) & (self.fnos <= end_fno)
+        if is_key:
+            mask &= self.key_flags
+        if is_read:
+            mask &= self.read_flags
+
+        pidx = int(np.searchsorted(self.fnos, fno, side='left'))
+        nidx = int(np.searchsorted(self.fnos, fno, side='right'))
+
+        prev_idxs = np.flatnonzero(mask[:pidx])
+        next_idxs = np.flatnonzero(mask[nidx:])
+
+        prev_fno = int(self.fnos[prev_idxs[-1]]) if len(prev_idxs) > 0 else None
+        next_fno = int(self.fnos[nidx + next_idxs[0]]) if len(next_idxs) > 0 else None
+
+        return prev_fno, next_fno
+
+    # 指定フレーム番号のキーが条件に合致するか
+    def is_match(self, fno: int, is_key=False, is_read=False):
+        idx = self.index(fno)
+        return (not is_key or bool(self.key_flags[idx])) and (not is_read or bool(self.read_flags[idx]))
+
+
+# VmdBoneTrackの1行を参照するキーフレ
+# 値の代入はトラックの配列に反映され、トラックの更新バージョンも進む。
+# 位置・回転・補間曲線は参照のたびに配列から複製して返すので、setX等で変更した場合は代入し直すこと。
+class VmdBoneFrameView(VmdBoneFrame):
+
+    def __init__(self, track: VmdBoneTrack, fno: int):
+        self.owner = None
+        self.track = track
+        self.fno = fno
+
+    def row(self):
+        idx = self.track.index(self.fno)
+        if idx < 0:
+            raise KeyError(self.fno)
+        return idx
+
+    # トラックから切り離したキーフレを生成する
+    def copy(self):
+        row = self.row()
+        bf = VmdBoneFrame(self.fno)
+        bf.name = self.track.name
+        bf.bname = self.track.bname
+        bf.position = MVector3D(self.track.positions[row])
+        bf.rotation = MQuaternion(self.track.rotations[row])
+        bf.org_position = MVector3D(self.track.org_positions[row])
+        bf.org_rotation = MQuaternion(self.track.org_rotations[row])
+        bf.interpolation = self.track.interpolations[row]
+        bf.org_interpolation = self.track.org_interpolations[row]
+        bf.key = bool(self.track.key_flags[row])
+        bf.read = bool(self.track.read_flags[row])
+
+        return bf
+
+    @property
+    def name(self):
+        return self.track.name
+
+    @name.setter
+    def name(self, name):
+        self.track.name = name
+        self.track.touch()
+
+    @property
+    def bname(self):
+        return self.track.bname
+
+    @bname.setter
+    def bname(self, bname):
+        self.track.bname = bname
+        self.track.touch()
+
+    @property
+    def position(self):
+        return MVector3D(self.track.positions[self.row()])
+
+    @position.setter
+    def position(self, position):
+        self.track.own()
+        self.track.positions[self.row()] = position.data()
+        self.track.touch()
+
+    @property
+    def rotation(self):
+        return MQuaternion(*self.track.rotations[self.row()])
+
+    @rotation.setter
+    def rotation(self, rotation):
+        self.track.own()
+        self.track.rotations[self.row()] = [rotation.scalar(), rotation.x(), rotation.y(), rotation.z()]
+        self.track.touch()
+
+    @property
+    def org_position(self):
+        return MVector3D(self.track.org_positions[self.row()])
+
+    @org_position.setter
+    def org_position(self, position):
+        self.track.own()
+        self.track.org_positions[self.row()] = position.data()
+        self.track.touch()
+
+    @property
+    def org_rotation(self):
+        return MQuaternion(*self.track.org_rotations[self.row()])
+
+    @org_rotation.setter
+    def org_rotation(self, rotation):
+        self.track.own()
+        self.track.org_rotations[self.row()] = [rotation.scalar(), rotation.x(), rotation.y(), rotation.z()]
+        self.track.touch()
+
+    @property
+    def interpolation(self):
+        return self.track.interpolations[self.row()].tolist()
+
+    @interpolation.setter
+    def interpolation(self, interpolation):
+        self.track.own()
+        self.track.interpolations[self.row()] = np.clip(interpolation, 0, MBezierUtils.INTERPOLATION_MMD_MAX)
+        self.track.touch()
+
+    @property
+    def org_interpolation(self):
+        return self.track.org_interpolations[self.row()].tolist()
+
+    @org_interpolation.setter
+    def org_interpolation(self, org_interpolation):
+        self.track.own()
+        self.track.org_interpolations[self.row()] = np.clip(org_interpolation, 0, MBezierUtils.INTERPOLATION_MMD_MAX)
+        self.track.touch()
+
+    @property
+    def key(self):
+        return bool(self.track.key_flags[self.row()])
+
+    @key.setter
+    def key(self, key):
+        self.track.own()
+        self.track.key_flags[self.row()] = key
+        self.track.touch()
+
+    @property
+    def read(self):
+        return bool(self.track.read_flags[self.row()])
+
+    @read.setter
+    def read(self, read):
+        self.track.own()
+        self.track.read_flags[self.row()] = read
+        self.track.touch()
+
+    @property
+    def avoidance(self):
+        return self.track.avoidances.get(self.fno, "")
+
+    @avoidance.setter
+    def avoidance(self, avoidance):
+        if avoidance:
+            self.track.avoidances[self.fno] = avoidance
+        else:
+            self.track.avoidances.pop(self.fno, None)
+        self.track.touch()
+
+
+# ボーン名：VmdBoneFrameDict(もしくはVmdBoneTrack)の辞書(key:ボーン名)
+# 普通の辞書が登録された場合も、VmdBoneFrameDictに変換して保持する
+# copyはキーフレを複製せずに共有し(コピーオンライト)、共有中のボーンは[]等で最初に取り出した時にそのボーンだけ複製する
+# ([]・get・values・itemsは変更用に取り出す。参照するだけの場合はraw_get・raw_itemsを使えば複製しない)
+class VmdBoneDict(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        # 他の辞書と共有しているボーン名：共有数(共有している辞書間で同じリストを持つ)
+        self.shared_counts = {}
+        # 最初に参照されるまで読み込みを遅らせているボーン名：キーフレを生成する関数
+        self.lazy_loaders = {}
+        # 複数スレッドから同じボーンを参照した時に、読み込み・複製が重複しないようにする
+        self.lock = threading.RLock()
+        self.version = next(VERSION_COUNTER)
+        self.update(*args, **kwargs)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self.raw_items()),))
+
+    def __getitem__(self, bone_name):
+        if (self.lazy_loaders and bone_name in self.lazy_loaders) or (self.shared_counts and bone_name in self.shared_counts):
+            with self.lock:
+                self.load(bone_name)
+                self.own(bone_name)
+        return super().__getitem__(bone_name)
+
+    # dict(bones)や{**bones}も__getitem__を経由させて、共有中・読込前のボーンをそのまま渡さない
+    # (複製せずに一括で参照する場合はraw_items、共有したまま複製する場合はcopyを使う)
+    def __iter__(self):
+        return super().__iter__()
+
+    def __setitem__(self, bone_name, frames):
+        if not isinstance(frames, (VmdBoneFrameDict, VmdBoneTrack)):
+            frames = VmdBoneFrameDict(frames)
+        frames.owner = self
+        self.release(bone_name)
+        self.lazy_loaders.pop(bone_name, None)
+        super().__setitem__(bone_name, frames)
+        self.touch()
+
+    def __delitem__(self, bone_name):
+        super().__delitem__(bone_name)
+        self.release(bone_name)
+        self.lazy_loaders.pop(bone_name, None)
+        self.touch()
+
+    def get(self, bone_name, default=None):
+        return self[bone_name] if bone_name in self else default
+
+    def values(self):
+        return [self[bone_name] for bone_name in list(self.keys())]
+
+    def items(self):
+        return [(bone_name, self[bone_name]) for bone_name in list(self.keys())]
+
+    # 共有中のボーンも複製せずに参照する(読み取り専用)
+    # is_loaded_only: 読み込みを遅らせているボーンは読み込まずに除外する
+    def raw_items(self, is_loaded_only=False):
+        if is_loaded_only:
+            return [(bone_name, frames) for bone_name, frames in super().items() if bone_name not in self.lazy_loaders]
+
+        with self.lock:
+            for bone_name in list(self.lazy_loaders.keys()):
+                self.load(bone_name)
+        return super().items()
+
+    # 共有中のボーンも複製せずに参照する(読み取り専用)
+    def raw_get(self, bone_name):
+        with self.lock:
+            self.load(bone_name)
+        return super().__getitem__(bone_name)
+
+    def pop(self, bone_name, *args):
+        if bone_name in self:
+            with self.lock:
+                self.load(bone_name)
+                self.own(bone_name)
+        self.touch()
+        return super().pop(bone_name, *args)
+
+    def clear(self):
+        for bone_name in list(self.shared_counts.keys()):
+            self.release(bone_name)
+        self.lazy_loaders.clear()
+        super().clear()
+        self.touch()
+
+    def setdefault(self, bone_name, frames=None):
+        if bone_name not in self:
+            self[bone_name] = frames if frames is not None else {}
+        return self[bone_name]
+
+    def update(self, *args, **kwargs):
+        for bone_name, frames in dict(*args, **kwargs).items():
+            self[bone_name] = frames
+
+    # キーフレを共有する辞書を生成する
+    def copy(self):
+        bones = self.__class__()
+        with self.lock:
+            for bone_name, frames in super().items():
+                if bone_name in self.lazy_loaders:
+                    # 未読込のボーンは、読み込み関数だけ引き継ぐ(それぞれ最初に参照された時に読み込む)
+                    bones.set_lazy(bone_name, self.lazy_loaders[bone_name])
+                    continue
+
+                shared_count = self.shared_counts.setdefault(bone_name, [1])
+                shared_count[0] += 1
+                bones.shared_counts[bone_name] = shared_count
+                super(VmdBoneDict, bones).__setitem__(bone_name, frames)
+
+        return bones
+
+    # ボーンのキーフレを、最初に参照された時に生成するよう登録する
+    def set_lazy(self, bone_name, loader):
+        self.release(bone_name)
+        super().__setitem__(bone_name, None)
+        self.lazy_loaders[bone_name] = loader
+        self.touch()
+
+    # 読み込みを遅らせているボーンのキーフレを生成する
+    def load(self, bone_name):
+        loader = self.lazy_loaders.pop(bone_name, None)
+        if loader:
+            frames = loader()
+            if not isinstance(frames, (VmdBoneFrameDict, VmdBoneTrack)):
+                frames = VmdBoneFrameDict(frames)
+            frames.owner = self
+            super().__setitem__(bone_name, frames)
+
+    # 共有中のボーンを、この辞書専用に複製する(他に共有している辞書がない場合はそのまま使う)
+    def own(self, bone_name):
+        shared_count = self.shared_counts.pop(bone_name, None)
+        if shared_count is None:
+            return
+
+        frames = super().__getitem__(bone_name)
+        if shared_count[0] > 1:
+            shared_count[0] -= 1
+            if isinstance(frames, VmdBoneTrack):
+                frames = frames.copy()
+            else:
+                frames = VmdBoneFrameDict({fno: bf.copy() for fno, bf in frames.items()})
+            super().__setitem__(bone_name, frames)
+        # 以降の変更は、この辞書の更新バージョンに反映する
+        frames.owner = self
+
+    # 更新バージョンを進める(ボーン毎のキーフレ辞書が更新された時にも呼ばれる)
+    def touch(self):
+        self.version = next(VERSION_COUNTER)
+
+    # 共有をやめる(キーフレは他の辞書に任せる)
+    def release(self, bone_name):
+        shared_count = self.shared_counts.pop(bone_name, None)
+        if shared_count:
+            shared_count[0] -= 1
+
+
+# ボーントラックの配列を一つの共有メモリに置いたもの
+# プロセス間では共有メモリ名と配置だけを受け渡し、受け取った側はattachで配列をコピーせずに参照する
+# 参照側のトラックは書き換え不可で、書き込むとそのトラックだけ自前の配列に複製される
+class VmdSharedBones():
+    def __init__(self, bones: dict):
+        tracks = [(bone_name, frames if isinstance(frames, VmdBoneTrack) else VmdBoneTrack.from_frames(bone_name, frames)) \
+                  for bone_name, frames in (bones.raw_items() if isinstance(bones, VmdBoneDict) else bones.items())]
+
+        # ボーン毎の(ボーン名, SJISボーン名, キー数, 接触回避, 配列の開始位置)
+        self.layouts = []
+        size = 0
+        for bone_name, track in tracks:
+            self.layouts.append((bone_name, track.bname, len(track), dict(track.avoidances), size))
+            size += self.calc_track_size(len(track))
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        self.name = self.shm.name
+        # 共有メモリを生成したプロセスか(破棄の責任を持つ)
+        self.is_owner = True
+
+        for (bone_name, track), (_, _, _, _, offset) in zip(tracks, self.layouts):
+            for array_name, shared_array in self.get_arrays(len(track), offset).items():
+                shared_array[:] = getattr(track, array_name)
+
+    def __getstate__(self):
+        return {"name": self.name, "layouts": self.layouts}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.layouts = state["layouts"]
+        self.shm = shared_memory.SharedMemory(name=self.name)
+        self.is_owner = False
+
+    # キー数分の配列に必要なバイト数(配列毎に8バイト境界に揃える)
+    @classmethod
+    def calc_track_size(cls, cnt: int):
+        size = 0
+        for _, shape, dtype in BONE_TRACK_ARRAYS:
+            size += cls.align(cnt * int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize)
+        return size
+
+    @classmethod
+    def align(cls, size: int):
+        return (size + 7) // 8 * 8
+
+    # 共有メモリ上の配列(配列名：配列)
+    def get_arrays(self, cnt: int, offset: int):
+        arrays = {}
+        for array_name, shape, dtype in BONE_TRACK_ARRAYS:
+            arrays[array_name] = np.ndarray((cnt,) + shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            offset += self.align(arrays[array_name].nbytes)
+        return arrays
+
+    # 共有メモリ上の配列を参照するボーントラックの辞書を生成する
+    def attach(self):
+        bones = VmdBoneDict()
+        for bone_name, bname, cnt, avoidances, offset in self.layouts:
+            track = VmdBoneTrack(bone_name)
+            track.bname = bname
+            for array_name, shared_array in self.get_arrays(cnt, offset).items():
+                shared_array.flags.writeable = False
+                setattr(track, array_name, shared_array)
+            track.avoidances = dict(avoidances)
+            # トラックが残っている間は共有メモリを閉じないよう、参照を持たせる
+            track.shared = self
+            bones[bone_name] = track
+
+        return bones
+
+    # 共有メモリを閉じる(attachしたトラックは、先に破棄するかownしておくこと)
+    def close(self):
+        self.shm.close()
+
+    # 共有メモリを破棄する(生成したプロセスで、全プロセスの処理が終わった後に呼ぶ)
+    def unlink(self):
+        if self.is_owner:
+            self.shm.unlink()
+
+
 # https://blog.goo.ne.jp/torisu_tetosuki/e/bc9f1c4d597341b394bd02b64597499d
 # https://w.atwiki.jp/kumiho_k/pages/15.html
 class VmdMotion():
@@ -180,7 +1075,7 @@ class VmdMotion():
         self.last_motion_frame = 0
         self.motion_cnt = 0
         # ボーン名：VmdBoneFrameの辞書(key:ボーン名)
-        self.bones = {}
+        self.bones = VmdBoneDict()
         self.morph_cnt = 0
         # モーフ名：VmdMorphFrameの辞書(key:モーフ名)
         self.morphs = {}
@@ -198,6 +1093,12 @@ class VmdMotion():
         self.showiks = []
         # ハッシュ値
         self.digest = None
+
+    # ボーンモーションの更新バージョン
+    # キーフレの登録・削除・値の代入のたびに、ボーン辞書の更新バージョンが進む
+    @property
+    def version(self):
+        return self.bones.version
     
     def regist_full_bf(self, data_set_no: int, bone_name_list: str, offset=1):
         # 指定された全部のボーンのキーフレ取得
@@ -231,35 +1132,38 @@ class VmdMotion():
             if len(bone_fnos) <= 0:
                 continue
             
-            before_bf = self.calc_bf(bone_name, 0)  # 比較対象bf
-            for fno in range(1, bone_fnos[-1]):
-                bf = self.calc_bf(bone_name, fno)
+            # 全フレームの位置と回転をまとめて求めておく
+            positions, rotations = self.calc_bf_many(bone_name, range(0, max(1, bone_fnos[-1])))
+            # 読み込みキーのフレーム番号
+            read_fnos = set(self.get_bone_fnos(bone_name, is_read=True))
 
-                if bf.read:
+            before_idx = 0  # 比較対象bf
+            for fno in range(1, bone_fnos[-1]):
+                if fno in read_fnos:
                     # 読み込みキーである場合、必ず処理対象に追加
                     fnos.append(fno)
                     # 前回キーとして保持
-                    before_bf = bf.copy()
+                    before_idx = fno
                 else:
                     # 読み込みキーではない場合、処理対象にするかチェック
 
                     # 読み込みキーとの差
-                    dot = MQuaternion.dotProduct(before_bf.rotation, bf.rotation)
+                    dot = np.sum(rotations[before_idx] * rotations[fno])
                     if dot < limit_radians:
                         # 前と今回の内積の差が指定度数より離れている場合、追加
                         logger.test("★ 追加 set: %s, %s, f: %s, dot: %s", data_set_no, bone_name, fno, dot)
                         fnos.append(fno)
                         # 前回キーとして保持
-                        before_bf = bf.copy()
+                        before_idx = fno
 
                     # 読み込みキーとの差
-                    diff = before_bf.position.distanceToPoint(bf.position)
+                    diff = np.linalg.norm(positions[before_idx] - positions[fno], ord=2)
                     if diff > limit_length:
                         # 前と今回の移動量の差が指定値より離れている場合、追加
                         logger.test("★ 追加 set: %s, %s, f: %s, dot: %s", data_set_no, bone_name, fno, dot)
                         fnos.append(fno)
                         # 前回キーとして保持
-                        before_bf = bf.copy()
+                        before_idx = fno
 
                 if data_set_no > 0 and fno // 500 > prev_sep_fno and bone_fnos[-1] > 0:
                     logger.info("-- %sフレーム目:終了(%s％)【No.%s - キーフレ追加準備 - %s】", fno, round((fno / bone_fnos[-1]) * 100, 3), data_set_no, bone_name)
@@ -509,57 +1413,62 @@ class VmdMotion():
         prev_bf = self.calc_bf(bone_name, prev_fno)
         next_bf = self.calc_bf(bone_name, next_fno)
         self.split_bf_by_fno(bone_name, prev_bf, next_bf, fno)
+        # 前後キーの補間曲線も書き換えているので、改めて更新バージョンを進める
+        self.bones[bone_name].touch()
 
     # 補間曲線を考慮した指定フレーム番号の位置
     # https://www55.atwiki.jp/kumiho_k/pages/15.html
     # https://harigane.at.webry.info/201103/article_1.html
-    def calc_bf(self, bone_name: str, fno: int, is_key=False, is_read=False, is_reset_interpolation=False):
+    # is_readonly: 値を参照するだけの場合。登録済みのキーをそのまま返すので、変更しないこと(共有中のボーンを複製せず、ボーンがなくても登録しない)
+    def calc_bf(self, bone_name: str, fno: int, is_key=False, is_read=False, is_reset_interpolation=False, is_readonly=False):
         fill_bf = VmdBoneFrame(fno)
 
         if bone_name not in self.bones:
-            self.bones[bone_name] = {fno: fill_bf}
+            if not is_readonly:
+                self.bones[bone_name] = {fno: fill_bf}
             fill_bf.set_name(bone_name)
             return fill_bf
         
+        # 前後キーの補間曲線を書き換える場合のみ、共有中のボーンを複製する
+        bone_frames = self.bones[bone_name] if is_reset_interpolation else self.bones.raw_get(bone_name)
+
         # 条件に合致するフレーム番号を探す
         # is_key: 登録対象のキーを探す
         # is_read: データ読み込み時のキーを探す
-        if fno in self.bones[bone_name] and (not is_key or (is_key and self.bones[bone_name][fno].key)) and (not is_read or (is_read and self.bones[bone_name][fno].read)):
-            # 合致するキーが見つかった場合、それを返す
-            return self.bones[bone_name][fno]
+        if fno in bone_frames and (not is_key or (is_key and bone_frames[fno].key)) and (not is_read or (is_read and bone_frames[fno].read)):
+            # 合致するキーが見つかった場合、それを返す(変更される可能性がある場合は、共有中のボーンを複製する)
+            return bone_frames[fno] if is_readonly else self.bones[bone_name][fno]
         else:
             # 合致するキーが見つからなかった場合
             if is_key or is_read:
                 # 既存キーのみ探している場合はNone
                 return None
 
-        # 番号より前のフレーム番号
-        before_fnos = [x for x in sorted(self.bones[bone_name].keys()) if (x < fno)]
-        # 番号より後のフレーム番号
-        after_fnos = [x for x in sorted(self.bones[bone_name].keys()) if (x > fno)]
+        # 番号より前と後のフレーム番号
+        before_fno, after_fno = bone_frames.get_prev_next_fno(fno)
 
-        if len(after_fnos) == 0 and len(before_fnos) == 0:
+        if after_fno is None and before_fno is None:
             fill_bf.set_name(bone_name)
             return fill_bf
 
-        if len(after_fnos) == 0:
+        if after_fno is None:
             # 番号より前があって、後のがない場合、前のをコピーして返す
-            fill_bf = self.bones[bone_name][before_fnos[-1]].copy()
+            fill_bf = bone_frames[before_fno].copy()
             fill_bf.fno = fno
             fill_bf.key = False
             fill_bf.read = False
             return fill_bf
         
-        if len(before_fnos) == 0:
+        if before_fno is None:
             # 番号より後があって、前がない場合、後のをコピーして返す
-            fill_bf = self.bones[bone_name][after_fnos[0]].copy()
+            fill_bf = bone_frames[after_fno].copy()
             fill_bf.fno = fno
             fill_bf.key = False
             fill_bf.read = False
             return fill_bf
 
-        prev_bf = self.bones[bone_name][before_fnos[-1]]
-        next_bf = self.bones[bone_name][after_fnos[0]]
+        prev_bf = bone_frames[before_fno]
+        next_bf = bone_frames[after_fno]
 
         # 名前をコピー
         fill_bf.name = prev_bf.name
@@ -644,6 +1553,90 @@ class VmdMotion():
         
         return prev_bf.position.copy()
     
+    # 指定ボーンの複数フレーム番号の位置と回転をまとめて求める
+    # 戻り値は位置(N×3)と回転(N×4: w, x, y, z)の配列で、各値はcalc_bfで求めた場合と同じ
+    def calc_bf_many(self, bone_name: str, fnos):
+        fnos = np.asarray(fnos, dtype=np.int64).reshape(-1)
+        positions = np.zeros((len(fnos), 3), dtype=np.float64)
+        rotations = np.tile(np.array([1, 0, 0, 0], dtype=np.float64), (len(fnos), 1))
+
+        if bone_name not in self.bones or len(self.bones.raw_get(bone_name)) == 0:
+            # キーがない場合、初期値
+            return positions, rotations
+
+        key_fnos, key_positions, key_rotations, key_interpolations = self.get_bone_arrays(bone_name)
+
+        # 各フレーム番号の直後のキーINDEX
+        next_idxs = np.searchsorted(key_fnos, fnos, side='right')
+        prev_idxs = next_idxs - 1
+
+        # キーと同じフレーム番号、もしくは範囲外の場合、そのキー(一番近いキー)の値をそのまま使う
+        copy_idxs = np.clip(prev_idxs, 0, len(key_fnos) - 1)
+        positions[:] = key_positions[copy_idxs]
+        rotations[:] = key_rotations[copy_idxs]
+
+        # 前後のキーの間にあるフレーム
+        fill_mask = (prev_idxs >= 0) & (next_idxs < len(key_fnos))
+        fill_mask[fill_mask] = key_fnos[prev_idxs[fill_mask]] != fnos[fill_mask]
+
+        if not np.any(fill_mask):
+            return positions, rotations
+
+        pidxs = prev_idxs[fill_mask]
+        nidxs = next_idxs[fill_mask]
+        start_fnos = key_fnos[pidxs]
+        now_fnos = fnos[fill_mask]
+        end_fnos = key_fnos[nidxs]
+        next_interpolations = key_interpolations[nidxs]
+
+        # 回転補間
+        prev_rots = key_rotations[pidxs]
+        next_rots = key_rotations[nidxs]
+        rot_mask = np.any(prev_rots != next_rots, axis=1)
+        _, ry, _ = MBezierUtils.evaluate_many(next_interpolations[:, MBezierUtils.R_x1_idxs[3]], next_interpolations[:, MBezierUtils.R_y1_idxs[3]], \
+                                              next_interpolations[:, MBezierUtils.R_x2_idxs[3]], next_interpolations[:, MBezierUtils.R_y2_idxs[3]], \
+                                              start_fnos, now_fnos, end_fnos)
+        fill_rots = prev_rots.copy()
+        fill_rots[rot_mask] = MQuaternionArray.slerp(prev_rots[rot_mask], next_rots[rot_mask], ry[rot_mask]).data()
+        rotations[fill_mask] = fill_rots
+
+        # 移動補間
+        prev_poses = key_positions[pidxs]
+        next_poses = key_positions[nidxs]
+        pos_mask = np.any(prev_poses != next_poses, axis=1)
+        fill_poses = prev_poses.copy()
+        for axis, (x1_idxs, y1_idxs, x2_idxs, y2_idxs) in enumerate([
+                (MBezierUtils.MX_x1_idxs, MBezierUtils.MX_y1_idxs, MBezierUtils.MX_x2_idxs, MBezierUtils.MX_y2_idxs),
+                (MBezierUtils.MY_x1_idxs, MBezierUtils.MY_y1_idxs, MBezierUtils.MY_x2_idxs, MBezierUtils.MY_y2_idxs),
+                (MBezierUtils.MZ_x1_idxs, MBezierUtils.MZ_y1_idxs, MBezierUtils.MZ_x2_idxs, MBezierUtils.MZ_y2_idxs)]):
+            _, yy, _ = MBezierUtils.evaluate_many(next_interpolations[:, x1_idxs[3]], next_interpolations[:, y1_idxs[3]], \
+                                                  next_interpolations[:, x2_idxs[3]], next_interpolations[:, y2_idxs[3]], \
+                                                  start_fnos, now_fnos, end_fnos)
+            fill_poses[pos_mask, axis] = prev_poses[pos_mask, axis] + ((next_poses[pos_mask, axis] - prev_poses[pos_mask, axis]) * yy[pos_mask])
+        positions[fill_mask] = fill_poses
+
+        return positions, rotations
+
+    # 指定ボーンのキーフレを配列で取得する(フレーム番号, 位置, 回転(w, x, y, z), 補間曲線)
+    def get_bone_arrays(self, bone_name: str):
+        bone_frames = self.bones.raw_get(bone_name)
+
+        if isinstance(bone_frames, VmdBoneTrack):
+            return bone_frames.fnos, bone_frames.positions, bone_frames.rotations, bone_frames.interpolations
+
+        key_fnos = np.array(bone_frames.get_range_fnos(0, 9999999999), dtype=np.int64)
+        key_positions = np.zeros((len(key_fnos), 3), dtype=np.float64)
+        key_rotations = np.zeros((len(key_fnos), 4), dtype=np.float64)
+        key_interpolations = np.zeros((len(key_fnos), 64), dtype=np.int64)
+
+        for kidx, fno in enumerate(key_fnos.tolist()):
+            bf = bone_frames[fno]
+            key_positions[kidx] = bf.position.data()
+            key_rotations[kidx] = [bf.rotation.scalar(), bf.rotation.x(), bf.rotation.y(), bf.rotation.z()]
+            key_interpolations[kidx] = bf.interpolation
+
+        return key_fnos, key_positions, key_rotations, key_interpolations
+
     # キーフレを指定されたフレーム番号の前後で分割する
     def split_bf_by_fno(self, target_bone_name: str, prev_bf: VmdBoneFrame, next_bf: VmdBoneFrame, fill_fno: int):
         if not (prev_bf.fno < fill_fno < next_bf.fno):
@@ -730,17 +1723,22 @@ class VmdMotion():
 
     # 補間曲線の再設定部品
     def reset_interpolation_parts(self, target_bone_name: str, bf: VmdBoneFrame, bzs: list, x1_idxs: list, y1_idxs: list, x2_idxs: list, y2_idxs: list):
+        # トラック参照のキーフレにも反映されるよう、組み立ててから代入する
+        interpolation = list(bf.interpolation)
+
         # キーの始点は、B
-        bf.interpolation[x1_idxs[0]] = bf.interpolation[x1_idxs[1]] = bf.interpolation[x1_idxs[2]] = bf.interpolation[x1_idxs[3]] = int(bzs[1].x())
-        bf.interpolation[y1_idxs[0]] = bf.interpolation[y1_idxs[1]] = bf.interpolation[y1_idxs[2]] = bf.interpolation[y1_idxs[3]] = int(bzs[1].y())
+        interpolation[x1_idxs[0]] = interpolation[x1_idxs[1]] = interpolation[x1_idxs[2]] = interpolation[x1_idxs[3]] = int(bzs[1].x())
+        interpolation[y1_idxs[0]] = interpolation[y1_idxs[1]] = interpolation[y1_idxs[2]] = interpolation[y1_idxs[3]] = int(bzs[1].y())
 
         # キーの終点は、C
-        bf.interpolation[x2_idxs[0]] = bf.interpolation[x2_idxs[1]] = bf.interpolation[x2_idxs[2]] = bf.interpolation[x2_idxs[3]] = int(bzs[2].x())
-        bf.interpolation[y2_idxs[0]] = bf.interpolation[y2_idxs[1]] = bf.interpolation[y2_idxs[2]] = bf.interpolation[y2_idxs[3]] = int(bzs[2].y())
+        interpolation[x2_idxs[0]] = interpolation[x2_idxs[1]] = interpolation[x2_idxs[2]] = interpolation[x2_idxs[3]] = int(bzs[2].x())
+        interpolation[y2_idxs[0]] = interpolation[y2_idxs[1]] = interpolation[y2_idxs[2]] = interpolation[y2_idxs[3]] = int(bzs[2].y())
+
+        bf.interpolation = interpolation
 
     # 有効なキーフレが入っているか
     def is_active_bones(self, bone_name):
-        for bf in self.bones[bone_name].values():
+        for bf in self.bones.raw_get(bone_name).values():
             if bf.position != MVector3D():
                 return True
             if bf.rotation != MQuaternion():
@@ -764,28 +1762,49 @@ class VmdMotion():
         keys = []
         for bone_name in bone_names:
             if bone_name in self.bones:
-                keys.extend([x for x in self.bones[bone_name].keys() if self.bones[bone_name][x].fno >= start_fno and self.bones[bone_name][x].fno <= end_fno and \
-                            (not is_key or (is_key and self.bones[bone_name][x].key)) and (not is_read or (is_read and self.bones[bone_name][x].read))])
+                # 範囲内のフレーム番号は二分探索で絞り込む
+                bone_frames = self.bones.raw_get(bone_name)
+                range_fnos = bone_frames.get_range_fnos(start_fno, end_fno)
+                if is_key or is_read:
+                    range_fnos = [x for x in range_fnos if bone_frames.is_match(x, is_key, is_read)]
+
+                if len(bone_names) == 1:
+                    # 1ボーンのみの場合、既に重複のない昇順
+                    return list(range_fnos)
+
+                keys.extend(range_fnos)
         
         # 重複を除いた昇順フレーム番号リストを返す
         return sorted(list(set(keys)))
     
     # 指定されたfnoの前後のキーを取得する
     def get_bone_prev_next_fno(self, *bone_names, **kwargs):
-        # 指定されたボーン名のfnos
-        fnos = self.get_bone_fnos(*bone_names, **kwargs)
+        # is_key: 登録対象のキーを探す
+        # is_read: データ読み込み時のキーを探す
+        is_key = True if "is_key" in kwargs and kwargs["is_key"] else False
+        is_read = True if "is_read" in kwargs and kwargs["is_read"] else False
+        start_fno = kwargs["start_fno"] if "start_fno" in kwargs and kwargs["start_fno"] else 0
+        end_fno = kwargs["end_fno"] if "end_fno" in kwargs and kwargs["end_fno"] else 9999999999
 
         fno = kwargs["fno"] if "fno" in kwargs else 0
 
-        # 指定より前のキーフレ
-        prev_fnos = [x for x in fnos if x < fno]
-        # 指定より後のキーフレ
-        next_fnos = [x for x in fnos if x > fno]
-        
         # 前のは取れなければ-1で強制的に前の
-        prev_fno = -1 if len(prev_fnos) <= 0 else prev_fnos[-1]
+        prev_fno = -1
         # 後のは取れなければ最終フレーム＋1
-        next_fno = self.last_motion_frame + 1 if len(next_fnos) <= 0 else next_fnos[0]
+        next_fno = self.last_motion_frame + 1
+
+        is_next = False
+        for bone_name in bone_names:
+            if bone_name in self.bones:
+                # 指定されたボーン名の前後キーを二分探索で取得する
+                bone_prev_fno, bone_next_fno = self.bones.raw_get(bone_name).get_prev_next_fno(fno, is_key, is_read, start_fno, end_fno)
+
+                if bone_prev_fno is not None and bone_prev_fno > prev_fno:
+                    prev_fno = bone_prev_fno
+
+                if bone_next_fno is not None and (not is_next or bone_next_fno < next_fno):
+                    next_fno = bone_next_fno
+                    is_next = True
 
         return prev_fno, next_fno
 
@@ -809,9 +1828,8 @@ class VmdMotion():
 
         target_fnos = {}
 
-        for bone_name, bone_frames in self.bones.items():
-            if bone_name not in ["SIZING_ROOT_BONE", "頭頂", "右つま先実体", "左つま先実体", "右足底辺", "左足底辺", "右足底実体", "左足底実体", "右足ＩＫ底実体", "左足ＩＫ底実体", "右足IK親底実体", "左足IK親底実体", \
-                                 "首根元", "右腕下延長", "左腕下延長", "右腕垂直", "左腕垂直", "センター実体", "左腕ひじ中間", "右腕ひじ中間", "左ひじ手首中間", "右ひじ手首中間", "左手首実体", "右手首実体"]:
+        for bone_name in self.bones.keys():
+            if bone_name not in SIZING_BONE_NAMES:
                 # サイジング用ボーンは出力しない
                 target_fnos[bone_name] = self.get_bone_fnos(bone_name, is_key=True)
 
@@ -820,14 +1838,14 @@ class VmdMotion():
 
             if len(fnos) > 0:
                 # 各ボーンの最終キーだけ先に登録
-                total_bone_frames.append(self.bones[bone_name][fnos[-1]])
+                total_bone_frames.append(self.bones.raw_get(bone_name)[fnos[-1]])
         
         for bone_name, fnos in target_fnos.items():
             if len(fnos) > 1:
                 # キーフレを最後の一つ手前まで登録
                 for fno in fnos[:-1]:
-                    if self.bones[bone_name][fno].key:
-                        total_bone_frames.append(self.bones[bone_name][fno])
+                    if self.bones.raw_get(bone_name)[fno].key:
+                        total_bone_frames.append(self.bones.raw_get(bone_name)[fno])
         
         return total_bone_frames
     
@@ -878,41 +1896,60 @@ class VmdMotion():
         
         self.morphs[frame.name][frame.fno] = frame
 
+    # ボーンキーフレを列指向トラックに変換する(ボーン名指定がない場合、全ボーン)
+    def to_bone_tracks(self, *bone_names):
+        for bone_name in (bone_names if bone_names else list(self.bones.keys())):
+            if bone_name in self.bones and not isinstance(self.bones.raw_get(bone_name), VmdBoneTrack):
+                self.bones[bone_name] = VmdBoneTrack.from_frames(bone_name, self.bones.raw_get(bone_name))
+
+    # 列指向トラックをボーンキーフレの辞書に戻す(ボーン名指定がない場合、全ボーン)
+    def to_bone_frames(self, *bone_names):
+        for bone_name in (bone_names if bone_names else list(self.bones.keys())):
+            if bone_name in self.bones and isinstance(self.bones.raw_get(bone_name), VmdBoneTrack):
+                self.bones[bone_name] = self.bones.raw_get(bone_name).to_frames()
+
+    # ボーントラックを共有メモリに置く(他プロセスには戻り値を渡し、attach_shared_bonesで参照する)
+    def share_bones(self):
+        return VmdSharedBones(self.bones)
+
+    # 共有メモリ上のボーントラックを参照する(書き込んだトラックだけ自前の配列に複製される)
+    def attach_shared_bones(self, shared_bones: VmdSharedBones):
+        self.bones = shared_bones.attach()
+
     # 指定fnoのみのモーションデータを生成する
     def copy_bone_motion(self, fno: int):
         new_motion = VmdMotion()
 
         for bone_name in self.bones.keys():
-            new_motion.bones[bone_name] = {fno: self.calc_bf(bone_name, fno).copy()}
+            new_motion.bones[bone_name] = {fno: self.calc_bf(bone_name, fno, is_readonly=True).copy()}
         
         return new_motion
 
+    # ボーンキーフレはコピーオンライトで共有し、変更するボーンだけ後から複製する
+    # モーフ・カメラ・照明・セルフ影・IK on/offは、キーフレを直接書き換える処理があるので(カメラ補正など)、ここで全て複製する
     def copy(self):
         motion = VmdMotion()
 
-        motion.path = cPickle.loads(cPickle.dumps(self.path, -1))
-        motion.signature = cPickle.loads(cPickle.dumps(self.signature, -1))
-        motion.model_name = cPickle.loads(cPickle.dumps(self.model_name, -1))
-        motion.last_motion_frame = cPickle.loads(cPickle.dumps(self.last_motion_frame, -1))
-        motion.motion_cnt = cPickle.loads(cPickle.dumps(self.motion_cnt, -1))
+        motion.path = self.path
+        motion.signature = self.signature
+        motion.model_name = self.model_name
+        motion.last_motion_frame = self.last_motion_frame
+        motion.motion_cnt = self.motion_cnt
 
-        for bone_name, bf_dict in self.bones.items():
-            motion.bones[bone_name] = {}
-            for bf in bf_dict.values():
-                motion.bones[bone_name][bf.fno] = bf.copy()
+        motion.bones = self.bones.copy()
 
-        motion.morph_cnt = cPickle.loads(cPickle.dumps(self.morph_cnt, -1))
+        motion.morph_cnt = self.morph_cnt
         motion.morphs = cPickle.loads(cPickle.dumps(self.morphs, -1))
-        motion.camera_cnt = cPickle.loads(cPickle.dumps(self.camera_cnt, -1))
+        motion.camera_cnt = self.camera_cnt
         motion.cameras = cPickle.loads(cPickle.dumps(self.cameras, -1))
 
-        motion.light_cnt = cPickle.loads(cPickle.dumps(self.light_cnt, -1))
+        motion.light_cnt = self.light_cnt
         motion.lights = cPickle.loads(cPickle.dumps(self.lights, -1))
-        motion.shadow_cnt = cPickle.loads(cPickle.dumps(self.shadow_cnt, -1))
+        motion.shadow_cnt = self.shadow_cnt
         motion.shadows = cPickle.loads(cPickle.dumps(self.shadows, -1))
-        motion.ik_cnt = cPickle.loads(cPickle.dumps(self.ik_cnt, -1))
+        motion.ik_cnt = self.ik_cnt
         motion.showiks = cPickle.loads(cPickle.dumps(self.showiks, -1))
         
-        motion.digest = cPickle.loads(cPickle.dumps(self.digest, -1))
+        motion.digest = self.digest
 
         return motion
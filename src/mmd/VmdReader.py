@@ -1,31 +1,50 @@
 # -*- coding: utf-8 -*-
 #
 import struct
-import hashlib
+import functools
 import re
+import numpy as np
 
-from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame
+from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdBoneTrack, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame
 from module.MMath import MRect, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
 from utils.MException import MParseException # noqa
+from utils import MFileUtils
 from utils.MLogger import MLogger # noqa
 from utils.MException import SizingException, MKilledException
 
+# ボーンキーフレ1件分(111byte)
+BONE_FRAME_DTYPE = np.dtype([("name", "S15"), ("fno", "<u4"), ("position", "<f4", (3,)), ("rotation", "<f4", (4,)), ("interpolation", "u1", (64,))])
+# モーフキーフレ1件分(23byte)
+MORPH_FRAME_DTYPE = np.dtype([("name", "S15"), ("fno", "<u4"), ("ratio", "<f4")])
+# カメラキーフレ1件分(61byte)
+CAMERA_FRAME_DTYPE = np.dtype([("fno", "<u4"), ("length", "<f4"), ("position", "<f4", (3,)), ("euler", "<f4", (3,)), ("interpolation", "u1", (24,)), \
+                               ("angle", "<u4"), ("perspective", "u1")])
+# 照明キーフレ1件分(28byte)
+LIGHT_FRAME_DTYPE = np.dtype([("fno", "<u4"), ("color", "<f4", (3,)), ("position", "<f4", (3,))])
+# セルフ影キーフレ1件分(9byte)
+SHADOW_FRAME_DTYPE = np.dtype([("fno", "<u4"), ("type", "u1"), ("distance", "<f4")])
+
 logger = MLogger(__name__)
 
 
 class VmdReader():
-    def __init__(self, file_path):
+    def __init__(self, file_path, is_track=False, is_lazy=False):
         self.offset = 0
         self.buffer = None
         self.encoding = None
+        self.digest = None
         self.file_path = file_path
+        # ボーンキーフレを列指向トラック(VmdBoneTrack)で保持するか
+        self.is_track = is_track
+        # ボーンキーフレを最初に参照された時に生成するか(ファイルはモーションが破棄されるまでマップしたままになる)
+        self.is_lazy = is_lazy
 
     # モデル名だけ取得
     def read_model_name(self):
         model_name = ""
         with open(self.file_path, "rb") as f:
-            # VMDファイルをバイナリ読み込み
-            self.buffer = f.read()
+            # VMDファイルのヘッダだけバイナリ読み込み
+            self.buffer = f.read(50)
 
             # vmdバージョン
             signature = self.unpack(30, "30s")
@@ -35,279 +54,225 @@ class VmdReader():
             model_bname, model_name = self.read_text(20)
             logger.test("model_bname %s, model_name: %s", model_bname, model_name)
 
+        self.buffer = None
+        self.offset = 0
+
         return model_name
 
+    # VMDファイルをメモリマップで開く(ハッシュ値の計算と読み込みで同じマップを使う)
+    def open_buffer(self):
+        if self.buffer is None:
+            self.buffer = MFileUtils.read_file_buffer(self.file_path)
+
+        return self.buffer
+
     def read_data(self):
         # モーションパス
         motion = VmdMotion()
         motion.path = self.file_path
 
         try:
-            with open(self.file_path, "rb") as f:
-                # VMDファイルをバイナリ読み込み
-                self.buffer = f.read()
-
-                # vmdバージョン
-                signature = self.unpack(30, "30s")
-                logger.test("signature %s", signature)
+            # VMDファイルをメモリマップで開く
+            self.open_buffer()
+            self.offset = 0
 
-                # モデル名
-                model_bname, model_name = self.read_text(20)
-                logger.test("model_bname %s, model_name: %s", model_bname, model_name)
-                motion.model_name = model_name
-
-                # モーション数
-                motion.motion_cnt = self.read_uint(4)
-                logger.test("motion.motion_cnt %s", motion.motion_cnt)
-
-                # 1F分のモーション情報
-
-                prev_n = 0
-                for n in range(motion.motion_cnt):
-                    frame = VmdBoneFrame(0)
-                    frame.key = True
-                    frame.read = True
-
-                    # ボーン ----------------------
-                    # ボーン名
-                    bone_bname, bone_name = self.read_text(15)
-
-                    frame.name = bone_name
-                    frame.bname = bone_bname
-                    logger.test("name: %s, bname %s", bone_name, bone_bname)
+            # vmdバージョン
+            signature = self.unpack(30, "30s")
+            logger.test("signature %s", signature)
 
-                    # フレームIDX
-                    frame.fno = self.read_uint(4)
-                    logger.test("frame.fno %s", frame.fno)
+            # モデル名
+            model_bname, model_name = self.read_text(20)
+            logger.test("model_bname %s, model_name: %s", model_bname, model_name)
+            motion.model_name = model_name
 
-                    # 位置X,Y,Z
-                    frame.position = self.read_Vector3D()
-                    logger.test("frame.position %s", frame.position)
-                    # オリジナルを保持
-                    frame.org_position = frame.position.copy()
+            # モーション数
+            motion.motion_cnt = self.read_uint(4)
+            logger.test("motion.motion_cnt %s", motion.motion_cnt)
 
-                    # 回転X,Y,Z,scalar
-                    frame.rotation = self.read_Quaternion()
-                    logger.test("frame.rotation %s", frame.rotation)
-                    logger.test("frame.rotation.euler %s", frame.rotation.toEulerAngles())
-                    # オリジナルを保持
-                    frame.org_rotation = frame.rotation.copy()
+            # 1F分のモーション情報(ボーンキーフレをまとめて読み込む)
+            bone_records = self.read_records(BONE_FRAME_DTYPE, motion.motion_cnt)
+            bone_names, bone_idxs = self.decode_names(bone_records["name"], 15)
 
-                    # 補間曲線
-                    frame.interpolation = list(self.unpack(64, "64B", True))
-                    logger.test("interpolation %s", frame.interpolation)
-                    # オリジナルの補間曲線を保持しておく
-                    # frame.org_interpolation = copy.deepcopy(frame.interpolation)
-                    # logger.test("org_interpolation %s", frame.org_interpolation)
+            if len(bone_records) > 0:
+                motion.last_motion_frame = max(motion.last_motion_frame, int(bone_records["fno"].max()))
 
-                    if bone_name not in motion.bones:
-                        # まだ辞書にない場合、配列追加
-                        motion.bones[bone_name] = {}
+            # ボーン毎に、ファイル上の順番でキーのINDEXをまとめる
+            bone_record_idxs = np.split(np.argsort(bone_idxs, kind="stable"), np.cumsum(np.bincount(bone_idxs, minlength=len(bone_names)))[:-1])
 
-                    # 辞書の該当部分にボーンフレームを追加
-                    if frame.fno not in motion.bones[bone_name]:
-                        motion.bones[bone_name][frame.fno] = frame
+            for (bone_bname, bone_name), record_idxs in zip(bone_names, bone_record_idxs):
+                if self.is_lazy:
+                    # キーフレは最初に参照された時に、マップからそのボーンの分だけ生成する
+                    motion.bones.set_lazy(bone_name, functools.partial(self.create_bone_frames, bone_name, bone_bname, bone_records, record_idxs))
+                else:
+                    motion.bones[bone_name] = self.create_bone_frames(bone_name, bone_bname, bone_records, record_idxs)
 
-                    if frame.fno > motion.last_motion_frame:
-                        # 最終フレームを記録
-                        motion.last_motion_frame = frame.fno
+            logger.info("-- VMDモーション読み込み キー: %s" % motion.motion_cnt)
 
-                    if n // 10000 > prev_n:
-                        prev_n = n // 10000
-                        logger.info("-- VMDモーション読み込み キー: %s" % n)
+            # モーフ数
+            motion.morph_cnt = self.read_uint(4)
+            logger.test("motion.morph_cnt %s", motion.morph_cnt)
 
-                # モーフ数
-                motion.morph_cnt = self.read_uint(4)
-                logger.test("motion.morph_cnt %s", motion.morph_cnt)
+            # 1F分のモーフ情報
+            morph_records = self.read_records(MORPH_FRAME_DTYPE, motion.morph_cnt)
+            morph_names, morph_idxs = self.decode_names(morph_records["name"], 15)
+            morph_ratios = morph_records["ratio"].astype(np.float64).tolist()
 
-                # 1F分のモーフ情報
-                prev_n = 0
-                for n in range(motion.morph_cnt):
-                    morph = VmdMorphFrame()
+            for n, (name_idx, fno) in enumerate(zip(morph_idxs.tolist(), morph_records["fno"].tolist())):
+                morph_bname, morph_name = morph_names[name_idx]
 
-                    # モーフ ----------------------
-                    # モーフ名
-                    morph_bname, morph_name = self.read_text(15)
+                if morph_name not in motion.morphs:
+                    # まだ辞書にない場合、配列追加
+                    motion.morphs[morph_name] = {}
 
+                if fno not in motion.morphs[morph_name]:
+                    # まだなければ辞書の該当部分にモーフフレームを追加
+                    morph = VmdMorphFrame(fno)
                     morph.name = morph_name
                     morph.bname = morph_bname
-                    logger.test("name: %s, bname %s", morph_name, morph_bname)
-
-                    # フレームIDX
-                    morph.fno = self.read_uint(4)
-                    logger.test("morph.fno %s", morph.fno)
-
-                    # 度数
-                    morph.ratio = self.read_float(4)
-                    logger.test("morph.ratio %s", morph.ratio)
-
-                    if morph_name not in motion.morphs:
-                        # まだ辞書にない場合、配列追加
-                        motion.morphs[morph_name] = {}
+                    morph.ratio = morph_ratios[n]
+                    motion.morphs[morph_name][fno] = morph
 
-                    if morph.fno not in motion.morphs[morph_name]:
-                        # まだなければ辞書の該当部分にモーフフレームを追加
-                        motion.morphs[morph_name][morph.fno] = morph
+            logger.info("-- VMDモーション読み込み モーフ: %s" % motion.morph_cnt)
 
-                    if n // 1000 > prev_n:
-                        prev_n = n // 1000
-                        logger.info("-- VMDモーション読み込み モーフ: %s" % n)
-
-                try:
-                    # カメラ数
-                    motion.camera_cnt = self.read_uint(4)
-                    logger.test("motion.camera_cnt %s", motion.camera_cnt)
-
-                    # 1F分のカメラ情報
-                    prev_n = 0
-                    for n in range(motion.camera_cnt):
-                        camera = VmdCameraFrame()
-
-                        # フレームIDX
-                        camera.fno = self.read_uint(4)
-                        logger.test("camera.fno %s", camera.fno)
-
-                        # 距離
-                        camera.length = self.read_float(4)
-                        logger.test("camera.length %s", camera.length)
-
-                        # 位置X,Y,Z
-                        camera.position = self.read_Vector3D()
-                        logger.test("camera.position %s", camera.position)
+            try:
+                # カメラ数
+                motion.camera_cnt = self.read_uint(4)
+                logger.test("motion.camera_cnt %s", motion.camera_cnt)
+
+                # 1F分のカメラ情報
+                camera_records = self.read_records(CAMERA_FRAME_DTYPE, motion.camera_cnt)
+                camera_values = zip(camera_records["fno"].tolist(), camera_records["length"].astype(np.float64).tolist(), \
+                                    camera_records["position"].astype(np.float64).tolist(), camera_records["euler"].astype(np.float64).tolist(), \
+                                    camera_records["interpolation"].tolist(), camera_records["angle"].tolist(), camera_records["perspective"].tolist())
+
+                for fno, length, position, euler, interpolation, angle, perspective in camera_values:
+                    camera = VmdCameraFrame()
+                    camera.fno = fno
+                    camera.length = length
+                    camera.position = MVector3D(*position)
+                    camera.euler = MVector3D(*euler)
+                    camera.interpolation = tuple(interpolation)
+                    camera.angle = angle
+                    camera.perspective = perspective
 
-                        # 角度（オイラー角）
-                        camera.euler = self.read_Vector3D()
-                        logger.test("camera.euler %s", camera.euler)
+                    # オリジナルを保持
+                    camera.org_length = camera.org_length
+                    camera.org_position = camera.org_position.copy()
 
-                        # 補間曲線
-                        camera.interpolation = self.unpack(24, "24B", True)
-                        logger.test("camera.interpolation %s", camera.interpolation)
+                    # カメラを追加
+                    motion.cameras[camera.fno] = camera
 
-                        # 視野角
-                        camera.angle = self.read_uint(4)
-                        logger.test("camera.angle %s", camera.angle)
+                logger.info("VMDカメラ読み込み キー: %s" % motion.camera_cnt)
 
-                        # パース有無
-                        camera.perspective = self.unpack(1, "B")
-                        logger.test("camera.perspective %s", camera.perspective)
+            except Exception:
+                # 情報がない場合、catchして握りつぶす
+                motion.camera_cnt = 0
 
-                        # オリジナルを保持
-                        camera.org_length = camera.org_length
-                        camera.org_position = camera.org_position.copy()
+            # 照明数
+            try:
+                motion.light_cnt = self.read_uint(4)
+                logger.test("motion.light_cnt %s", motion.light_cnt)
 
-                        # カメラを追加
-                        motion.cameras[camera.fno] = camera
+                # 1F分の照明情報
+                for _ in range(motion.light_cnt):
+                    light = VmdLightFrame()
 
-                        if n // 10000 > prev_n:
-                            prev_n = n // 10000
-                            logger.info("VMDカメラ読み込み キー: %s" % n)
+                    # フレームIDX
+                    light.fno = self.read_uint(4)
+                    logger.test("light.fno %s", light.fno)
 
-                except Exception:
-                    # 情報がない場合、catchして握りつぶす
-                    motion.camera_cnt = 0
+                    # 照明色(RGBだが、下手に数値が変わるのも怖いのでV3D)
+                    light.color = self.read_Vector3D()
+                    logger.test("light.color %s", light.color)
 
-                # 照明数
-                try:
-                    motion.light_cnt = self.read_uint(4)
-                    logger.test("motion.light_cnt %s", motion.light_cnt)
+                    # 照明位置
+                    light.position = self.read_Vector3D()
+                    logger.test("light.position %s", light.position)
 
-                    # 1F分の照明情報
-                    for _ in range(motion.light_cnt):
-                        light = VmdLightFrame()
+                    # 追加
+                    motion.lights.append(light)
 
-                        # フレームIDX
-                        light.fno = self.read_uint(4)
-                        logger.test("light.fno %s", light.fno)
+            except Exception:
+                # 情報がない場合、catchして握りつぶす
+                motion.light_cnt = 0
 
-                        # 照明色(RGBだが、下手に数値が変わるのも怖いのでV3D)
-                        light.color = self.read_Vector3D()
-                        logger.test("light.color %s", light.color)
+            # セルフシャドウ数
+            try:
+                motion.shadow_cnt = self.read_uint(4)
+                logger.test("motion.shadow_cnt %s", motion.shadow_cnt)
 
-                        # 照明位置
-                        light.position = self.read_Vector3D()
-                        logger.test("light.position %s", light.position)
+                # 1F分のシャドウ情報
+                for _ in range(motion.shadow_cnt):
+                    shadow = VmdShadowFrame()
 
-                        # 追加
-                        motion.lights.append(light)
+                    # フレームIDX
+                    shadow.fno = self.read_uint(4)
+                    logger.test("shadow.fno %s", shadow.fno)
 
-                except Exception:
-                    # 情報がない場合、catchして握りつぶす
-                    motion.light_cnt = 0
+                    # シャドウ種別
+                    shadow.type = self.read_uint(1)
+                    logger.test("shadow.type %s", shadow.type)
 
-                # セルフシャドウ数
-                try:
-                    motion.shadow_cnt = self.read_uint(4)
-                    logger.test("motion.shadow_cnt %s", motion.shadow_cnt)
+                    # 距離
+                    shadow.distance = self.read_float()
+                    logger.test("shadow.distance %s", shadow.distance)
 
-                    # 1F分のシャドウ情報
-                    for _ in range(motion.shadow_cnt):
-                        shadow = VmdShadowFrame()
+                    # 追加
+                    motion.shadows.append(shadow)
 
-                        # フレームIDX
-                        shadow.fno = self.read_uint(4)
-                        logger.test("shadow.fno %s", shadow.fno)
+            except Exception:
+                # 情報がない場合、catchして握りつぶす
+                motion.shadow_cnt = 0
 
-                        # シャドウ種別
-                        shadow.type = self.read_uint(1)
-                        logger.test("shadow.type %s", shadow.type)
+            # IK数
+            try:
+                motion.ik_cnt = self.read_uint(4)
+                logger.test("motion.ik_cnt %s", motion.ik_cnt)
 
-                        # 距離
-                        shadow.distance = self.read_float()
-                        logger.test("shadow.distance %s", shadow.distance)
+                # 1F分のIK情報
+                for _ in range(motion.ik_cnt):
+                    show_ik = VmdShowIkFrame()
 
-                        # 追加
-                        motion.shadows.append(shadow)
+                    # フレームIDX
+                    show_ik.fno = self.read_uint(4)
+                    logger.test("ik.fno %s", show_ik.fno)
 
-                except Exception:
-                    # 情報がない場合、catchして握りつぶす
-                    motion.shadow_cnt = 0
+                    # モデル表示, 0:OFF, 1:ON
+                    show_ik.show = self.read_uint(1)
+                    logger.test("ik.show %s", show_ik.show)
 
-                # IK数
-                try:
-                    motion.ik_cnt = self.read_uint(4)
-                    logger.test("motion.ik_cnt %s", motion.ik_cnt)
+                    # 記録するIKの数
+                    show_ik.ik_count = self.read_uint(4)
+                    logger.test("ik.ik_count %s", show_ik.ik_count)
 
-                    # 1F分のIK情報
-                    for _ in range(motion.ik_cnt):
-                        show_ik = VmdShowIkFrame()
+                    for _ in range(show_ik.ik_count):
+                        ik_info = VmdInfoIk()
 
-                        # フレームIDX
-                        show_ik.fno = self.read_uint(4)
-                        logger.test("ik.fno %s", show_ik.fno)
+                        # IK名
+                        ik_bname, ik_name = self.read_text(20)
+                        ik_info.name = ik_bname
+                        logger.test("ik_info.name %s", ik_name)
 
                         # モデル表示, 0:OFF, 1:ON
-                        show_ik.show = self.read_uint(1)
-                        logger.test("ik.show %s", show_ik.show)
-
-                        # 記録するIKの数
-                        show_ik.ik_count = self.read_uint(4)
-                        logger.test("ik.ik_count %s", show_ik.ik_count)
-
-                        for _ in range(show_ik.ik_count):
-                            ik_info = VmdInfoIk()
-
-                            # IK名
-                            ik_bname, ik_name = self.read_text(20)
-                            ik_info.name = ik_bname
-                            logger.test("ik_info.name %s", ik_name)
+                        ik_info.onoff = self.read_uint(1)
+                        logger.test("ik_info.onoff %s", ik_info.onoff)
 
-                            # モデル表示, 0:OFF, 1:ON
-                            ik_info.onoff = self.read_uint(1)
-                            logger.test("ik_info.onoff %s", ik_info.onoff)
+                        show_ik.ik.append(ik_info)
 
-                            show_ik.ik.append(ik_info)
+                    # 追加
+                    motion.showiks.append(show_ik)
 
-                        # 追加
-                        motion.showiks.append(show_ik)
-
-                except Exception:
-                    # 昔のMMD（MMDv7.39.x64以前）はIK情報がないため、catchして握りつぶす
-                    motion.ik_cnt = 0
+            except Exception:
+                # 昔のMMD（MMDv7.39.x64以前）はIK情報がないため、catchして握りつぶす
+                motion.ik_cnt = 0
 
             # ハッシュを設定
             motion.digest = self.hexdigest()
             logger.test("motion: %s, hash: %s", motion.path, motion.digest)
 
+            # マップは、遅延読み込み中のボーンが参照している間だけ残る
+            self.buffer = None
+
             return motion
         except MKilledException as ke:
             # 終了命令
@@ -320,19 +285,86 @@ class VmdReader():
             logger.error("サイジング処理が意図せぬエラーで終了しました。\n\n%s", traceback.print_exc())
             raise e
 
+    # ボーン1件分のキーフレを生成する(同じフレーム番号のキーがある場合、先に出てきたキーを採用)
+    def create_bone_frames(self, bone_name: str, bone_bname: bytes, bone_records: np.ndarray, record_idxs: np.ndarray):
+        records = bone_records[record_idxs]
+
+        # VMDは(x, y, z, scalar)の順なので、(scalar, x, y, z)に並べ替える
+        rotations = records["rotation"][:, [3, 0, 1, 2]].astype(np.float64)
+        positions = records["position"].astype(np.float64)
+
+        if self.is_track:
+            # 読み込んだキーは全て登録対象
+            return VmdBoneTrack.from_arrays(bone_name, records["fno"], positions, rotations, records["interpolation"], \
+                                            key_flags=np.ones(len(records), dtype=np.bool_), read_flags=np.ones(len(records), dtype=np.bool_), bname=bone_bname)
+
+        bone_frames = {}
+        interpolation_bytes = records["interpolation"].tobytes()
+        interpolations = {}
+
+        for n, (fno, position, rotation) in enumerate(zip(records["fno"].tolist(), positions.tolist(), rotations.tolist())):
+            if fno in bone_frames:
+                continue
+
+            frame = VmdBoneFrame(fno)
+            frame.key = True
+            frame.read = True
+            frame.name = bone_name
+            frame.bname = bone_bname
+            frame.position = MVector3D(*position)
+            frame.rotation = MQuaternion(*rotation)
+            # オリジナルは値だけ保持しておく(参照された時に生成する)
+            frame.set_org_values(tuple(position), tuple(rotation))
+
+            # 補間曲線(同じバイト列は一度だけ変換する)
+            interpolation = interpolation_bytes[n * 64:(n + 1) * 64]
+            if interpolation not in interpolations:
+                interpolations[interpolation] = tuple(interpolation)
+            frame.interpolation = interpolations[interpolation]
+
+            bone_frames[fno] = frame
+
+        return bone_frames
+
+    # 固定長レコードをまとめて構造化配列として読み込む
+    def read_records(self, dtype: np.dtype, count: int):
+        records = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=self.offset)
+        self.offset += dtype.itemsize * count
+
+        return records
+
+    # 固定長の名前を、重複を除いて一度ずつ復元する
+    # 戻り値は、ファイル上で出てきた順の(バイト列, 名前)リストと、各レコードの名前INDEX
+    # NULL以降のバイト列だけが違う場合は、同じ名前として扱う
+    def decode_names(self, bnames: np.ndarray, format_size: int):
+        unique_bnames, first_idxs, inverse_idxs = np.unique(bnames, return_index=True, return_inverse=True)
+
+        names = []
+        name_idxs = {}
+        unique_name_idxs = np.zeros(len(unique_bnames), dtype=np.int64)
+        # 出てきた順に名前を復元する
+        for unique_idx in np.argsort(first_idxs, kind="stable").tolist():
+            # 構造化配列では末尾のNULLが落ちるので、元の長さに戻す
+            bname = unique_bnames[unique_idx].ljust(format_size, b'\x00')
+
+            if not self.encoding:
+                # まだエンコードが確定していない場合、エンコード取得
+                self.encoding = self.get_encoding(bname, False)
+
+            name = self.decode_text(bname, self.encoding, False) if self.encoding else None
+            if name not in name_idxs:
+                name_idxs[name] = len(names)
+                names.append((bname if self.encoding else None, name))
+            unique_name_idxs[unique_idx] = name_idxs[name]
+
+        return names, unique_name_idxs[inverse_idxs.reshape(-1)]
+
+    # ハッシュ値は、読み込みと同じマップから一度だけ計算する
     def hexdigest(self):
-        sha1 = hashlib.sha1()
-
-        with open(self.file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(2048 * sha1.block_size), b''):
-                sha1.update(chunk)
-
-        sha1.update(chunk)
-
-        # ファイルパスをハッシュに含める
-        sha1.update(self.file_path.encode('utf-8'))
+        if not self.digest:
+            self.digest = MFileUtils.calc_digest(self.open_buffer(), self.file_path)
 
-        return sha1.hexdigest()
+        return self.digest
 
     def read_text(self, format_size):
         bresult = self.unpack(format_size, "{0}s".format(format_size))
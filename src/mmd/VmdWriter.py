@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 #
+import io
 import struct
+import numpy as np
+import quaternion # noqa
+from mmd.VmdData import VmdBoneTrack, SIZING_BONE_NAMES
+from mmd.VmdReader import BONE_FRAME_DTYPE, MORPH_FRAME_DTYPE, CAMERA_FRAME_DTYPE, LIGHT_FRAME_DTYPE, SHADOW_FRAME_DTYPE
 from module.MOptions import MOptionsDataSet
 from utils.MLogger import MLogger # noqa
 
@@ -11,51 +16,211 @@ class VmdWriter():
     def __init__(self, data_set: MOptionsDataSet):
         self.data_set = data_set
 
-    def write(self):
+    def write(self, is_release=False):
         """Write VMD data to a file"""
-        fout = open(self.data_set.output_vmd_path, "wb")
-
-        # header
-        fout.write(b'Vocaloid Motion Data 0002\x00\x00\x00\x00\x00')
-
-        bone_frames = self.data_set.motion.get_bone_frames()
-        morph_frames = self.data_set.motion.get_morph_frames()
-        camera_frames = self.data_set.motion.get_camera_frames()
-            
-        if len(bone_frames) > 0 or len(morph_frames) > 0:
-            try:
-                # モデル名を20byteで切る
-                model_bname = self.data_set.rep_model.name.encode('cp932').decode('shift_jis').encode('shift_jis')[:20]
-            except Exception:
-                logger.warning("モデル名に日本語・英語で判読できない文字が含まれているため、仮モデル名を設定します。 %s", self.data_set.rep_model.name, decoration=MLogger.DECORATION_BOX)
-                model_bname = "Vmd Sized Model".encode('shift_jis')[:20]
-
-            # 20文字に満たなかった場合、埋める
-            model_bname = model_bname.ljust(20, b'\x00')
-                
-            fout.write(model_bname)
-        else:
-            # カメラ・照明
-            fout.write(b'\x83J\x83\x81\x83\x89\x81E\x8f\xc6\x96\xbe\x00on Data')
-        
-        # bone frames
-        fout.write(struct.pack('<L', len(bone_frames)))  # ボーンフレーム数
-        for e, bf in enumerate(bone_frames):
-            bf.write(fout)
-        fout.write(struct.pack('<L', len(morph_frames)))  # 表情キーフレーム数
-        for mf in morph_frames:
-            mf.write(fout)
-        fout.write(struct.pack('<L', len(camera_frames)))  # カメラキーフレーム数
-        for cf in camera_frames:
-            cf.write(fout)
-        fout.write(struct.pack('<L', len(self.data_set.motion.lights)))  # 照明キーフレーム数
-        for cf in self.data_set.motion.lights:
-            cf.write(fout)
-        fout.write(struct.pack('<L', len(self.data_set.motion.shadows)))  # セルフ影キーフレーム数
-        for cf in self.data_set.motion.shadows:
-            cf.write(fout)
-        fout.write(struct.pack('<L', len(self.data_set.motion.showiks)))  # モデル表示・IK on/offキーフレーム数
+        # is_release: 書き込んだボーンのキーフレをモーションから削除する(書き込み後にモーションを使わない場合)
+        motion = self.data_set.motion
+
+        # キーのあるボーンは先に確定させておく(各ボーンの最終キーを先頭に並べるため、その数だけ枠を確保する)
+        bone_names = [bone_name for bone_name in list(motion.bones.keys()) if bone_name not in SIZING_BONE_NAMES and self.has_bone_key(motion.bones.raw_get(bone_name))]
+        morph_records = self.encode_morph_frames()
+
+        with open(self.data_set.output_vmd_path, "wb") as fout:
+            # header
+            fout.write(b'Vocaloid Motion Data 0002\x00\x00\x00\x00\x00')
+
+            if len(bone_names) > 0 or len(morph_records) > 0:
+                try:
+                    # モデル名を20byteで切る
+                    model_bname = self.data_set.rep_model.name.encode('cp932').decode('shift_jis').encode('shift_jis')[:20]
+                except Exception:
+                    logger.warning("モデル名に日本語・英語で判読できない文字が含まれているため、仮モデル名を設定します。 %s", self.data_set.rep_model.name, decoration=MLogger.DECORATION_BOX)
+                    model_bname = "Vmd Sized Model".encode('shift_jis')[:20]
+
+                # 20文字に満たなかった場合、埋める
+                model_bname = model_bname.ljust(20, b'\x00')
+
+                fout.write(model_bname)
+            else:
+                # カメラ・照明
+                fout.write(b'\x83J\x83\x81\x83\x89\x81E\x8f\xc6\x96\xbe\x00on Data')
+
+            # bone frames
+            # ボーンフレーム数と各ボーンの最終キーは、全ボーンを書き込んだ後に埋める
+            bone_cnt_offset = fout.tell()
+            fout.seek(4 + BONE_FRAME_DTYPE.itemsize * len(bone_names), io.SEEK_CUR)
+
+            # 最終キー以外は、ボーン毎に確定した順に追記する
+            last_records = []
+            for bone_name in bone_names:
+                bone_records = self.encode_bone_frames(motion.bones.raw_get(bone_name))
+                last_records.append(bone_records[-1:])
+                fout.write(bone_records[:-1])
+
+                if is_release:
+                    del motion.bones[bone_name]
+
+            bone_cnt = (fout.tell() - bone_cnt_offset - 4) // BONE_FRAME_DTYPE.itemsize
+            fout.seek(bone_cnt_offset)
+            fout.write(struct.pack('<L', bone_cnt))  # ボーンフレーム数
+            if len(last_records) > 0:
+                fout.write(np.concatenate(last_records))
+            fout.seek(0, io.SEEK_END)
+
+            # 残りのセクションは、まとめて変換して一度に書き込む
+            camera_records = self.encode_camera_frames()
+            light_records = self.encode_light_frames()
+            shadow_records = self.encode_shadow_frames()
+
+            fout.write(struct.pack('<L', len(morph_records)))  # 表情キーフレーム数
+            fout.write(morph_records)
+            fout.write(struct.pack('<L', len(camera_records)))  # カメラキーフレーム数
+            fout.write(camera_records)
+            fout.write(struct.pack('<L', len(light_records)))  # 照明キーフレーム数
+            fout.write(light_records)
+            fout.write(struct.pack('<L', len(shadow_records)))  # セルフ影キーフレーム数
+            fout.write(shadow_records)
+            fout.write(struct.pack('<L', len(motion.showiks)))  # モデル表示・IK on/offキーフレーム数
+            fout.write(self.encode_showik_frames())
+
+    # 出力対象のキーがあるか
+    def has_bone_key(self, frames):
+        if isinstance(frames, VmdBoneTrack):
+            return bool(np.any(frames.key_flags & (frames.fnos >= 0) & (frames.fnos <= 9999999999)))
+
+        return any(frames[fno].key for fno in frames.get_range_fnos(0, 9999999999))
+
+    # ボーン1件分のキーフレを、フレーム番号順の構造化配列にする
+    def encode_bone_frames(self, frames):
+        if isinstance(frames, VmdBoneTrack):
+            return self.encode_bone_track(frames)
+
+        return self.encode_bone_dict(frames)
+
+    # ボーン1件分のキーフレ辞書を、フレーム番号順の構造化配列にする
+    def encode_bone_dict(self, frames: dict):
+        bfs = [bf for bf in map(frames.__getitem__, frames.get_range_fnos(0, 9999999999)) if bf.key]
+
+        records = np.zeros(len(bfs), dtype=BONE_FRAME_DTYPE)
+        if len(bfs) == 0:
+            return records
+
+        bnames = {}
+        records["name"] = [bf.bname if bf.bname else bnames.setdefault(bf.name, self.encode_name(bf.name, 15)) for bf in bfs]
+        records["fno"] = [bf.fno for bf in bfs]
+        records["position"] = np.array([bf.position.data() for bf in bfs])
+        records["rotation"] = self.encode_rotations(quaternion.as_float_array(np.array([bf.rotation.data() for bf in bfs], dtype=np.quaternion)))
+
+        # 補間曲線は同じタプルを共有しているので、種類毎に一度だけ変換する
+        _, first_idxs, interpolation_idxs = np.unique([id(bf.interpolation) for bf in bfs], return_index=True, return_inverse=True)
+        records["interpolation"] = self.encode_interpolations([bfs[idx].interpolation for idx in first_idxs.tolist()])[interpolation_idxs.reshape(-1)]
+
+        return records
+
+    # ボーン1件分のトラックを、フレーム番号順の構造化配列にする
+    def encode_bone_track(self, track: VmdBoneTrack):
+        idxs = np.flatnonzero(track.key_flags & (track.fnos >= 0) & (track.fnos <= 9999999999))
+
+        records = np.zeros(len(idxs), dtype=BONE_FRAME_DTYPE)
+        records["name"] = track.bname if track.bname else self.encode_name(track.name, 15)
+        records["fno"] = track.fnos[idxs]
+        records["position"] = track.positions[idxs]
+        records["rotation"] = self.encode_rotations(track.rotations[idxs])
+        records["interpolation"] = self.encode_interpolations(track.interpolations[idxs])
+
+        return records
+
+    # モーフキーフレを出力順に並べた構造化配列
+    # 各モーフの最終キーを先に並べ、その後に各モーフの残りのキーをフレーム番号順に並べる
+    def encode_morph_frames(self):
+        motion = self.data_set.motion
+        morph_fnos = [(morph_name, motion.get_morph_fnos(morph_name)) for morph_name in motion.morphs.keys()]
+
+        mfs = [motion.morphs[morph_name][fnos[-1]] for morph_name, fnos in morph_fnos if len(fnos) > 0]
+        mfs.extend([motion.morphs[morph_name][fno] for morph_name, fnos in morph_fnos for fno in fnos[:-1]])
+
+        records = np.zeros(len(mfs), dtype=MORPH_FRAME_DTYPE)
+        if len(mfs) == 0:
+            return records
+
+        records["name"] = [mf.bname if mf.bname else self.encode_name(mf.name, 15) for mf in mfs]
+        records["fno"] = [mf.fno for mf in mfs]
+        records["ratio"] = [mf.ratio for mf in mfs]
+
+        return records
+
+    # カメラキーフレを出力順(フレーム番号の逆順)に並べた構造化配列
+    def encode_camera_frames(self):
+        cfs = self.data_set.motion.get_camera_frames()
+
+        records = np.zeros(len(cfs), dtype=CAMERA_FRAME_DTYPE)
+        if len(cfs) == 0:
+            return records
+
+        records["fno"] = [cf.fno for cf in cfs]
+        records["length"] = [cf.length for cf in cfs]
+        records["position"] = [cf.position.data() for cf in cfs]
+        records["euler"] = [cf.euler.data() for cf in cfs]
+        records["interpolation"] = self.encode_interpolations([cf.interpolation for cf in cfs])
+        records["angle"] = [cf.angle for cf in cfs]
+        records["perspective"] = [cf.perspective for cf in cfs]
+
+        return records
+
+    # 照明キーフレの構造化配列
+    def encode_light_frames(self):
+        lights = self.data_set.motion.lights
+
+        records = np.zeros(len(lights), dtype=LIGHT_FRAME_DTYPE)
+        if len(lights) == 0:
+            return records
+
+        records["fno"] = [light.fno for light in lights]
+        records["color"] = [light.color.data() for light in lights]
+        records["position"] = [light.position.data() for light in lights]
+
+        return records
+
+    # セルフ影キーフレの構造化配列
+    def encode_shadow_frames(self):
+        shadows = self.data_set.motion.shadows
+
+        records = np.zeros(len(shadows), dtype=SHADOW_FRAME_DTYPE)
+        if len(shadows) == 0:
+            return records
+
+        records["fno"] = [shadow.fno for shadow in shadows]
+        records["type"] = [shadow.type for shadow in shadows]
+        records["distance"] = [shadow.distance for shadow in shadows]
+
+        return records
+
+    # モデル表示・IK on/offキーフレのバイト列(IKの数がキー毎に違うので、まとめて連結する)
+    def encode_showik_frames(self):
+        showik_bytes = []
+
         for sf in self.data_set.motion.showiks:
-            sf.write(fout)
-        
-        fout.close()
+            showik_bytes.append(struct.pack('<LbL', sf.fno, sf.show, len(sf.ik)))
+            for k in sf.ik:
+                # IKボーン名20Byteの残りを\0で埋める
+                showik_bytes.append(struct.pack('<20sb', k.name, k.onoff))
+
+        return b''.join(showik_bytes)
+
+    # 回転(w, x, y, z)を正規化して、VMDの(x, y, z, w)の順に並べ替える
+    # MQuaternion.normalized と同じく、NaN・無限大は0にして、Scalarが0の場合は1にしてから正規化する
+    def encode_rotations(self, rotations: np.ndarray):
+        rotations = np.array(rotations, dtype=np.float64).reshape(-1, 4)
+        rotations[~np.isfinite(rotations)] = 0
+        rotations[rotations[:, 0] == 0, 0] = 1
+        rotations = rotations / np.sqrt(np.sum(rotations ** 2, axis=1))[:, np.newaxis]
+
+        return rotations[:, [1, 2, 3, 0]]
+
+    # 補間曲線を0～127に収める
+    def encode_interpolations(self, interpolations):
+        return np.clip(np.asarray(interpolations, dtype=np.float64), 0, 127).astype(np.uint8)
+
+    # 名前を指定byteで切る
+    def encode_name(self, name: str, format_size: int):
+        return name.encode('cp932').decode('shift_jis').encode('shift_jis')[:format_size].ljust(format_size, b'\x00')
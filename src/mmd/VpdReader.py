@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 #
-import hashlib
+import io
 import re
 
 from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame # noqa
 from module.MMath import MRect, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
+from utils import MFileUtils
 from utils.MException import MParseException # noqa
 from utils.MLogger import MLogger # noqa
 from utils.MException import SizingException, MKilledException
@@ -16,14 +17,13 @@ class VpdReader():
     def __init__(self, file_path):
         self.encoding = None
         self.file_path = file_path
+        self.buffer = None
+        self.digest = None
 
     # モデル名だけ取得
     def read_model_name(self):
         # VPDファイルを通常読み込み
-        lines = []
-
-        with open(self.file_path, "r", encoding=self.get_file_encoding(self.file_path)) as f:
-            lines = f.readlines()
+        lines = self.read_lines()
 
         if len(lines) > 0:
             # vpdバージョン
@@ -46,8 +46,7 @@ class VpdReader():
         lines = []
 
         try:
-            with open(self.file_path, "r", encoding=self.get_file_encoding(self.file_path)) as f:
-                lines = f.readlines()
+            lines = self.read_lines()
 
             if len(lines) > 0:
                 # vpdバージョン
@@ -139,29 +138,29 @@ class VpdReader():
         # 正規表現に合致するのが取れなかった場合、None
         return None
  
-    def hexdigest(self):
-        sha1 = hashlib.sha1()
+    # VPDファイルを一度だけ読み込む(ハッシュ値の計算と読み込みで同じバイト列を使う)
+    def open_buffer(self):
+        if self.buffer is None:
+            with open(self.file_path, "rb") as f:
+                self.buffer = f.read()
 
-        with open(self.file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(2048 * sha1.block_size), b''):
-                sha1.update(chunk)
+        return self.buffer
 
-        sha1.update(chunk)
+    # VPDファイルを行単位で取得する(テキストモードで読み込んだ場合と同じく改行を揃える)
+    def read_lines(self):
+        fbytes = self.open_buffer()
 
-        # ファイルパスをハッシュに含める
-        sha1.update(self.file_path.encode('utf-8'))
+        return io.StringIO(fbytes.decode(self.get_file_encoding(fbytes)), newline=None).readlines()
 
-        return sha1.hexdigest()
+    # ハッシュ値は、読み込みと同じバイト列から一度だけ計算する
+    def hexdigest(self):
+        if not self.digest:
+            self.digest = MFileUtils.calc_digest(self.open_buffer(), self.file_path)
+
+        return self.digest
         
     # ファイルのエンコードを取得する
-    def get_file_encoding(self, file_path):
-        try:
-            f = open(file_path, "rb")
-            fbytes = f.read()
-            f.close()
-        except Exception:
-            raise MParseException("unknown encoding!")
-            
+    def get_file_encoding(self, fbytes):
         codelst = ('shift-jis', 'utf_8')
         
         for encoding in codelst:
@@ -169,7 +168,7 @@ class VpdReader():
                 fstr = fbytes.decode(encoding)  # bytes文字列から指定文字コードの文字列に変換
                 fstr = fstr.encode('utf-8')  # uft-8文字列に変換
                 # 問題なく変換できたらエンコードを返す
-                logger.test("%s: encoding: %s", file_path, encoding)
+                logger.test("%s: encoding: %s", self.file_path, encoding)
                 return encoding
             except Exception:
                 pass
@@ -229,6 +229,13 @@ class MVector3D():
     def copy(self):
         return MVector3D(self.x(), self.y(), self.z())
 
+    # 配列を共有したベクトル(setX等の値の変更が元の配列にも反映される)
+    @classmethod
+    def fromBuffer(cls, data: np.ndarray):
+        v = cls.__new__(cls)
+        v.__data = data
+        return v
+
     def length(self):
         return np.linalg.norm(self.__data, ord=2)
 
@@ -363,6 +370,8 @@ class MVector3D():
     def __add__(self, other):
         if isinstance(other, MVector3D):
             v = self.__data + other.__data
+        elif isinstance(other, MVector3DArray):
+            return MVector3DArray(self.__data + other.data()).effective()
         else:
             v = self.__data + other
         v2 = self.__class__(v)
@@ -372,6 +381,8 @@ class MVector3D():
     def __sub__(self, other):
         if isinstance(other, MVector3D):
             v = self.__data - other.__data
+        elif isinstance(other, MVector3DArray):
+            return MVector3DArray(self.__data - other.data()).effective()
         else:
             v = self.__data - other
         v2 = self.__class__(v)
@@ -381,6 +392,8 @@ class MVector3D():
     def __mul__(self, other):
         if isinstance(other, MVector3D):
             v = self.__data * other.__data
+        elif isinstance(other, MVector3DArray):
+            return MVector3DArray(self.__data * other.data()).effective()
         else:
             v = self.__data * other
         v2 = self.__class__(v)
@@ -487,6 +500,146 @@ class MVector3D():
         self.__data[2] = z
 
 
+# 複数の位置をまとめて扱うクラス(N×3: x, y, z の配列)
+# 配列は共有されるので、+= 等の変更は元の配列(ボーントラックの位置等)にも反映される
+class MVector3DArray():
+
+    def __init__(self, data=None):
+        if isinstance(data, MVector3DArray):
+            # クラスの場合
+            self.__data = data.__data
+        elif isinstance(data, MVector3D):
+            # 単体の位置の場合
+            self.__data = np.array([data.data()], dtype=np.float64)
+        elif data is None:
+            self.__data = np.zeros((0, 3), dtype=np.float64)
+        elif len(data) > 0 and isinstance(data[0], MVector3D):
+            # 位置のリストの場合
+            self.__data = np.array([v.data() for v in data], dtype=np.float64)
+        else:
+            self.__data = np.asarray(data, dtype=np.float64).reshape(-1, 3)
+
+    def copy(self):
+        return MVector3DArray(self.__data.copy())
+
+    def __str__(self):
+        return "MVector3DArray({0})".format(self.__data.tolist())
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return MVector3D(self.__data[idx])
+        return MVector3DArray(self.__data[idx])
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, (int, np.integer)) and isinstance(value, np.ndarray):
+            # 1件の位置に代入する場合、配列はそのまま1つのベクトルとして扱う
+            self.__data[idx] = value
+        else:
+            self.__data[idx] = MVector3DArray.to_data(value)
+
+    def data(self):
+        return self.__data
+
+    def toVectors(self):
+        return [MVector3D(v) for v in self.__data]
+
+    def x(self):
+        return self.__data[:, 0]
+
+    def y(self):
+        return self.__data[:, 1]
+
+    def z(self):
+        return self.__data[:, 2]
+
+    def length(self):
+        return np.linalg.norm(self.__data, ord=2, axis=1)
+
+    def lengthSquared(self):
+        return np.linalg.norm(self.__data, ord=2, axis=1)**2
+
+    def normalized(self):
+        l2 = np.linalg.norm(self.__data, ord=2, axis=-1, keepdims=True)
+        l2[l2 == 0] = 1
+        return MVector3DArray(self.__data / l2)
+
+    def distanceToPoint(self, v):
+        return np.linalg.norm(self.__data - MVector3DArray.to_data(v), ord=2, axis=1)
+
+    def effective(self):
+        self.__data[~np.isfinite(self.__data)] = 0
+
+        return self
+
+    @classmethod
+    def crossProduct(cls, v1, v2):
+        return MVector3DArray(np.cross(MVector3DArray.to_data(v1), MVector3DArray.to_data(v2)))
+
+    @classmethod
+    def dotProduct(cls, v1, v2):
+        return np.sum(MVector3DArray.to_data(v1) * MVector3DArray.to_data(v2), axis=-1)
+
+    # 計算相手の値を配列にする(MVector3D・MVector3DArrayはそのまま、1次元の配列は要素数に関わらず各位置毎の値とする)
+    # 1つのベクトルを全位置に掛ける場合は、MVector3Dで渡す
+    @classmethod
+    def to_data(cls, other):
+        if isinstance(other, MVector3DArray):
+            return other.__data
+        elif isinstance(other, MVector3D):
+            return other.data()
+        elif isinstance(other, np.ndarray) and other.ndim == 1:
+            return other.reshape(-1, 1)
+        return other
+
+    def __eq__(self, other):
+        return np.all(self.__data == MVector3DArray.to_data(other), axis=1)
+
+    def __ne__(self, other):
+        return np.any(self.__data != MVector3DArray.to_data(other), axis=1)
+
+    def __add__(self, other):
+        return MVector3DArray(self.__data + MVector3DArray.to_data(other)).effective()
+
+    def __sub__(self, other):
+        return MVector3DArray(self.__data - MVector3DArray.to_data(other)).effective()
+
+    def __mul__(self, other):
+        return MVector3DArray(self.__data * MVector3DArray.to_data(other)).effective()
+
+    def __truediv__(self, other):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return MVector3DArray(self.__data / MVector3DArray.to_data(other)).effective()
+
+    def __radd__(self, other):
+        return self.__add__(other)
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def __iadd__(self, other):
+        self.__data += MVector3DArray.to_data(other)
+        return self.effective()
+
+    def __isub__(self, other):
+        self.__data -= MVector3DArray.to_data(other)
+        return self.effective()
+
+    def __imul__(self, other):
+        self.__data *= MVector3DArray.to_data(other)
+        return self.effective()
+
+    def __itruediv__(self, other):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.__data /= MVector3DArray.to_data(other)
+        return self.effective()
+
+    def __neg__(self):
+        return MVector3DArray(-self.__data)
+
+
 class MVector4D():
 
     def __init__(self, x=0, y=0, z=0, w=0):
@@ -498,7 +651,14 @@ class MVector4D():
             self.__data = np.array([x[0], x[1], x[2], x[3]], dtype=np.float64)
         else:
             self.__data = np.array([x, y, z, w], dtype=np.float64)
-    
+
+    # 配列を共有したベクトル(値の変更が元の配列にも反映される)
+    @classmethod
+    def fromBuffer(cls, data: np.ndarray):
+        v = cls.__new__(cls)
+        v.__data = data
+        return v
+
     def length(self):
         return np.linalg.norm(self.__data, ord=2)
 
@@ -1091,6 +1251,8 @@ class MQuaternion():
         elif isinstance(other, MVector3D):
             v = self.toMatrix4x4() * other
             return v
+        elif isinstance(other, MQuaternionArray):
+            return other.__rmul__(self)
         else:
             v = self.__data * other
             return self.__class__(v.w, v.x, v.y, v.z)
@@ -1159,6 +1321,320 @@ class MQuaternion():
         return self.__class__(~self.__data.w, ~self.__data.x, ~self.__data.y, ~self.__data.z)
 
 
+# 複数の回転をまとめて扱うクラス(N×4: w, x, y, z の配列)
+class MQuaternionArray():
+
+    def __init__(self, data=None):
+        if isinstance(data, MQuaternionArray):
+            # クラスの場合
+            self.__data = data.__data
+        elif isinstance(data, MQuaternion):
+            # 単体の回転の場合
+            self.__data = np.array([[data.scalar(), data.x(), data.y(), data.z()]], dtype=np.float64)
+        elif data is None:
+            self.__data = np.zeros((0, 4), dtype=np.float64)
+        elif len(data) > 0 and isinstance(data[0], MQuaternion):
+            # 回転のリストの場合
+            self.__data = np.array([[q.scalar(), q.x(), q.y(), q.z()] for q in data], dtype=np.float64)
+        else:
+            self.__data = np.asarray(data, dtype=np.float64).reshape(-1, 4)
+
+    def copy(self):
+        return MQuaternionArray(self.__data.copy())
+
+    def __str__(self):
+        return "MQuaternionArray({0})".format(self.__data.tolist())
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return MQuaternion(self.__data[idx])
+        return MQuaternionArray(self.__data[idx])
+
+    def __setitem__(self, idx, value):
+        if isinstance(value, MQuaternion):
+            self.__data[idx] = [value.scalar(), value.x(), value.y(), value.z()]
+        elif isinstance(value, MQuaternionArray):
+            self.__data[idx] = value.__data
+        else:
+            self.__data[idx] = value
+
+    def data(self):
+        return self.__data
+
+    def toQuaternions(self):
+        return [MQuaternion(q) for q in self.__data]
+
+    def inverted(self):
+        return MQuaternionArray(quaternion.as_float_array(np.reciprocal(quaternion.as_quat_array(self.__data))))
+
+    def length(self):
+        return np.linalg.norm(self.__data, ord=2, axis=1)
+
+    def normalized(self):
+        v = self.__data.copy()
+        v[~np.isfinite(v)] = 0
+        # Scalarは1がデフォルトとなる
+        v[v[:, 0] == 0, 0] = 1
+        v /= np.linalg.norm(v, ord=2, axis=1)[:, np.newaxis]
+        return MQuaternionArray(v)
+
+    # 回転行列(N×4×4)
+    def toMatrix4x4(self):
+        w = self.__data[:, 0]
+        x = self.__data[:, 1]
+        y = self.__data[:, 2]
+        z = self.__data[:, 3]
+
+        m = np.zeros((len(self.__data), 4, 4), dtype=np.float64)
+
+        m[:, 0, 0] = w * w + x * x - y * y - z * z
+        m[:, 0, 1] = 2.0 * x * y - 2.0 * w * z
+        m[:, 0, 2] = 2.0 * x * z + 2.0 * w * y
+
+        m[:, 1, 0] = 2.0 * x * y + 2.0 * w * z
+        m[:, 1, 1] = w * w - x * x + y * y - z * z
+        m[:, 1, 2] = 2.0 * y * z - 2.0 * w * x
+
+        m[:, 2, 0] = 2.0 * x * z - 2.0 * w * y
+        m[:, 2, 1] = 2.0 * y * z + 2.0 * w * x
+        m[:, 2, 2] = w * w - x * x - y * y + z * z
+
+        m[:, 3, 3] = w * w + x * x + y * y + z * z
+
+        m /= m[:, 3, 3][:, np.newaxis, np.newaxis]
+        m[:, 3, 3] = 1.0
+
+        return m
+
+    def toEulerAngles4MMD(self):
+        # MMDの表記に合わせたオイラー角
+        euler = self.toEulerAngles()
+        euler[:, 1:] *= -1
+
+        return euler
+
+    # オイラー角(N×3: pitch, yaw, roll)
+    def toEulerAngles(self):
+        wp = self.__data[:, 0]
+        xp = self.__data[:, 1]
+        yp = self.__data[:, 2]
+        zp = self.__data[:, 3]
+
+        xx = xp * xp
+        xy = xp * yp
+        xz = xp * zp
+        xw = xp * wp
+        yy = yp * yp
+        yz = yp * zp
+        yw = yp * wp
+        zz = zp * zp
+        zw = zp * wp
+        lengthSquared = xx + yy + zz + wp * wp
+
+        scale = np.where((np.abs(lengthSquared - 1.0) >= 0.0000001) & (np.abs(lengthSquared) >= 0.0000001), lengthSquared, 1)
+        xx = xx / scale
+        xy = xy / scale
+        xz = xz / scale
+        xw = xw / scale
+        yy = yy / scale
+        yz = yz / scale
+        yw = yw / scale
+        zz = zz / scale
+        zw = zw / scale
+
+        pitch = np.arcsin(np.clip(-2.0 * (yz - xw), -1, 1))
+        yaw = np.arctan2(2.0 * (xz + yw), 1.0 - 2.0 * (xx + yy))
+        roll = np.arctan2(2.0 * (xy + zw), 1.0 - 2.0 * (xx + zz))
+
+        # not a unique solution
+        upper_mask = pitch >= (math.pi / 2)
+        lower_mask = pitch <= -(math.pi / 2)
+        yaw[upper_mask] = np.arctan2(-2.0 * (xy[upper_mask] - zw[upper_mask]), 1.0 - 2.0 * (yy[upper_mask] + zz[upper_mask]))
+        yaw[lower_mask] = -np.arctan2(-2.0 * (xy[lower_mask] - zw[lower_mask]), 1.0 - 2.0 * (yy[lower_mask] + zz[lower_mask]))
+        roll[upper_mask | lower_mask] = 0.0
+
+        return np.degrees(np.stack([pitch, yaw, roll], axis=1))
+
+    # 角度に変換
+    def toDegree(self):
+        return np.degrees(2 * np.arccos(np.clip(self.__data[:, 0], -1, 1)))
+
+    @classmethod
+    def dotProduct(cls, v1, v2):
+        return np.sum(MQuaternionArray(v1).__data * MQuaternionArray(v2).__data, axis=1)
+
+    # 軸(N×3もしくはMVector3D)と角度(度数)からまとめて回転を生成する
+    @classmethod
+    def fromAxisAndAngle(cls, vec3, angle):
+        axis = np.array(vec3.data() if isinstance(vec3, MVector3D) else vec3, dtype=np.float64).reshape(-1, 3)
+        angle = np.asarray(angle, dtype=np.float64).reshape(-1)
+        axis, angle = np.broadcast_arrays(axis, angle[:, np.newaxis])
+        axis = axis.copy()
+        angle = angle[:, 0]
+
+        length = np.sqrt(np.sum(axis * axis, axis=1))
+        length_mask = (np.abs(length - 1.0) >= 0.0000001) & (np.abs(length) >= 0.0000001)
+        axis[length_mask] /= length[length_mask][:, np.newaxis]
+
+        a = np.radians(angle / 2.0)
+        s = np.sin(a)
+        c = np.cos(a)
+        return MQuaternionArray(np.stack([c, axis[:, 0] * s, axis[:, 1] * s, axis[:, 2] * s], axis=1)).normalized()
+
+    # オイラー角(度数)からまとめて回転を生成する
+    @classmethod
+    def fromEulerAngles(cls, pitch, yaw, roll):
+        pitch, yaw, roll = np.broadcast_arrays(np.radians(np.asarray(pitch, dtype=np.float64)).reshape(-1), \
+                                               np.radians(np.asarray(yaw, dtype=np.float64)).reshape(-1), \
+                                               np.radians(np.asarray(roll, dtype=np.float64)).reshape(-1))
+
+        pitch = pitch * 0.5
+        yaw = yaw * 0.5
+        roll = roll * 0.5
+
+        c1 = np.cos(yaw)
+        s1 = np.sin(yaw)
+        c2 = np.cos(roll)
+        s2 = np.sin(roll)
+        c3 = np.cos(pitch)
+        s3 = np.sin(pitch)
+        c1c2 = c1 * c2
+        s1s2 = s1 * s2
+        w = c1c2 * c3 + s1s2 * s3
+        x = c1c2 * s3 + s1s2 * c3
+        y = s1 * c2 * c3 - c1 * s2 * s3
+        z = c1 * s2 * c3 - s1 * c2 * s3
+
+        return MQuaternionArray(np.stack([w, x, y, z], axis=1))
+
+    # MQuaternion.slerp をまとめて行う
+    @classmethod
+    def slerp(cls, q1, q2, t):
+        q1s = MQuaternionArray(q1).__data
+        q2s = MQuaternionArray(q2).__data
+        q1s, q2s = np.broadcast_arrays(q1s, q2s)
+        ts = np.broadcast_to(np.asarray(t, dtype=np.float64).reshape(-1), (len(q1s),))
+
+        q2bs = q2s.copy()
+        dots = q1s[:, 0] * q2s[:, 0] + q1s[:, 1] * q2s[:, 1] + q1s[:, 2] * q2s[:, 2] + q1s[:, 3] * q2s[:, 3]
+
+        neg_mask = dots < 0.0
+        q2bs[neg_mask] = -q2bs[neg_mask]
+        dots = np.where(neg_mask, -dots, dots)
+
+        # Get the scale factors.  If they are too small,
+        # then revert to simple linear interpolation.
+        factor1s = 1.0 - ts
+        factor2s = ts.copy()
+
+        angles = np.arccos(np.clip(dots, 0, 1))
+        sin_of_angles = np.sin(angles)
+        angle_mask = ((1.0 - dots) > 0.0000001) & (sin_of_angles > 0.0000001)
+        factor1s[angle_mask] = np.sin((1.0 - ts[angle_mask]) * angles[angle_mask]) / sin_of_angles[angle_mask]
+        factor2s[angle_mask] = np.sin(ts[angle_mask] * angles[angle_mask]) / sin_of_angles[angle_mask]
+
+        results = q1s * factor1s[:, np.newaxis] + q2bs * factor2s[:, np.newaxis]
+
+        # Handle the easy cases
+        results[ts <= 0.0] = q1s[ts <= 0.0]
+        results[ts >= 1.0] = q2s[ts >= 1.0]
+
+        return MQuaternionArray(results)
+
+    # MQuaternion.rotationTo をまとめて行う(fromv, tov: N×3もしくはMVector3D)
+    @classmethod
+    def rotationTo(cls, fromv, tov):
+        v0s = np.array(fromv.data() if isinstance(fromv, MVector3D) else fromv, dtype=np.float64).reshape(-1, 3)
+        v1s = np.array(tov.data() if isinstance(tov, MVector3D) else tov, dtype=np.float64).reshape(-1, 3)
+        v0s, v1s = np.broadcast_arrays(v0s, v1s)
+        v0s = MVector3DArray(v0s.copy()).normalized().data()
+        v1s = MVector3DArray(v1s.copy()).normalized().data()
+        ds = np.sum(v0s * v1s, axis=1) + 1.0
+
+        results = np.zeros((len(v0s), 4), dtype=np.float64)
+
+        # if dest vector is close to the inverse of source vector, ANY axis of rotation is valid
+        null_mask = np.abs(ds) < 0.0000001
+        axis = np.cross(np.array([1.0, 0.0, 0.0]), v0s[null_mask])
+        y_mask = np.sum(axis * axis, axis=1) < 0.0000001
+        axis[y_mask] = np.cross(np.array([0.0, 1.0, 0.0]), v0s[null_mask][y_mask])
+        results[null_mask, 1:] = MVector3DArray(axis).normalized().data()
+
+        ds = np.sqrt(2.0 * ds[~null_mask])
+        results[~null_mask, 0] = ds * 0.5
+        results[~null_mask, 1:] = np.cross(v0s[~null_mask], v1s[~null_mask]) / ds[:, np.newaxis]
+
+        return MQuaternionArray(results).normalized()
+
+    # MMatrix4x4.toQuaternion をまとめて行う(mats: N×4×4)
+    @classmethod
+    def fromMatrix4x4(cls, mats):
+        a = np.asarray(mats, dtype=np.float64).reshape(-1, 4, 4)
+        results = np.zeros((len(a), 4), dtype=np.float64)
+
+        trace = a[:, 0, 0] + a[:, 1, 1] + a[:, 2, 2]
+        trace_mask = trace > 0
+        x_mask = ~trace_mask & (a[:, 0, 0] > a[:, 1, 1]) & (a[:, 0, 0] > a[:, 2, 2])
+        y_mask = ~trace_mask & ~x_mask & (a[:, 1, 1] > a[:, 2, 2])
+        z_mask = ~trace_mask & ~x_mask & ~y_mask
+
+        m = a[trace_mask]
+        s = 0.5 / np.sqrt(trace[trace_mask] + 1)
+        results[trace_mask] = np.stack([0.25 / s, (m[:, 2, 1] - m[:, 1, 2]) * s, (m[:, 0, 2] - m[:, 2, 0]) * s, (m[:, 1, 0] - m[:, 0, 1]) * s], axis=1)
+
+        m = a[x_mask]
+        s = 2 * np.sqrt(1 + m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2])
+        results[x_mask] = np.stack([(m[:, 2, 1] - m[:, 1, 2]) / s, 0.25 * s, (m[:, 0, 1] + m[:, 1, 0]) / s, (m[:, 0, 2] + m[:, 2, 0]) / s], axis=1)
+
+        m = a[y_mask]
+        s = 2 * np.sqrt(1 + m[:, 1, 1] - m[:, 0, 0] - m[:, 2, 2])
+        results[y_mask] = np.stack([(m[:, 0, 2] - m[:, 2, 0]) / s, (m[:, 0, 1] + m[:, 1, 0]) / s, 0.25 * s, (m[:, 1, 2] + m[:, 2, 1]) / s], axis=1)
+
+        m = a[z_mask]
+        s = 2 * np.sqrt(1 + m[:, 2, 2] - m[:, 0, 0] - m[:, 1, 1])
+        results[z_mask] = np.stack([(m[:, 1, 0] - m[:, 0, 1]) / s, (m[:, 0, 2] + m[:, 2, 0]) / s, (m[:, 1, 2] + m[:, 2, 1]) / s, 0.25 * s], axis=1)
+
+        return MQuaternionArray(results)
+
+    def __eq__(self, other):
+        return np.all(self.__data == MQuaternionArray(other).__data, axis=1)
+
+    def __ne__(self, other):
+        return np.any(self.__data != MQuaternionArray(other).__data, axis=1)
+
+    def __add__(self, other):
+        if isinstance(other, (MQuaternion, MQuaternionArray)):
+            return MQuaternionArray(self.__data + MQuaternionArray(other).__data)
+        return MQuaternionArray(self.__data + other)
+
+    def __sub__(self, other):
+        if isinstance(other, (MQuaternion, MQuaternionArray)):
+            return MQuaternionArray(self.__data - MQuaternionArray(other).__data)
+        return MQuaternionArray(self.__data - other)
+
+    # 回転同士の場合は要素毎の積(長さ1の場合は全要素に掛ける)
+    def __mul__(self, other):
+        if isinstance(other, (MQuaternion, MQuaternionArray)):
+            v = quaternion.as_quat_array(self.__data) * quaternion.as_quat_array(MQuaternionArray(other).__data)
+            return MQuaternionArray(quaternion.as_float_array(v))
+        elif isinstance(other, np.ndarray):
+            return MQuaternionArray(self.__data * other.reshape(-1, 1))
+        return MQuaternionArray(self.__data * other)
+
+    def __rmul__(self, other):
+        if isinstance(other, MQuaternion):
+            return MQuaternionArray(other) * self
+        elif isinstance(other, np.ndarray):
+            return MQuaternionArray(self.__data * other.reshape(-1, 1))
+        return MQuaternionArray(self.__data * other)
+
+    def __neg__(self):
+        return MQuaternionArray(-self.__data)
+
+
 class MMatrix4x4():
     
     def __init__(self, m11=1, m12=0, m13=0, m14=0, m21=0, m22=1, m23=0, m24=0, m31=0, m32=0, m33=1, m34=0, m41=0, m42=0, m43=0, m44=1):
@@ -2,11 +2,13 @@
 #
 import os
 import sys
+import copy
 import argparse
 
 from mmd.PmxReader import PmxReader
 from mmd.VmdReader import VmdReader
 from mmd.VpdReader import VpdReader
+from mmd.VmdData import VmdBoneDict
 from module.MMath import MRect, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
 from utils import MFileUtils
 from utils.MException import SizingException
@@ -18,7 +20,7 @@ logger = MLogger(__name__)
 class MOptions():
 
     def __init__(self, version_name, logging_level, max_workers, data_set_list, arm_options, \
-                 camera_motion, camera_output_vmd_path, monitor, is_file, outout_datetime):
+                 camera_motion, camera_output_vmd_path, monitor, is_file, outout_datetime, is_process=False):
         self.version_name = version_name
         self.logging_level = logging_level
         self.max_workers = max_workers
@@ -29,7 +31,26 @@ class MOptions():
         self.monitor = monitor
         self.is_file = is_file
         self.outout_datetime = outout_datetime
+        # データセット単位の処理をプロセス並列で行うか否か
+        self.is_process = is_process
     
+    # 指定データセットだけをプロセスに渡すためのオプションを生成する
+    # 番号表記と剛体接触回避対象の参照を変えないよう、他のデータセットはNoneでINDEXを維持する
+    # 元モーションのボーンを共有メモリで渡す場合、オプションには元モーションのボーンを含めない
+    # max_workers: プロセス内のスレッド数(未指定の場合、元と同じ)
+    def copy_process_options(self, target_data_set_idx: int, is_shared_org_bones=False, max_workers=None):
+        data_set_list = [(data_set if data_set_idx == target_data_set_idx else None) for data_set_idx, data_set in enumerate(self.data_set_list)]
+
+        if is_shared_org_bones:
+            data_set = copy.copy(data_set_list[target_data_set_idx])
+            data_set.org_motion = copy.copy(data_set.org_motion)
+            data_set.org_motion.bones = VmdBoneDict()
+            data_set_list[target_data_set_idx] = data_set
+
+        # GUIのコンソールはプロセス間で受け渡せないので、プロセス側で標準出力に差し替える
+        return MOptions(self.version_name, self.logging_level, (max_workers or self.max_workers), data_set_list, self.arm_options, \
+                        None, None, None, self.is_file, self.outout_datetime, is_process=False)
+
     # 複数件のファイルセットの足IKの比率を再設定する
     def calc_leg_ratio(self):
         # まず一番小さいXZ比率と一番大きいXZ比率を取得する
@@ -84,6 +105,9 @@ class MOptions():
         parser.add_argument("--camera_motion_path", type=str, default="")
         parser.add_argument("--camera_org_model_path", default=[], type=(lambda x: list(map(str, x.split(';')))))
         parser.add_argument("--camera_offset_y", default=[], type=(lambda x: list(map(str, x.split(';')))))
+        parser.add_argument("--model_cache_dir", type=str, default="", \
+                            help="解析済みモデルのキャッシュ先。キャッシュはpickle形式で読み込むため、自分しか書き込めない信頼できるディレクトリを指定すること")
+        parser.add_argument("--model_cache_max_mb", type=int, default=1024, help="モデルキャッシュの上限サイズ(MB)")
         parser.add_argument("--verbose", type=int, default=20)
 
         args = parser.parse_args()
@@ -136,7 +160,7 @@ class MOptions():
                 
                 file_name, input_ext = os.path.splitext(os.path.basename(motion_path))
                 if input_ext.lower() == ".vmd":
-                    motion_reader = VmdReader(motion_path)
+                    motion_reader = VmdReader(motion_path, is_lazy=True)
                 elif input_ext.lower() == ".vpd":
                     motion_reader = VpdReader(motion_path)
                 else:
@@ -151,7 +175,7 @@ class MOptions():
 
                 file_name, input_ext = os.path.splitext(os.path.basename(org_model_path))
                 if input_ext.lower() == ".pmx":
-                    org_model_reader = PmxReader(org_model_path)
+                    org_model_reader = PmxReader(org_model_path, cache_dir=args.model_cache_dir, cache_max_bytes=args.model_cache_max_mb * 1024 * 1024, is_lazy=True)
                 else:
                     raise SizingException("{0}.org_model_path 読み込み失敗(拡張子不正): {1}".format(display_set_no, os.path.basename(org_model_path)))
                 
@@ -164,7 +188,7 @@ class MOptions():
 
                 file_name, input_ext = os.path.splitext(os.path.basename(rep_model_path))
                 if input_ext.lower() == ".pmx":
-                    rep_model_reader = PmxReader(rep_model_path)
+                    rep_model_reader = PmxReader(rep_model_path, cache_dir=args.model_cache_dir, cache_max_bytes=args.model_cache_max_mb * 1024 * 1024, is_lazy=True)
                 else:
                     raise SizingException("{0}.rep_model_path 読み込み失敗(拡張子不正): {1}".format(display_set_no, os.path.basename(rep_model_path)))
                 
@@ -178,7 +202,7 @@ class MOptions():
 
                     file_name, input_ext = os.path.splitext(os.path.basename(camera_org_model_path))
                     if input_ext.lower() == ".pmx":
-                        camera_org_model_reader = PmxReader(camera_org_model_path)
+                        camera_org_model_reader = PmxReader(camera_org_model_path, cache_dir=args.model_cache_dir, cache_max_bytes=args.model_cache_max_mb * 1024 * 1024, is_lazy=True)
                     else:
                         raise SizingException("{0}.camera_org_model_path 読み込み失敗(拡張子不正): {1}".format(display_set_no, os.path.basename(camera_org_model_path)))
                     
@@ -238,7 +262,8 @@ class MOptions():
                 monitor=sys.stdout, \
                 is_file=True, \
                 outout_datetime=logger.outout_datetime, \
-                max_workers=1)
+                max_workers=(os.cpu_count() or 1), \
+                is_process=(len(data_set_list) > 1))
 
             return options
         except SizingException as se:
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 #
+import threading
 from collections import OrderedDict
 
 
@@ -110,8 +111,48 @@ class BoneLinks():
                 
         return new_links
         
+    # キャッシュ用のキー(ボーン名と位置の組み合わせ)
+    def cache_key(self):
+        return tuple((lkey, tuple(bone.position.data().tolist())) for lkey, bone in self.__links.items())
+
     def __str__(self):
         return "<BoneLinks links:{0}".format(self.__links)
 
 
+# グローバル位置のキャッシュ
+# 上限件数を超えた場合、最も長く参照されていないものから削除する
+class PoseCache():
+    def __init__(self, max_size=20000):
+        self.max_size = max_size
+        self.__cache = OrderedDict()
+        # スレッドから並行して参照・登録されるので、順番の入れ替えと削除はロックして行う
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.__lock:
+            if key not in self.__cache:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.__cache.move_to_end(key)
+            return self.__cache[key]
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__cache[key] = value
+            self.__cache.move_to_end(key)
 
+            while len(self.__cache) > self.max_size:
+                self.__cache.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def size(self):
+        return len(self.__cache)
@@ -11,8 +11,17 @@ class StdoutQueue():
 
     # 初期化
     def __init__(self, *args, **kwargs):
-        m = multiprocessing.Manager()
-        self.queue = m.Queue(*args, **kwargs)
+        # マネージャが解放されるとキューも使えなくなるので、保持しておく
+        self.manager = multiprocessing.Manager()
+        self.queue = self.manager.Queue(*args, **kwargs)
+
+    # 別プロセスにはキューだけを渡す
+    def __getstate__(self):
+        return {"queue": self.queue}
+
+    def close(self):
+        if getattr(self, "manager", None):
+            self.manager.shutdown()
 
     def get(self, *args, **kwargs):
         try:
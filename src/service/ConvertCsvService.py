@@ -7,6 +7,7 @@ import traceback
 from datetime import datetime
 
 from module.MOptions import MCsvOptions
+from module.MMath import MQuaternionArray
 from utils import MFileUtils
 from utils.MException import SizingException
 from utils.MLogger import MLogger # noqa
@@ -67,11 +68,15 @@ class ConvertCsvService():
                 f.write("\n")
 
                 for bone_name in self.options.motion.bones:
-                    for fno in self.options.motion.get_bone_fnos(bone_name):
-                        bf = self.options.motion.bones[bone_name][fno]
+                    fnos = self.options.motion.get_bone_fnos(bone_name)
+                    bfs = [self.options.motion.bones[bone_name][fno] for fno in fnos]
+                    # ボーン単位でまとめてオイラー角に変換しておく
+                    eulers = MQuaternionArray([bf.rotation for bf in bfs]).toEulerAngles4MMD().tolist()
+
+                    for bf, euler in zip(bfs, eulers):
                         s = "{0},{1},{2},{3},{4},{5},{6},{7},{8}".format(bf.name, bf.fno, \
-                                                                         bf.position.x(), bf.position.y(), bf.position.z(), bf.rotation.toEulerAngles4MMD().x(), \
-                                                                         bf.rotation.toEulerAngles4MMD().y(), bf.rotation.toEulerAngles4MMD().z(), ','.join([str(i) for i in bf.interpolation]))
+                                                                         bf.position.x(), bf.position.y(), bf.position.z(), euler[0], \
+                                                                         euler[1], euler[2], ','.join([str(i) for i in bf.interpolation]))
                         f.write(s)
                         f.write("\n")
 
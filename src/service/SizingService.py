@@ -3,11 +3,19 @@
 
 import logging
 import os
+import sys
+import time
+import queue
+import threading
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 from mmd.PmxData import PmxModel
+from mmd.VmdData import VmdSharedBones
 from mmd.VmdWriter import VmdWriter
 from module.MOptions import MOptions, MOptionsDataSet
+from module.StdoutQueue import StdoutQueue
 from service.parts.MoveService import MoveService
 from service.parts.StanceService import StanceService
 from service.parts.ArmAlignmentService import ArmAlignmentService
@@ -28,6 +36,10 @@ class SizingService():
     def execute(self):
         logging.basicConfig(level=self.options.logging_level, format="%(message)s [%(module_name)s]")
 
+        # 前回実行分のポーズが残らないよう、実行ごとにキャッシュを空にする
+        MServiceUtils.pose_cache.clear()
+        MServiceUtils.deform_cache.clear()
+
         try:
             service_data_txt = "VMDサイジング処理実行\n------------------------\nexeバージョン: {version_name}\n".format(version_name=self.options.version_name)
 
@@ -88,19 +100,29 @@ class SizingService():
             # 足IKの比率再計算
             self.options.calc_leg_ratio()
 
-            # 移動補正
-            if not MoveService(self.options).execute():
-                return False
+            # 全データセットを参照する補正がない場合、データセット毎の補正が終わった時点でモーションが確定する
+            is_output_process = False
 
-            # スタンス補正
-            if not StanceService(self.options).execute():
-                return False
+            if self.options.is_process and len(self.options.data_set_list) > 1:
+                # 移動補正・スタンス補正・剛体接触回避はデータセット毎にプロセス並列で実行
+                # 確定したモーションはプロセス側でそのまま出力し、親プロセスには戻さない
+                is_output_process = not self.options.arm_options.alignment and not self.options.camera_motion
+                if not self.execute_process(is_output_process):
+                    return False
+            else:
+                # 移動補正
+                if not MoveService(self.options).execute():
+                    return False
 
-            # 剛体接触回避
-            if self.options.arm_options.avoidance:
-                if not ArmAvoidanceService(self.options).execute():
+                # スタンス補正
+                if not StanceService(self.options).execute():
                     return False
 
+                # 剛体接触回避
+                if self.options.arm_options.avoidance:
+                    if not ArmAvoidanceService(self.options).execute():
+                        return False
+
             # 手首位置合わせ
             if self.options.arm_options.alignment:
                 if not ArmAlignmentService(self.options).execute():
@@ -111,22 +133,14 @@ class SizingService():
                 if not CameraService(self.options).execute():
                     return False
 
-            # モーフ置換
-            if not MorphService(self.options).execute():
-                return False
-            
-            for data_set_idx, data_set in enumerate(self.options.data_set_list):
-                # 実行後、出力ファイル存在チェック
-                try:
-                    # 出力
-                    VmdWriter(data_set).write()
-
-                    Path(data_set.output_vmd_path).resolve(True)
-
-                    logger.info("【No.%s】 出力終了: %s", (data_set_idx + 1), os.path.basename(data_set.output_vmd_path), decoration=MLogger.DECORATION_BOX, title="サイジング成功")
+            if not is_output_process:
+                # モーフ置換
+                if not MorphService(self.options).execute():
+                    return False
 
-                except FileNotFoundError as fe:
-                    logger.error("【No.%s】出力VMDファイルが正常に作成されなかったようです。\nパスを確認してください。%s\n\n%s", (data_set_idx + 1), data_set.output_vmd_path, fe.message, decoration=MLogger.DECORATION_BOX)
+                for data_set_idx, data_set in enumerate(self.options.data_set_list):
+                    # 出力したデータセットから順にメモリを解放する
+                    write_data_set(data_set_idx, data_set)
             
             if self.options.camera_motion:
                 try:
@@ -153,3 +167,151 @@ class SizingService():
             return False
         finally:
             logging.shutdown()
+
+    # データセット単位で独立している処理をプロセス並列で実行する
+    def execute_process(self, is_output: bool):
+        avoidance_data_set_idxs = []
+        if self.options.arm_options.avoidance:
+            # 接触回避対象の判定は全データセットを見て親プロセスで行う
+            avoidance_data_set_idxs = ArmAvoidanceService(self.options).get_target_set_idxs()
+
+            if len(avoidance_data_set_idxs) == 0:
+                logger.warning("接触回避ができるファイルセットが見つからなかったため、処理をスキップします。", decoration=MLogger.DECORATION_BOX)
+
+        futures = {}
+        shared_org_bones = {}
+        # プロセス側のログは、キュー経由で親プロセスのコンソール(GUIの場合は画面)に出力する
+        monitor_queue = StdoutQueue()
+        # 親プロセスに停止命令が出た場合、プロセス側にも伝える
+        kill_event = monitor_queue.manager.Event()
+        # プロセス数はCPU数まで。各プロセス内のスレッド数は、CPUを超えないように割り振る
+        max_workers = max(1, min(len(self.options.data_set_list), self.options.max_workers, (os.cpu_count() or 1)))
+        process_max_workers = max(1, self.options.max_workers // max_workers)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for data_set_idx, data_set in enumerate(self.options.data_set_list):
+                    # 元モーションは参照するだけなので、共有メモリに置いてコピーせずに渡す
+                    shared_org_bones[data_set_idx] = data_set.org_motion.share_bones()
+
+                    futures[data_set_idx] = executor.submit(execute_data_set_process, \
+                                                            self.options.copy_process_options(data_set_idx, is_shared_org_bones=True, max_workers=process_max_workers), \
+                                                            data_set_idx, (data_set_idx in avoidance_data_set_idxs), shared_org_bones[data_set_idx], is_output, \
+                                                            monitor_queue, kill_event)
+
+                while True:
+                    done, not_done = concurrent.futures.wait(futures.values(), timeout=0.1)
+                    self.write_process_monitor(monitor_queue)
+
+                    if "is_killed" in threading.current_thread()._kwargs and threading.current_thread()._kwargs["is_killed"]:
+                        # 停止命令が出ている場合、プロセス側も止めてから終了
+                        kill_event.set()
+                        raise MKilledException()
+
+                    if not not_done:
+                        break
+
+            for data_set_idx, f in futures.items():
+                result, data_set = f.result()
+                if not result:
+                    return False
+
+                # モーションだけでなくモデルのオフセットも更新されているので、データセットごと差し替える
+                # 元モーションは共有メモリを参照していたので、親プロセスのものに戻す
+                data_set.org_motion = self.options.data_set_list[data_set_idx].org_motion
+                self.options.data_set_list[data_set_idx] = data_set
+
+                if is_output:
+                    # プロセス側で出力済みなので、元モーションも解放する
+                    data_set.org_motion.bones.clear()
+        finally:
+            for shared_bones in shared_org_bones.values():
+                shared_bones.close()
+                shared_bones.unlink()
+
+            self.write_process_monitor(monitor_queue)
+            monitor_queue.close()
+
+        return True
+
+    # プロセス側から届いたログを出力する
+    def write_process_monitor(self, monitor_queue: StdoutQueue):
+        while True:
+            try:
+                self.options.monitor.write(monitor_queue.get(block=False))
+            except (queue.Empty, EOFError, OSError):
+                break
+
+
+# 1データセット分のモーションを出力する
+# 出力したボーンのキーフレは順にモーションから削除するので、出力後のデータセットのモーションは使えない
+def write_data_set(data_set_idx: int, data_set: MOptionsDataSet):
+    # 実行後、出力ファイル存在チェック
+    try:
+        # 出力
+        VmdWriter(data_set).write(is_release=True)
+
+        Path(data_set.output_vmd_path).resolve(True)
+
+        logger.info("【No.%s】 出力終了: %s", (data_set_idx + 1), os.path.basename(data_set.output_vmd_path), decoration=MLogger.DECORATION_BOX, title="サイジング成功")
+
+    except FileNotFoundError as fe:
+        logger.error("【No.%s】出力VMDファイルが正常に作成されなかったようです。\nパスを確認してください。%s\n\n%s", (data_set_idx + 1), data_set.output_vmd_path, fe.message, decoration=MLogger.DECORATION_BOX)
+
+    # 元モーションも参照しないので解放する
+    data_set.org_motion.bones.clear()
+
+
+# プロセス側で1データセット分の移動補正・スタンス補正・剛体接触回避を行う
+# is_output: モーフ置換・出力までプロセス側で行う
+# monitor: ログの出力先(親プロセスに渡すキュー。未指定の場合、標準出力)
+# kill_event: 親プロセスで停止命令が出た時にセットされるイベント
+def execute_data_set_process(options: MOptions, data_set_idx: int, is_avoidance: bool, shared_org_bones: VmdSharedBones, is_output: bool, \
+                             monitor=None, kill_event=None):
+    # プロセス起動方式によってはロガーの設定が引き継がれないので、親の設定を再現する
+    MLogger.total_level = options.logging_level
+    MLogger.is_file = options.is_file
+    MLogger.outout_datetime = options.outout_datetime
+    options.monitor = monitor or sys.stdout
+    logger.copy(options)
+
+    if kill_event:
+        watch_thread = threading.Thread(target=watch_kill_event, args=(kill_event,))
+        watch_thread.daemon = True
+        watch_thread.start()
+
+    data_set = options.data_set_list[data_set_idx]
+    data_set.org_motion.attach_shared_bones(shared_org_bones)
+
+    # 移動補正
+    if not MoveService(options).execute():
+        return False, None
+
+    # スタンス補正
+    if not StanceService(options).execute():
+        return False, None
+
+    # 剛体接触回避
+    if is_avoidance:
+        if not ArmAvoidanceService(options).execute():
+            return False, None
+
+    if is_output:
+        # モーフ置換
+        if not MorphService(options).execute():
+            return False, None
+
+        write_data_set(data_set_idx, data_set)
+
+    # 元モーションは親プロセスにあるので返さない
+    data_set.org_motion = None
+
+    return True, data_set
+
+
+# 親プロセスから停止命令が来たら、プロセス内の全スレッドに終了命令を出す(以降のログ出力で停止する)
+def watch_kill_event(kill_event):
+    kill_event.wait()
+    while True:
+        for th in threading.enumerate():
+            th._kwargs["is_killed"] = True
+        time.sleep(0.1)
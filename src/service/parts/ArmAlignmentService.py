@@ -101,8 +101,18 @@ class ArmAlignmentService():
 
         org_effector_pairs = list(itertools.combinations(target_pairs, 2))
         logger.test("list: %s, pairs: %s", target_pairs, org_effector_pairs)
+
+        # 元モデルのグローバル位置は、全キーフレ分まとめて求めておく
+        all_org_global_poses = {}
+        for data_set_idx, alignment_options in self.target_links.items():
+            for alignment_idx, target_link in alignment_options.items():
+                # 処理対象データセット
+                data_set = self.options.data_set_list[data_set_idx]
+
+                all_org_global_poses[(data_set_idx, alignment_idx)] = \
+                    MServiceUtils.calc_global_pos_many(data_set.org_model, target_link.org_links, data_set.org_motion, fnos, return_matrix=True, is_local_x=True)
         
-        for fno in fnos:
+        for fidx, fno in enumerate(fnos):
             all_org_global_effector_vec[fno] = {}
             all_org_global_trunk_matrixs[fno] = {}
             all_org_global_neck_vec[fno] = {}
@@ -117,8 +127,8 @@ class ArmAlignmentService():
                     data_set = self.options.data_set_list[data_set_idx]
 
                     # 元モデルのそれぞれのグローバル位置
-                    org_global_3ds, org_global_matrixs = \
-                        MServiceUtils.calc_global_pos(data_set.org_model, target_link.org_links, data_set.org_motion, fno, return_matrix=True, is_local_x=True)
+                    org_global_poses, org_global_mats = all_org_global_poses[(data_set_idx, alignment_idx)]
+                    org_global_3ds, org_global_matrixs = MServiceUtils.get_global_pos_dic(target_link.org_links, org_global_poses, org_global_mats, fidx)
                    
                     all_org_global_effector_vec[fno][(data_set_idx, alignment_idx)] = org_global_3ds[target_link.effector_bone_name]
 
@@ -694,7 +704,9 @@ class ArmAlignmentService():
                                          list(now_ik_links.all().keys()), rep_effector_vec.to_log(), rep_global_effector.to_log())
                             
                             # IK計算実行
-                            MServiceUtils.calc_IK(data_set.rep_model, target_link.rep_links, data_set.motion, fno, rep_global_effector, now_ik_links, max_count=1)
+                            # 解析的に解く場合、初回だけ解析的に解き、2回目以降はCCDで詰める
+                            MServiceUtils.calc_IK(data_set.rep_model, target_link.rep_links, data_set.motion, fno, rep_global_effector, now_ik_links, max_count=1, \
+                                                  is_two_bone=(target_link.ik_two_bone_list[ik_cnt] and now_ik_max_count == 1))
 
                             # 現在のエフェクタ位置
                             aligned_rep_global_3ds = MServiceUtils.calc_global_pos(data_set.rep_model, target_link.rep_links, data_set.motion, fno)
@@ -1174,6 +1186,7 @@ class ArmAlignmentService():
             # IK用リンク（エフェクタから追加していく）
             ik_links_list = []
             ik_count_list = []
+            ik_two_bone_list = []
 
             wrist_bone = rep_wrist_links.get("{0}手首".format(direction))
 
@@ -1195,6 +1208,8 @@ class ArmAlignmentService():
             ik_links.append(arm_bone)
             ik_links_list.append(ik_links)
             ik_count_list.append(30)
+            # 腕→ひじ→手首は解析的に解く
+            ik_two_bone_list.append(True)
 
             if tip_bone_name == "{0}手首".format(direction):
                 # 位置合わせが手首の場合、先端調整不要
@@ -1215,7 +1230,7 @@ class ArmAlignmentService():
 
             # 手首リンク登録
             self.target_links[data_set_idx][alignment_idx] = \
-                ArmAlignmentOption(org_wrist_links, rep_wrist_links, ik_links_list, ik_count_list, tip_ik_links, \
+                ArmAlignmentOption(org_wrist_links, rep_wrist_links, ik_links_list, ik_count_list, ik_two_bone_list, tip_ik_links, \
                                    org_palm_length, rep_palm_length, data_set.org_model, data_set.rep_model, "{0}腕".format(direction), \
                                    "{0}手首".format(direction), "{0}手首".format(direction), tip_bone_name, self.options.arm_options.alignment_distance_wrist, data_set.xz_ratio, 1)
 
@@ -1227,6 +1242,7 @@ class ArmAlignmentService():
                 # IK用リンク（エフェクタから追加していく）
                 ik_links_list = []
                 ik_count_list = []
+                ik_two_bone_list = []
 
                 ik_links = BoneLinks()
                 ik_links.append(wrist_bone)
@@ -1249,10 +1265,11 @@ class ArmAlignmentService():
 
                 ik_links_list.append(ik_links)
                 ik_count_list.append(30)
+                ik_two_bone_list.append(False)
 
                 # 手首リンク登録(alignmentをマイナスとする)
                 self.target_links[data_set_idx][-alignment_idx] = \
-                    ArmAlignmentOption(org_wrist_links, rep_wrist_links, ik_links_list, ik_count_list, tip_ik_links, \
+                    ArmAlignmentOption(org_wrist_links, rep_wrist_links, ik_links_list, ik_count_list, ik_two_bone_list, tip_ik_links, \
                                        org_palm_length, rep_palm_length, data_set.org_model, data_set.rep_model, "床", \
                                        "{0}手首".format(direction), "床", tip_bone_name, \
                                        self.options.arm_options.alignment_distance_floor, data_set.xz_ratio, 2)
@@ -1301,6 +1318,7 @@ class ArmAlignmentService():
                 # IK用リンク（エフェクタから追加していく）
                 ik_links_list = []
                 ik_count_list = []
+                ik_two_bone_list = []
 
                 elbow_bone = rep_finger_links.get("{0}ひじ".format(direction))
                 elbow_bone.dot_near_limit = 0.97
@@ -1320,6 +1338,8 @@ class ArmAlignmentService():
                 ik_links.append(arm_bone)
                 ik_links_list.append(ik_links)
                 ik_count_list.append(30)
+                # 腕→ひじ→指は解析的に解く
+                ik_two_bone_list.append(True)
 
                 # # 先端リンクは不要
                 # tip_ik_links = BoneLinks()
@@ -1328,7 +1348,7 @@ class ArmAlignmentService():
 
                 # 指リンク登録
                 self.target_links[data_set_idx][alignment_idx] = \
-                    ArmAlignmentOption(org_finger_links, rep_finger_links, ik_links_list, ik_count_list, None, \
+                    ArmAlignmentOption(org_finger_links, rep_finger_links, ik_links_list, ik_count_list, ik_two_bone_list, None, \
                                        org_palm_length, rep_palm_length, data_set.org_model, data_set.rep_model, "{0}腕".format(direction), \
                                        total_finger_name, total_finger_name[:3], total_finger_name, self.options.arm_options.alignment_distance_finger, data_set.xz_ratio, 3)
 
@@ -1373,7 +1393,7 @@ class ArmAlignmentService():
 # 位置合わせ用オプション
 class ArmAlignmentOption():
 
-    def __init__(self, org_links: BoneLinks, rep_links: BoneLinks, ik_links_list: list, ik_count_list: list, tip_ik_links: BoneLinks, \
+    def __init__(self, org_links: BoneLinks, rep_links: BoneLinks, ik_links_list: list, ik_count_list: list, ik_two_bone_list: list, tip_ik_links: BoneLinks, \
                  org_palm_length: float, rep_palm_length: float, org_model: PmxModel, rep_model: PmxModel, start_bone_name: str, \
                  effector_bone_name: str, effector_display_bone_name: str, tip_bone_name: str, distance: float, xz_ratio: float, priority: int):
         super().__init__()
@@ -1382,6 +1402,8 @@ class ArmAlignmentOption():
         self.rep_links = rep_links
         self.ik_links_list = ik_links_list
         self.ik_count_list = ik_count_list
+        # IKリンク毎に、解析的に解くか否か
+        self.ik_two_bone_list = ik_two_bone_list
         self.tip_ik_links = tip_ik_links
         self.org_palm_length = org_palm_length
         self.rep_palm_length = rep_palm_length
@@ -19,12 +19,14 @@ logger = MLogger(__name__, level=1)
 # 接触回避用オプション
 class ArmAvoidanceOption():
 
-    def __init__(self, arm_links: BoneLinks, ik_links_list: list, ik_count_list: list, avoidance_links: dict, avoidances: dict, face_length: float):
+    def __init__(self, arm_links: BoneLinks, ik_links_list: list, ik_count_list: list, ik_two_bone_list: list, avoidance_links: dict, avoidances: dict, face_length: float):
         super().__init__()
 
         self.arm_links = arm_links
         self.ik_links_list = ik_links_list
         self.ik_count_list = ik_count_list
+        # IKリンク毎に、解析的に解くか否か
+        self.ik_two_bone_list = ik_two_bone_list
         self.avoidance_links = avoidance_links
         self.avoidances = avoidances
         self.face_length = face_length
@@ -47,6 +49,10 @@ class ArmAvoidanceService():
         self.avoidance_options = {}
 
         for data_set_idx, data_set in enumerate(self.options.data_set_list):
+            if not data_set:
+                # 別プロセスで処理するデータセットはスキップ
+                continue
+
             logger.info("接触回避　【No.%s】", (data_set_idx + 1), decoration=MLogger.DECORATION_LINE)
 
             # 接触回避用準備
@@ -56,6 +62,9 @@ class ArmAvoidanceService():
         futures = []
         with ThreadPoolExecutor(thread_name_prefix="avoidance", max_workers=self.options.max_workers) as executor:
             for data_set_idx, data_set in enumerate(self.options.data_set_list):
+                if not data_set:
+                    continue
+
                 futures.append(executor.submit(self.execute_avoidance_pool, data_set_idx, "右"))
                 futures.append(executor.submit(self.execute_avoidance_pool, data_set_idx, "左"))
 
@@ -251,7 +260,9 @@ class ArmAvoidanceService():
                                              list(ik_links.all().keys()), avoidance_name, axis, rep_global_3ds[arm_link.last_name()].to_log(), rep_collision_vec.to_log())
                                 
                                 # 修正角度がない場合、IK計算実行
-                                MServiceUtils.calc_IK(data_set.rep_model, arm_link, data_set.motion, fno, rep_collision_vec, ik_links, max_count=1)
+                                # 解析的に解く場合、初回だけ解析的に解き、2回目以降はCCDで詰める
+                                MServiceUtils.calc_IK(data_set.rep_model, arm_link, data_set.motion, fno, rep_collision_vec, ik_links, max_count=1, \
+                                                      is_two_bone=(avoidance_options.ik_two_bone_list[arm_link.last_name()][ik_cnt] and now_ik_max_count == 1))
 
                                 # 現在のエフェクタ位置
                                 now_rep_global_3ds = MServiceUtils.calc_global_pos(data_set.rep_model, arm_link, data_set.motion, fno)
@@ -617,6 +628,7 @@ class ArmAvoidanceService():
         # IK用リンク（エフェクタから追加していく）
         ik_links_list = {}
         ik_count_list = {}
+        ik_two_bone_list = {}
          
         effector_bone_name_list = []
 
@@ -631,6 +643,7 @@ class ArmAvoidanceService():
 
             ik_links_list[effector_bone_name] = []
             ik_count_list[effector_bone_name] = []
+            ik_two_bone_list[effector_bone_name] = []
 
             effector_bone = arm_link.get(effector_bone_name)
 
@@ -643,6 +656,7 @@ class ArmAvoidanceService():
             ik_links.append(arm_bone)
             ik_links_list[effector_bone_name].append(ik_links)
             ik_count_list[effector_bone_name].append(30)
+            ik_two_bone_list[effector_bone_name].append(False)
 
         effector_bone_name_list = []
        
@@ -659,6 +673,7 @@ class ArmAvoidanceService():
 
             ik_links_list[effector_bone_name] = []
             ik_count_list[effector_bone_name] = []
+            ik_two_bone_list[effector_bone_name] = []
 
             effector_bone = arm_link.get(effector_bone_name)
 
@@ -675,6 +690,7 @@ class ArmAvoidanceService():
             ik_links.append(arm_bone)
             ik_links_list[effector_bone_name].append(ik_links)
             ik_count_list[effector_bone_name].append(30)
+            ik_two_bone_list[effector_bone_name].append(False)
 
             # ik_links = BoneLinks()
             # ik_links.append(effector_bone)
@@ -688,9 +704,11 @@ class ArmAvoidanceService():
             ik_links.append(arm_bone)
             ik_links_list[effector_bone_name].append(ik_links)
             ik_count_list[effector_bone_name].append(30)
+            # 腕→ひじ→先端は解析的に解く
+            ik_two_bone_list[effector_bone_name].append(True)
 
         # 手首リンク登録
-        return ArmAvoidanceOption(arm_links, ik_links_list, ik_count_list, avoidance_links, avoidances, face_length)
+        return ArmAvoidanceOption(arm_links, ik_links_list, ik_count_list, ik_two_bone_list, avoidance_links, avoidances, face_length)
 
     # 指定したモデル・方向の手のひら頂点
     def calc_wrist_entity_vertex(self, data_set_idx: int, model: PmxModel, target_model_type: str, direction: str):
@@ -713,7 +731,7 @@ class ArmAvoidanceService():
     def get_target_set_idxs(self):
         target_data_set_idxs = []
         for data_set_idx, data_set in enumerate(self.options.data_set_list):
-            if data_set.motion.motion_cnt <= 0:
+            if not data_set or data_set.motion.motion_cnt <= 0:
                 # モーションデータが無い場合、処理スキップ
                 continue
             
@@ -442,7 +442,7 @@ class CameraService():
                 data_set = self.options.data_set_list[data_set_idx]
 
                 # 元モデルのそれぞれのグローバル位置
-                org_global_3ds = MServiceUtils.calc_global_pos(data_set.camera_org_model, org_link, data_set.org_motion, fno)
+                org_global_3ds = MServiceUtils.calc_global_pos(data_set.camera_org_model, org_link, data_set.org_motion, fno, is_cache=True)
                 for bone_name, org_vec in org_global_3ds.items():
                     if bone_name in camera_option.org_link_target.keys():
                         # 処理対象ボーンである場合、データを保持
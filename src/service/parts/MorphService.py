@@ -19,7 +19,7 @@ class MorphService():
 
     def execute(self):
         for data_set_idx, data_set in enumerate(self.options.data_set_list):
-            if data_set.motion.morph_cnt <= 0 or len(data_set.morph_list) == 0:
+            if not data_set or data_set.motion.morph_cnt <= 0 or len(data_set.morph_list) == 0:
                 # モーフデータが無い場合、或いは置換データが無い場合、処理スキップ
                 continue
 
@@ -5,8 +5,9 @@ import numpy as np
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 
-from module.MMath import MRect, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
+from module.MMath import MRect, MVector3D, MVector3DArray, MVector4D, MQuaternion, MMatrix4x4 # noqa
 from module.MOptions import MOptions, MOptionsDataSet
+from mmd.VmdData import VmdBoneTrack
 from utils import MUtils, MServiceUtils, MBezierUtils # noqa
 from utils.MLogger import MLogger # noqa
 from utils.MException import SizingException, MKilledException
@@ -24,7 +25,7 @@ class MoveService():
 
         with ThreadPoolExecutor(thread_name_prefix="move", max_workers=min(5, self.options.max_workers)) as executor:
             for data_set_idx, data_set in enumerate(self.options.data_set_list):
-                if data_set.motion.motion_cnt <= 0:
+                if not data_set or data_set.motion.motion_cnt <= 0:
                     # モーションデータが無い場合、処理スキップ
                     continue
 
@@ -57,16 +58,26 @@ class MoveService():
             data_set = self.options.data_set_list[data_set_idx]
             fnos = data_set.motion.get_bone_fnos(bone_name)
 
-            for fno in fnos:
-                bf = data_set.motion.bones[bone_name][fno]
+            if isinstance(data_set.motion.bones[bone_name], VmdBoneTrack):
+                # 列指向トラックの場合、全キーの位置をまとめて補正する
+                track = data_set.motion.bones[bone_name]
 
-                # 一旦IK比率をそのまま掛ける
-                bf.position.setX(bf.position.x() * data_set.xz_ratio)
-                bf.position.setY(bf.position.y() * data_set.y_ratio)
-                bf.position.setZ(bf.position.z() * data_set.xz_ratio)
+                # 一旦IK比率をそのまま掛ける(1キーずつの場合と同じく、不正値はオフセット調整後に0にする)
+                positions = MVector3DArray(track.get_position_array().data() * [data_set.xz_ratio, data_set.y_ratio, data_set.xz_ratio])
 
                 # オフセット調整
-                bf.position += data_set.rep_model.bones[bone_name].local_offset
+                track.set_position_array(positions + data_set.rep_model.bones[bone_name].local_offset)
+            else:
+                for fno in fnos:
+                    bf = data_set.motion.bones[bone_name][fno]
+
+                    # 一旦IK比率をそのまま掛ける
+                    bf.position.setX(bf.position.x() * data_set.xz_ratio)
+                    bf.position.setY(bf.position.y() * data_set.y_ratio)
+                    bf.position.setZ(bf.position.z() * data_set.xz_ratio)
+
+                    # オフセット調整
+                    bf.position += data_set.rep_model.bones[bone_name].local_offset
 
             if len(fnos) > 0:
                 logger.info("移動補正:終了【No.%s - %s】", data_set_idx + 1, bone_name)
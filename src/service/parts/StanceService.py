@@ -6,8 +6,8 @@ import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 
 from mmd.PmxData import PmxModel # noqa
-from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame # noqa
-from module.MMath import MRect, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
+from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdBoneTrack, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame # noqa
+from module.MMath import MRect, MVector3D, MVector4D, MQuaternion, MQuaternionArray, MMatrix4x4 # noqa
 from module.MOptions import MOptions, MOptionsDataSet
 from module.MParams import BoneLinks
 from utils import MUtils, MServiceUtils, MBezierUtils # noqa
@@ -30,7 +30,7 @@ class StanceService():
         futures = []
         with ThreadPoolExecutor(thread_name_prefix="stance", max_workers=min(5, self.options.max_workers)) as executor:
             for data_set_idx, data_set in enumerate(self.options.data_set_list):
-                if data_set.motion.motion_cnt <= 0:
+                if not data_set or data_set.motion.motion_cnt <= 0:
                     # モーションデータが無い場合、処理スキップ
                     continue
 
@@ -820,6 +820,9 @@ class StanceService():
                     org_leg_ik_links = data_set.org_model.create_link_2_top_one(target_bone_name)
                     rep_leg_ik_links = data_set.rep_model.create_link_2_top_one(target_bone_name)
 
+                    # 足ＩＫ=OFFのキーフレは、足ＩＫの代わりに足のFK回転を補正する
+                    self.adjust_leg_fk_stance_lr(data_set_idx, data_set, direction, leg_ratio)
+
                     # つま先と足IKのあるキーフレ
                     fnos = data_set.motion.get_bone_fnos(target_bone_name)
 
@@ -880,8 +883,8 @@ class StanceService():
                                                             limit_links=rep_leg_ik_links.from_links(rep_leg_ik_links.get(target_bone_name, offset=-1).name), return_matrix=True)
                         
                         # 処理対象ボーンまでの位置とグローバル座標
-                        org_ik_root_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_ik_root_links, data_set.org_motion, fno)
-                        org_leg_ik_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_leg_ik_links, data_set.org_motion, fno)
+                        org_ik_root_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_ik_root_links, data_set.org_motion, fno, is_cache=True)
+                        org_leg_ik_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_leg_ik_links, data_set.org_motion, fno, is_cache=True)
 
                         # 先リンク元（足ボーン）
                         rep_ik_root_global_3ds = MServiceUtils.calc_global_pos(data_set.rep_model, rep_ik_root_links, data_set.motion, fno)
@@ -964,6 +967,67 @@ class StanceService():
             raise e
 
     # つま先ＩＫ補正
+    # 足ＩＫ=OFFのキーフレで、足首を足ＩＫ補正と同じ縮尺の位置に合わせるよう、足IKのリンク(足→ひざ→足首)のFK回転を補正する
+    # ジョイントが2つのリンクは解析的に解き、それ以外(もしくは解けない場合)はCCDで解く
+    def adjust_leg_fk_stance_lr(self, data_set_idx: int, data_set: MOptionsDataSet, direction: str, leg_ratio: MVector3D):
+        leg_ik_bone_name = "{0}足ＩＫ".format(direction)
+        leg_bone_name = "{0}足".format(direction)
+
+        # 足ＩＫのon/offが切り替わるフレーム番号と、その時のon/off(IK名は読み込んだSJISのまま、後ろを\0で埋めてある)
+        leg_ik_bname = leg_ik_bone_name.encode("shift-jis")
+        ik_switches = sorted([(showik.fno, ik_info.onoff) for showik in data_set.motion.showiks for ik_info in showik.ik \
+                              if (ik_info.name.split(b"\0")[0] if isinstance(ik_info.name, bytes) else ik_info.name.encode("shift-jis")) == leg_ik_bname])
+        if not [onoff for _, onoff in ik_switches if onoff == 0]:
+            # 一度もOFFにならない場合、終了
+            return
+
+        rep_ik = data_set.rep_model.bones[leg_ik_bone_name].ik
+        effector_bone_name = data_set.rep_model.bone_indexes[rep_ik.target_index]
+        joint_bone_names = [data_set.rep_model.bone_indexes[ik_link.bone_index] for ik_link in rep_ik.link]
+
+        if effector_bone_name not in data_set.org_model.bones:
+            logger.info("%s足ＩＫ補正(FK): 【No.%s】作成元に%sボーンがないため、処理をスキップします。", direction, (data_set_idx + 1), effector_bone_name)
+            return
+
+        # 足ＩＫ=OFFのキーフレ(足ＩＫのon/offは、直前に切り替えた状態のまま)
+        fnos = []
+        for fno in data_set.motion.get_bone_fnos(effector_bone_name, *joint_bone_names):
+            onoffs = [onoff for switch_fno, onoff in ik_switches if switch_fno <= fno]
+            if onoffs and onoffs[-1] == 0:
+                fnos.append(fno)
+
+        if len(fnos) == 0:
+            return
+
+        org_effector_links = data_set.org_model.create_link_2_top_one(effector_bone_name)
+        rep_effector_links = data_set.rep_model.create_link_2_top_one(effector_bone_name)
+
+        if not org_effector_links.get(leg_bone_name) or not all([rep_effector_links.get(joint_bone_name) for joint_bone_name in joint_bone_names]):
+            logger.info("%s足ＩＫ補正(FK): 【No.%s】%sボーンまでのリンクに足ＩＫのリンクが含まれていないため、処理をスキップします。", direction, (data_set_idx + 1), effector_bone_name)
+            return
+
+        logger.info("%s補正(FK)【No.%s】", leg_ik_bone_name, (data_set_idx + 1))
+
+        # IKリンク(エフェクタ、ジョイント(末端から順番))
+        ik_links = BoneLinks()
+        ik_links.append(rep_effector_links.get(effector_bone_name))
+        for joint_bone_name in joint_bone_names:
+            joint_bone = rep_effector_links.get(joint_bone_name)
+            joint_bone.degree_limit = math.degrees(rep_ik.limit_radian)
+            ik_links.append(joint_bone)
+
+        for fno in fnos:
+            # 元モデルの足から見た足首の位置を、足の長さの縮尺で先モデルの足に当てはめる
+            org_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_effector_links, data_set.org_motion, fno, is_cache=True)
+            rep_global_3ds = MServiceUtils.calc_global_pos(data_set.rep_model, rep_effector_links, data_set.motion, fno)
+            target_pos = rep_global_3ds[leg_bone_name] + (org_global_3ds[effector_bone_name] - org_global_3ds[leg_bone_name]) * leg_ratio
+
+            logger.debug("f: %s, %s, rep_effector_pos: %s, target_pos: %s", fno, effector_bone_name, rep_global_3ds[effector_bone_name].to_log(), target_pos.to_log())
+
+            MServiceUtils.calc_IK(data_set.rep_model, rep_effector_links, data_set.motion, fno, target_pos, ik_links, max_count=rep_ik.loop, is_two_bone=True)
+
+        logger.info("%s足ＩＫ補正(FK):終了【No.%s】", direction, (data_set_idx + 1))
+
     def adjust_toe_ik_stance(self, data_set_idx: int, data_set: MOptionsDataSet):
         logger.info("つま先ＩＫ補正　【No.%s】", (data_set_idx + 1), decoration=MLogger.DECORATION_LINE)
 
@@ -1083,11 +1147,11 @@ class StanceService():
 
                         # 足ＩＫまでのグローバル座標と行列
                         org_target_global_3ds, org_target_toe_ik_matrixs \
-                            = MServiceUtils.calc_global_pos(data_set.org_model, org_toe_ik_links, data_set.org_motion, fno, return_matrix=True)
+                            = MServiceUtils.calc_global_pos(data_set.org_model, org_toe_ik_links, data_set.org_motion, fno, return_matrix=True, is_cache=True)
                         # 足IKの親までのグローバル座標と行列
                         _, org_initial_toe_ik_matrixs \
                             = MServiceUtils.calc_global_pos(data_set.org_model, org_toe_ik_links, data_set.org_motion, fno, \
-                                                            limit_links=org_toe_ik_links.from_links(leg_ik_parent_name), return_matrix=True)
+                                                            limit_links=org_toe_ik_links.from_links(leg_ik_parent_name), return_matrix=True, is_cache=True)
                         # つま先IKまでの初期相対位置
                         org_initial_toe_trans_vs = MServiceUtils.calc_relative_position(data_set.org_model, org_toe_ik_links, data_set.org_motion, fno, \
                                                                                         limit_links=org_toe_ik_links.from_links(leg_ik_bone_name))
@@ -1986,7 +2050,7 @@ class StanceService():
 
         # FROMボーンまでの位置
         org_from_global_3ds, org_front_from_global_3ds, org_from_direction_qq = \
-            MServiceUtils.calc_front_global_pos(data_set.org_model, org_from_links, data_set.org_motion, bf.fno, limit_links=org_from_links)
+            MServiceUtils.calc_front_global_pos(data_set.org_model, org_from_links, data_set.org_motion, bf.fno, limit_links=org_from_links, is_cache=True)
         rep_from_global_3ds, rep_front_from_global_3ds, rep_from_direction_qq = \
             MServiceUtils.calc_front_global_pos(data_set.rep_model, rep_from_links, data_set.motion, bf.fno, limit_links=rep_from_links)
 
@@ -1998,7 +2062,7 @@ class StanceService():
 
         # TOボーンまでの位置（フレームはFROMまでで、TO自身は初期値として求める）
         org_to_global_3ds, org_front_to_global_3ds, org_to_direction_qq = \
-            MServiceUtils.calc_front_global_pos(data_set.org_model, org_to_links, data_set.org_motion, bf.fno, limit_links=org_from_links)
+            MServiceUtils.calc_front_global_pos(data_set.org_model, org_to_links, data_set.org_motion, bf.fno, limit_links=org_from_links, is_cache=True)
         rep_to_global_3ds, rep_front_to_global_3ds, rep_to_direction_qq = \
             MServiceUtils.calc_front_global_pos(data_set.rep_model, rep_to_links, data_set.motion, bf.fno, limit_links=rep_from_links)
 
@@ -2036,12 +2100,12 @@ class StanceService():
         # UP計算 ---------------
 
         # 左腕ボーンまでの位置
-        org_left_arm_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_arm_links["左"], data_set.org_motion, bf.fno, org_from_links)
+        org_left_arm_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_arm_links["左"], data_set.org_motion, bf.fno, org_from_links, is_cache=True)
         org_left_arm_pos = org_left_arm_global_3ds["左{0}".format(up_name)]
         logger.test("f: %s, org_left_arm_pos: %s", bf.fno, org_left_arm_pos)
 
         # 右腕ボーンまでの位置
-        org_right_arm_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_arm_links["右"], data_set.org_motion, bf.fno, org_from_links)
+        org_right_arm_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_arm_links["右"], data_set.org_motion, bf.fno, org_from_links, is_cache=True)
         org_right_arm_pos = org_right_arm_global_3ds["右{0}".format(up_name)]
         logger.test("f: %s, org_right_arm_pos: %s", bf.fno, org_right_arm_pos)
         
@@ -2215,7 +2279,7 @@ class StanceService():
             bf = data_set.motion.calc_bf(shoulder_name, fno)
             
             # 腕までのグローバル位置と行列
-            org_arm_global_3ds, org_arm_matrixs = MServiceUtils.calc_global_pos(data_set.org_model, org_arm_links[shoulder_name[0]], data_set.org_motion, fno, return_matrix=True)
+            org_arm_global_3ds, org_arm_matrixs = MServiceUtils.calc_global_pos(data_set.org_model, org_arm_links[shoulder_name[0]], data_set.org_motion, fno, return_matrix=True, is_cache=True)
             rep_arm_global_3ds, rep_arm_matrixs = MServiceUtils.calc_global_pos(data_set.rep_model, rep_arm_links[shoulder_name[0]], data_set.motion, fno, return_matrix=True, \
                                                                                 limit_links=rep_arm_links[shoulder_name[0]].from_links("首根元2"))
 
@@ -2418,7 +2482,7 @@ class StanceService():
 
         # TOボーンまでの位置
         org_to_global_3ds, org_front_to_global_3ds, org_to_direction_qq = \
-            MServiceUtils.calc_front_global_pos(data_set.org_model, org_to_links, data_set.org_motion, bf.fno, limit_links=org_limit_links)
+            MServiceUtils.calc_front_global_pos(data_set.org_model, org_to_links, data_set.org_motion, bf.fno, limit_links=org_limit_links, is_cache=True)
         rep_to_global_3ds, rep_front_to_global_3ds, rep_to_direction_qq = \
             MServiceUtils.calc_front_global_pos(data_set.rep_model, rep_to_links, data_set.motion, bf.fno, limit_links=rep_limit_links)
 
@@ -2461,7 +2525,7 @@ class StanceService():
         
         # 肩下延長ボーンまでの位置
         org_shoulder_under_global_3ds = MServiceUtils.calc_global_pos(data_set.org_model, org_shoulder_under_links, \
-                                                                      data_set.org_motion, bf.fno, org_limit_links)
+                                                                      data_set.org_motion, bf.fno, org_limit_links, is_cache=True)
         org_shoulder_under_pos = org_shoulder_under_global_3ds["{0}下延長".format(from_bone_name)]
         logger.test("f: %s, org_shoulder_under_pos: %s", bf.fno, org_shoulder_under_pos)
 
@@ -2519,7 +2583,7 @@ class StanceService():
             rep_parent_bf = data_set.motion.calc_bf(target_parent_name, fno)
 
             # 元々の親bfのdeformed回転量
-            org_deformed_qq = MServiceUtils.deform_rotation(data_set.org_model, data_set.org_motion, org_parent_bf)
+            org_deformed_qq = MServiceUtils.deform_rotation(data_set.org_model, data_set.org_motion, org_parent_bf, is_cache=True)
             # 調整後の親bfのdeformed回転量
             rep_deformed_qq = MServiceUtils.deform_rotation(data_set.rep_model, data_set.motion, rep_parent_bf)
 
@@ -2562,7 +2626,7 @@ class StanceService():
             rep_parent_bf = data_set.motion.calc_bf(target_parent_name, fno)
 
             # 元々の親bfのdeformed回転量
-            org_deformed_qq = MServiceUtils.deform_rotation(data_set.org_model, data_set.org_motion, org_parent_bf)
+            org_deformed_qq = MServiceUtils.deform_rotation(data_set.org_model, data_set.org_motion, org_parent_bf, is_cache=True)
             # 調整後の親bfのdeformed回転量
             rep_deformed_qq = MServiceUtils.deform_rotation(data_set.rep_model, data_set.motion, rep_parent_bf)
 
@@ -2653,13 +2717,27 @@ class StanceService():
             data_set = self.options.data_set_list[data_set_idx]
 
             if bone_name in arm_diff_qq_dic and bone_name in data_set.motion.bones:
-                # スタンス補正値がある場合
-                for bf in data_set.motion.bones[bone_name].values():
-                    if bf.key:
-                        if arm_diff_qq_dic[bone_name]["from"] == MQuaternion():
-                            bf.rotation = bf.rotation * arm_diff_qq_dic[bone_name]["to"]
-                        else:
-                            bf.rotation = arm_diff_qq_dic[bone_name]["from"].inverted() * bf.rotation * arm_diff_qq_dic[bone_name]["to"]
+                # スタンス補正値がある場合、登録対象キーの回転をまとめて補正する
+                bone_frames = data_set.motion.bones[bone_name]
+                if isinstance(bone_frames, VmdBoneTrack):
+                    rotations = MQuaternionArray(bone_frames.rotations[bone_frames.key_flags])
+                else:
+                    key_bfs = [bf for bf in bone_frames.values() if bf.key]
+                    rotations = MQuaternionArray([bf.rotation for bf in key_bfs])
+
+                if len(rotations) > 0:
+                    if arm_diff_qq_dic[bone_name]["from"] == MQuaternion():
+                        rotations = rotations * arm_diff_qq_dic[bone_name]["to"]
+                    else:
+                        rotations = arm_diff_qq_dic[bone_name]["from"].inverted() * rotations * arm_diff_qq_dic[bone_name]["to"]
+
+                    if isinstance(bone_frames, VmdBoneTrack):
+                        bone_frames.own()
+                        bone_frames.rotations[bone_frames.key_flags] = rotations.data()
+                        bone_frames.touch()
+                    else:
+                        for bf, rotation in zip(key_bfs, rotations.toQuaternions()):
+                            bf.rotation = rotation
                 
                 logger.info("腕スタンス補正【No.%s - %s】", (data_set_idx + 1), bone_name)
                 logger.test("from: %s", arm_diff_qq_dic[bone_name]["from"].toEulerAngles())
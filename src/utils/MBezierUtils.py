@@ -4,11 +4,14 @@ from module.MMath import MRect, MVector2D, MVector3D, MVector4D, MQuaternion, MM
 from utils.MLogger import MLogger # noqa
 import numpy as np
 import bezier
+from functools import lru_cache
 
 logger = MLogger(__name__, level=1)
 
 # MMDでの補間曲線の最大値
 INTERPOLATION_MMD_MAX = 127
+# 補間曲線テーブルを作成する区間の最大フレーム数(これより長い区間は都度計算)
+EVALUATE_TABLE_MAX_LENGTH = 10000
 # MMDの線形補間
 LINEAR_MMD_INTERPOLATION = [MVector2D(0, 0), MVector2D(20, 20), MVector2D(107, 107), MVector2D(127, 127)]
 
@@ -332,6 +335,11 @@ def intersect_by_x(curve, xs):
 def evaluate(x1v: int, y1v: int, x2v: int, y2v: int, start: int, now: int, end: int):
     if (now - start) == 0 or (end - start) == 0:
         return 0, 0, 0
+
+    if isinstance(now - start, (int, np.integer)) and isinstance(end - start, (int, np.integer)) and 0 < now - start < end - start <= EVALUATE_TABLE_MAX_LENGTH:
+        # 区間内の整数フレームの場合、補間曲線テーブルから取得する
+        x, y, t = get_evaluate_table(int(x1v), int(y1v), int(x2v), int(y2v), int(end - start))[int(now - start)]
+        return float(x), float(y), float(t)
         
     x = (now - start) / (end - start)
     x1 = x1v / INTERPOLATION_MMD_MAX
@@ -366,6 +374,51 @@ def evaluate(x1v: int, y1v: int, x2v: int, y2v: int, start: int, now: int, end:
     return x, y, t
 
 
+# evaluate を複数の補間曲線・フレーム番号分まとめて行う(各引数は配列もしくは数値)
+def evaluate_many(x1v, y1v, x2v, y2v, start, now, end):
+    start = np.asarray(start)
+    now = np.asarray(now)
+    end = np.asarray(end)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (now - start) / (end - start)
+    x1 = np.asarray(x1v) / INTERPOLATION_MMD_MAX
+    x2 = np.asarray(x2v) / INTERPOLATION_MMD_MAX
+    y1 = np.asarray(y1v) / INTERPOLATION_MMD_MAX
+    y2 = np.asarray(y2v) / INTERPOLATION_MMD_MAX
+
+    x, x1, x2, y1, y2 = np.broadcast_arrays(x, x1, x2, y1, y2)
+
+    t = np.full(x.shape, 0.5)
+    s = np.full(x.shape, 0.5)
+
+    for i in range(15):
+        ft = (3 * (s * s) * t * x1) + (3 * s * (t * t) * x2) + (t * t * t) - x
+        t = np.where(ft > 0, t - 1 / (4 << i), t + 1 / (4 << i))
+        s = 1 - t
+
+    y = (3 * (s * s) * t * y1) + (3 * s * (t * t) * y2) + (t * t * t)
+
+    # 始点と同じか区間がない場合は0
+    zero_mask = np.broadcast_to(((now - start) == 0) | ((end - start) == 0), x.shape)
+    x = np.where(zero_mask, 0, x)
+    y = np.where(zero_mask, 0, y)
+    t = np.where(zero_mask, 0, t)
+
+    return x, y, t
+
+
+# 補間曲線の区間内の各フレームの x, y, t のテーブル((length + 1)×3)
+# モーションで使われる補間曲線の種類は少ないので、制御点と区間の長さ毎に保持しておく
+@lru_cache(maxsize=4096)
+def get_evaluate_table(x1v: int, y1v: int, x2v: int, y2v: int, length: int):
+    x, y, t = evaluate_many(x1v, y1v, x2v, y2v, 0, np.arange(0, length + 1), length)
+    table = np.stack([x, y, t], axis=1)
+    table.flags.writeable = False
+
+    return table
+
+
 # 指定されたtになるフレーム番号を取得する
 def evaluate_by_t(x1v: int, y1v: int, x2v: int, y2v: int, start: int, end: int, t: float):
     if (end - start) <= 1:
@@ -6,6 +6,8 @@ import sys
 import os
 import json
 import glob
+import hashlib
+import mmap
 import traceback
 from pathlib import Path
 import re
@@ -332,3 +334,36 @@ def escape_filepath(path: str):
     path = path.replace("/", "\\/")
 
     return path
+
+
+# ファイルを一度だけ開いて、メモリマップで返す(空ファイルはマップできないので、読み込んだバイト列を返す)
+def read_file_buffer(file_path: str):
+    with open(file_path, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return f.read()
+
+
+# ファイル内容のハッシュ値(読み込みと同じバッファから一度だけ計算する)
+def calc_digest(buffer, file_path: str):
+    return calc_digests(buffer, file_path)[1]
+
+
+# 内容だけのハッシュ値と、ファイルパスを含めたハッシュ値を、一度の走査で計算する
+def calc_digests(buffer, file_path: str):
+    blake2 = hashlib.blake2b(digest_size=20)
+    blake2.update(buffer)
+    content_digest = blake2.hexdigest()
+
+    # ファイルパスをハッシュに含める
+    blake2.update(file_path.encode('utf-8'))
+
+    return content_digest, blake2.hexdigest()
+
+
+# ファイルのパス・サイズ・更新日時(変わっていない場合、内容も変わっていないとみなす)
+def get_file_stat(file_path: str):
+    stat = os.stat(file_path)
+
+    return (file_path, stat.st_size, stat.st_mtime_ns)
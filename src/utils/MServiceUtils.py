@@ -7,41 +7,70 @@ from collections import OrderedDict
 
 from mmd.PmxData import PmxModel, Vertex, Material, Bone, Morph, DisplaySlot, RigidBody, Joint # noqa
 from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame # noqa
-from module.MMath import MRect, MVector2D, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
+from module.MMath import MRect, MVector2D, MVector3D, MVector3DArray, MVector4D, MQuaternion, MQuaternionArray, MMatrix4x4 # noqa
 from module.MOptions import MOptions, MOptionsDataSet # noqa
-from module.MParams import BoneLinks # noqa
+from module.MParams import BoneLinks, PoseCache # noqa
 from utils import MBezierUtils # noqa
 from utils.MLogger import MLogger # noqa
 
 logger = MLogger(__name__, level=1)
 
+# グローバル位置のキャッシュ(各処理で共有する)
+pose_cache = PoseCache()
+# 付与親・軸制限を加味した回転量のキャッシュ(各処理で共有する)
+deform_cache = PoseCache()
+
 
 # IK計算
 # target_pos: IKリンクの目的位置
 # ik_links: IKリンク
-def calc_IK(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, target_pos: MVector3D, ik_links: BoneLinks, max_count=10):
+# is_two_bone: ジョイントが2つのIKリンクの場合、解析的に解く(解けない場合、CCDで解く)
+# pole_pos: 解析的に解く場合に、中間ジョイントを曲げる方向のグローバル位置
+# リンクの相対位置・回転はメモリ上に保持し、ジョイントを回転させるたびにそれ以降のボーンだけ計算し直す。モーションへの反映は最後に一回だけ行う
+def calc_IK(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, target_pos: MVector3D, ik_links: BoneLinks, max_count=10, is_two_bone=False, pole_pos=None):
     for bone_name in list(ik_links.all().keys())[1:]:
         # bfをモーションに登録
         bf = motion.calc_bf(bone_name, fno)
         motion.regist_bf(bf, bone_name, fno)
     
+    if is_two_bone and ik_links.size() == 3 and calc_two_bone_IK(model, links, motion, fno, target_pos, ik_links, pole_pos):
+        # 解析的に解けた場合、終了
+        return
+
+    skeleton = model.get_skeleton()
+    link_names = list(links.all().keys())
+    joint_names = list(ik_links.all().keys())[1:]
+
+    # ジョイントのキーフレと、IK中の回転量
+    joint_bfs = {joint_name: motion.calc_bf(joint_name, fno) for joint_name in joint_names}
+    joint_qqs = {joint_name: joint_bfs[joint_name].rotation for joint_name in joint_names}
+
+    # ジョイント毎に、回転が変わった時に計算し直すリンクのINDEX(自身と、自身を付与親に持つボーン)
+    joint_link_idxs = {}
+    for joint_name in joint_names:
+        joint_link_idxs[joint_name] = [n for n, lname in enumerate(link_names) \
+                                       if lname == joint_name or skeleton.index(joint_name) in skeleton.get_effect_ids(lname)]
+
+    # 現在のボーングローバル位置と行列
+    trans_vs, add_qs = calc_relative_position_rotation(model, links, motion, fno)
+    global_3ds = [None for _ in link_names]
+    total_mats = [None for _ in link_names]
+    calc_global_pos_from_index(trans_vs, add_qs, global_3ds, total_mats, 0)
+
     local_effector_pos = MVector3D()
     local_target_pos = MVector3D()
 
     for cnt in range(max_count):
         # 規定回数ループ
-        for ik_idx, joint_name in enumerate(list(ik_links.all().keys())[1:]):
+        for ik_idx, joint_name in enumerate(joint_names):
             # 処理対象IKボーン
             ik_bone = ik_links.get(joint_name)
 
-            # 現在のボーングローバル位置と行列を取得
-            global_3ds_dic, total_mats = calc_global_pos(model, links, motion, fno, return_matrix=True)
-
             # エフェクタ（末端）
-            global_effector_pos = global_3ds_dic[ik_links.first_name()]
+            global_effector_pos = global_3ds[link_names.index(ik_links.first_name())]
 
             # 注目ノード（実際に動かすボーン）
-            joint_mat = total_mats[joint_name]
+            joint_mat = total_mats[link_names.index(joint_name)]
 
             # ワールド座標系から注目ノードの局所座標系への変換
             inv_coord = joint_mat.inverted()
@@ -73,12 +102,11 @@ def calc_IK(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, targ
                 correct_qq = MQuaternion.fromAxisAndAngle(rotation_axis, min(rotation_degree, ik_bone.degree_limit))
 
                 # ジョイントに補正をかける
-                bf = motion.calc_bf(joint_name, fno)
-                new_ik_qq = correct_qq * bf.rotation
+                new_ik_qq = correct_qq * joint_qqs[joint_name]
 
                 # IK軸制限がある場合、上限下限をチェック
                 if ik_bone.ik_limit_min != MVector3D() and ik_bone.ik_limit_max != MVector3D():
-                    x_qq, y_qq, z_qq, yz_qq = separate_local_qq(fno, bone_name, new_ik_qq, model.get_local_x_axis(ik_bone.name))
+                    x_qq, y_qq, z_qq, yz_qq = separate_local_qq(fno, bone_name, new_ik_qq, skeleton.get_local_x_axis(ik_bone.name))
 
                     logger.test("new_ik_qq: %s, x_qq: %s, y_qq: %s, z_qq: %s", new_ik_qq.toEulerAngles(), x_qq.toEulerAngles(), y_qq.toEulerAngles(), z_qq.toEulerAngles())
                     logger.test("new_ik_qq: %s, x_qq: %s, y_qq: %s, z_qq: %s", new_ik_qq.toDegree(), x_qq.toDegree(), y_qq.toDegree(), z_qq.toDegree())
@@ -91,15 +119,371 @@ def calc_IK(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, targ
 
                     new_ik_qq = MQuaternion.fromEulerAngles(euler_x, euler_y, euler_z)
 
-                bf.rotation = new_ik_qq
+                joint_qqs[joint_name] = new_ik_qq
+
+                # 回転が変わったボーンの回転量を計算し直して、それ以降のグローバル位置と行列を更新する
+                for n in joint_link_idxs[joint_name]:
+                    add_qs[n] = deform_rotation(model, motion, joint_bfs.get(link_names[n]) or motion.calc_bf(link_names[n], fno), effect_rotations=joint_qqs)
+
+                if joint_link_idxs[joint_name]:
+                    calc_global_pos_from_index(trans_vs, add_qs, global_3ds, total_mats, min(joint_link_idxs[joint_name]))
 
         # 位置の差がほとんどない場合、終了
         if (local_effector_pos - local_target_pos).lengthSquared() < 0.0001:
-            return
-        
+            break
+
+    # モーションに反映
+    for joint_name in joint_names:
+        joint_bfs[joint_name].rotation = joint_qqs[joint_name]
+
     return
 
 
+# ジョイントが2つのIKリンク(腕→ひじ→手首、足→ひざ→足首等)の解析的なIK計算
+# 根元ジョイントと中間ジョイントの2つだけを回転させ、エフェクタを目的位置に合わせる(届かない場合、目的位置の方向に伸ばす)
+# pole_pos: 中間ジョイントを曲げる方向のグローバル位置(未指定の場合、現在の中間ジョイントの位置)
+# 解析的に解けない場合(固定軸・付与があるか、伸びきっていて曲げる方向が決まらないか、IK軸制限を超える場合)、Falseを返す
+def calc_two_bone_IK(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, target_pos: MVector3D, ik_links: BoneLinks, pole_pos=None):
+    skeleton = model.get_skeleton()
+    link_names = list(links.all().keys())
+    effector_name, middle_name, root_name = list(ik_links.all().keys())
+
+    for joint_name in [middle_name, root_name]:
+        joint_idx = skeleton.index(joint_name)
+        if joint_idx < 0 or skeleton.has_fixed_axes[joint_idx] or skeleton.effect_ids[joint_idx] >= 0:
+            # 軸制限・付与があるジョイントは、回転量がそのまま反映されないので不可
+            return False
+
+        if len([lname for lname in link_names if joint_idx in skeleton.get_effect_ids(lname)]) > 0:
+            # ジョイントを付与親とするボーンがある場合も不可
+            return False
+
+    effector_idx = link_names.index(effector_name)
+    middle_idx = link_names.index(middle_name)
+    root_idx = link_names.index(root_name)
+
+    if not 0 < root_idx < middle_idx < effector_idx:
+        return False
+
+    # 現在のボーングローバル位置と行列
+    trans_vs, add_qs = calc_relative_position_rotation(model, links, motion, fno)
+    global_3ds = [None for _ in link_names]
+    total_mats = [None for _ in link_names]
+    calc_global_pos_from_index(trans_vs, add_qs, global_3ds, total_mats, 0)
+
+    root_pos = global_3ds[root_idx]
+    middle_pos = global_3ds[middle_idx]
+    effector_pos = global_3ds[effector_idx]
+
+    # 根元→中間、中間→エフェクタの長さ(ジョイントを回転させても変わらない)
+    upper_length = middle_pos.distanceToPoint(root_pos)
+    lower_length = effector_pos.distanceToPoint(middle_pos)
+    target_length = target_pos.distanceToPoint(root_pos)
+
+    if upper_length < 0.0001 or lower_length < 0.0001 or target_length < 0.0001:
+        return False
+
+    # 根元から目的位置への向き
+    target_direction = (target_pos - root_pos).normalized()
+
+    # 曲げる方向(目的位置への向きと直交する成分)
+    hint_vec = (pole_pos if pole_pos else middle_pos) - root_pos
+    bend_direction = hint_vec - target_direction * MVector3D.dotProduct(hint_vec, target_direction)
+
+    if bend_direction.length() < 0.0001:
+        # 伸びきっている場合、初期姿勢での中間ジョイントの曲がり方向を根元の回転で向け直す
+        rest_root_pos = model.bones[root_name].position
+        rest_effector_direction = (model.bones[effector_name].position - rest_root_pos).normalized()
+        rest_hint_vec = model.bones[middle_name].position - rest_root_pos
+        rest_hint_vec = rest_hint_vec - rest_effector_direction * MVector3D.dotProduct(rest_hint_vec, rest_effector_direction)
+        hint_vec = total_mats[root_idx].toQuaternion() * rest_hint_vec
+        bend_direction = hint_vec - target_direction * MVector3D.dotProduct(hint_vec, target_direction)
+
+        if bend_direction.length() < 0.0001:
+            return False
+
+    bend_direction.normalize()
+
+    # 届く範囲に収めた、根元から目的位置までの長さ
+    reach_length = min(upper_length + lower_length, max(abs(upper_length - lower_length), target_length))
+
+    # 余弦定理で、根元ジョイントの開き具合を求める
+    root_cos = max(-1, min(1, (upper_length ** 2 + reach_length ** 2 - lower_length ** 2) / (2 * upper_length * reach_length)))
+
+    # 求めた中間ジョイントとエフェクタの位置
+    new_middle_pos = root_pos + (target_direction * root_cos + bend_direction * math.sqrt(1 - root_cos ** 2)) * upper_length
+    new_effector_pos = root_pos + target_direction * reach_length
+
+    # 根元ジョイントのグローバルの回転量
+    root_global_qq = MQuaternion.rotationTo(middle_pos - root_pos, new_middle_pos - root_pos)
+    # 根元を回した後のエフェクタ位置から、中間ジョイントのグローバルの回転量
+    rotated_effector_pos = root_pos + root_global_qq * (effector_pos - root_pos)
+    middle_global_qq = MQuaternion.rotationTo(rotated_effector_pos - new_middle_pos, new_effector_pos - new_middle_pos)
+
+    # 親の向きから見たローカルの回転量に変換して、ジョイントの回転量に掛ける
+    root_parent_qq = total_mats[root_idx - 1].toQuaternion()
+    middle_parent_qq = root_global_qq * total_mats[middle_idx - 1].toQuaternion()
+
+    joint_bfs = {root_name: motion.calc_bf(root_name, fno), middle_name: motion.calc_bf(middle_name, fno)}
+    joint_qqs = {root_name: root_parent_qq.inverted() * root_global_qq * root_parent_qq * joint_bfs[root_name].rotation, \
+                 middle_name: middle_parent_qq.inverted() * middle_global_qq * middle_parent_qq * joint_bfs[middle_name].rotation}
+
+    for joint_name, joint_qq in joint_qqs.items():
+        ik_bone = ik_links.get(joint_name)
+
+        # IK軸制限がある場合、CCDと同じく上限下限をチェック
+        if ik_bone.ik_limit_min != MVector3D() and ik_bone.ik_limit_max != MVector3D():
+            x_qq, y_qq, z_qq, _ = separate_local_qq(fno, joint_name, joint_qq, skeleton.get_local_x_axis(ik_bone.name))
+
+            for degree, limit_min, limit_max in [(x_qq.toDegree(), ik_bone.ik_limit_min.x(), ik_bone.ik_limit_max.x()), \
+                                                 (y_qq.toDegree(), ik_bone.ik_limit_min.y(), ik_bone.ik_limit_max.y()), \
+                                                 (z_qq.toDegree(), ik_bone.ik_limit_min.z(), ik_bone.ik_limit_max.z())]:
+                if not limit_min <= degree <= limit_max:
+                    # 制限を超える場合、CCDに任せる
+                    return False
+
+    # モーションに反映
+    for joint_name, joint_qq in joint_qqs.items():
+        joint_bfs[joint_name].rotation = joint_qq.normalized()
+        motion.regist_bf(joint_bfs[joint_name], joint_name, fno)
+
+    return True
+
+
+# 指定INDEX以降のボーンについて、グローバル位置と行列を計算し直す(calc_global_posと同じ計算)
+# global_3ds, total_mats: リンク順のグローバル位置と行列のリスト(指定INDEX以降を上書きする)
+def calc_global_pos_from_index(trans_vs: list, add_qs: list, global_3ds: list, total_mats: list, start_idx: int):
+    for n in range(start_idx, len(trans_vs)):
+        # 行列を生成
+        mat = MMatrix4x4()
+        # 初期化
+        mat.setToIdentity()
+        # 移動
+        mat.translate(trans_vs[n])
+        # 回転
+        mat.rotate(add_qs[n])
+
+        if n == 0:
+            total_mat = MMatrix4x4()
+            total_mat.setToIdentity()
+        else:
+            total_mat = total_mats[n - 1].copy()
+
+        # 自分は、位置だけ掛ける
+        global_3ds[n] = total_mat * trans_vs[n]
+
+        # 最後の行列をかけ算する
+        total_mat *= mat
+        total_mats[n] = total_mat
+
+
+# 複数フレームのIK計算(calc_IKと同じ計算を、全フレームまとめて行う)
+# ジョイントのキーフレは、解く前に全フレーム分登録する
+# target_poses: フレーム毎のIKリンクの目的位置(フレーム数×3)
+# ik_links: IKリンク
+# is_warm_start: 先にwarm_start_interval毎に間引いたフレームを解き、残りのフレームは直前に解いたフレームの補正量を掛けてから解き始める
+# 戻り値は、フレーム毎に収束したか否かの配列
+def calc_IK_many(model: PmxModel, links: BoneLinks, motion: VmdMotion, fnos, target_poses, ik_links: BoneLinks, max_count=10, is_warm_start=False, warm_start_interval=10):
+    fnos = np.asarray(fnos, dtype=np.int64).reshape(-1)
+    target_poses = np.broadcast_to(MVector3DArray.to_data(target_poses), (len(fnos), 3))
+    joint_names = list(ik_links.all().keys())[1:]
+
+    for fno in fnos:
+        for bone_name in joint_names:
+            # bfをモーションに登録
+            bf = motion.calc_bf(bone_name, fno)
+            motion.regist_bf(bf, bone_name, fno)
+
+    # IK中のジョイントの回転量
+    joint_qqs = {joint_name: motion.calc_bf_many(joint_name, fnos)[1] for joint_name in joint_names}
+    is_converged = np.zeros(len(fnos), dtype=np.bool_)
+
+    if is_warm_start and len(fnos) > warm_start_interval:
+        org_joint_qqs = {joint_name: joint_qqs[joint_name].copy() for joint_name in joint_names}
+
+        # 間引いたフレームを先に解く
+        first_idxs = np.arange(0, len(fnos), warm_start_interval)
+        is_converged[first_idxs] = calc_IK_many_frames(model, links, motion, fnos, target_poses, ik_links, joint_qqs, first_idxs, max_count)
+
+        # 残りは直前に解いたフレームの補正量を掛けた所から解き始める
+        rest_idxs = np.setdiff1d(np.arange(len(fnos)), first_idxs)
+        warm_idxs = first_idxs[np.searchsorted(first_idxs, rest_idxs) - 1]
+        for joint_name in joint_names:
+            warm_qqs = MQuaternionArray(joint_qqs[joint_name][warm_idxs]) * MQuaternionArray(org_joint_qqs[joint_name][warm_idxs]).inverted()
+            joint_qqs[joint_name][rest_idxs] = (warm_qqs * MQuaternionArray(joint_qqs[joint_name][rest_idxs])).data()
+        is_converged[rest_idxs] = calc_IK_many_frames(model, links, motion, fnos, target_poses, ik_links, joint_qqs, rest_idxs, max_count)
+    else:
+        is_converged[:] = calc_IK_many_frames(model, links, motion, fnos, target_poses, ik_links, joint_qqs, np.arange(len(fnos)), max_count)
+
+    # モーションに反映
+    for joint_name in joint_names:
+        for fno, qq in zip(fnos, joint_qqs[joint_name]):
+            motion.calc_bf(joint_name, fno).rotation = MQuaternion(qq)
+
+    return is_converged
+
+
+# 指定INDEXのフレームだけIK計算を行う(calc_IK_manyの本体)
+# joint_qqs: ジョイントの回転量(key:ボーン名, value:フレーム数×4)。指定INDEXのフレームを上書きする
+def calc_IK_many_frames(model: PmxModel, links: BoneLinks, motion: VmdMotion, fnos: np.ndarray, target_poses: np.ndarray, ik_links: BoneLinks, joint_qqs: dict, \
+                        fidxs: np.ndarray, max_count: int):
+    skeleton = model.get_skeleton()
+    link_names = list(links.all().keys())
+    effector_idx = link_names.index(ik_links.first_name())
+    now_fnos = fnos[fidxs]
+    now_target_poses = target_poses[fidxs]
+    now_joint_qqs = {joint_name: joint_qqs[joint_name][fidxs] for joint_name in joint_qqs.keys()}
+
+    # ジョイント毎に、回転が変わった時に計算し直すリンクのINDEX(自身と、自身を付与親に持つボーン)
+    joint_link_idxs = {}
+    for joint_name in now_joint_qqs.keys():
+        joint_link_idxs[joint_name] = [n for n, lname in enumerate(link_names) \
+                                       if lname == joint_name or skeleton.index(joint_name) in skeleton.get_effect_ids(lname)]
+
+    # リンクのキーフレの回転量(ジョイントはIK中の回転量)
+    link_qqs = [now_joint_qqs[lname] if lname in now_joint_qqs else motion.calc_bf_many(lname, now_fnos)[1] for lname in link_names]
+
+    # 現在のボーングローバル位置と行列(ジョイントの回転量は、IK中の回転量で計算し直す)
+    trans_vs, add_qs = calc_relative_position_rotation_many(model, links, motion, now_fnos)
+    trans_vs = [v.data() for v in trans_vs]
+    add_qs = [q.data().copy() for q in add_qs]
+    for n in sorted(set([n for link_idxs in joint_link_idxs.values() for n in link_idxs])):
+        add_qs[n] = deform_rotation_many(model, motion, link_names[n], now_fnos, MQuaternionArray(link_qqs[n]), \
+                                         effect_rotations={jname: MQuaternionArray(jqq) for jname, jqq in now_joint_qqs.items()}).data()
+
+    global_poses = np.zeros((len(now_fnos), len(link_names), 3), dtype=np.float64)
+    total_mats = np.zeros((len(now_fnos), len(link_names), 4, 4), dtype=np.float64)
+    calc_global_pos_many_from_index(trans_vs, add_qs, global_poses, total_mats, 0)
+
+    # まだ収束していないフレーム
+    is_active = np.ones(len(now_fnos), dtype=np.bool_)
+
+    for cnt in range(max_count):
+        # 規定回数ループ
+        aidxs = np.flatnonzero(is_active)
+        if len(aidxs) == 0:
+            break
+
+        diffs = np.zeros(len(aidxs), dtype=np.float64)
+
+        for joint_name in now_joint_qqs.keys():
+            # 処理対象IKボーン
+            ik_bone = ik_links.get(joint_name)
+
+            # ワールド座標系から注目ノードの局所座標系への変換
+            inv_coords = np.linalg.inv(total_mats[aidxs, link_names.index(joint_name)])
+
+            # 注目ノードを起点とした、エフェクタのローカル位置
+            local_effector_poses = calc_pos_by_matrix_many(inv_coords, global_poses[aidxs, effector_idx])
+            local_target_poses = calc_pos_by_matrix_many(inv_coords, now_target_poses[aidxs])
+            diffs = np.sum((local_effector_poses - local_target_poses) ** 2, axis=1)
+
+            #  (1) 基準関節→エフェクタ位置への方向ベクトル
+            basis2_effectors = MVector3DArray(local_effector_poses).normalized().data()
+            #  (2) 基準関節→目標位置への方向ベクトル
+            basis2_targets = MVector3DArray(local_target_poses).normalized().data()
+
+            # ベクトル (1) を (2) に一致させるための最短回転量（Axis-Angle）
+            rotation_radians = np.arccos(np.clip(np.sum(basis2_effectors * basis2_targets, axis=1), -1, 1))
+
+            # 一定角度以上の場合
+            rotation_mask = np.abs(rotation_radians) > 0.0001
+            if not np.any(rotation_mask):
+                continue
+
+            ridxs = aidxs[rotation_mask]
+
+            # 回転軸
+            rotation_axises = MVector3DArray(np.cross(basis2_effectors[rotation_mask], basis2_targets[rotation_mask])).normalized().data()
+            # 回転角度
+            rotation_degrees = np.degrees(rotation_radians[rotation_mask])
+
+            # 関節回転量の補正(最大変位量を制限する)
+            correct_qqs = MQuaternionArray.fromAxisAndAngle(rotation_axises, np.minimum(rotation_degrees, ik_bone.degree_limit))
+
+            # ジョイントに補正をかける
+            new_ik_qqs = correct_qqs * MQuaternionArray(now_joint_qqs[joint_name][ridxs])
+
+            # IK軸制限がある場合、上限下限をチェック
+            if ik_bone.ik_limit_min != MVector3D() and ik_bone.ik_limit_max != MVector3D():
+                x_qqs, y_qqs, z_qqs, _ = separate_local_qq_many(new_ik_qqs, skeleton.get_local_x_axis(ik_bone.name))
+
+                euler_xs = np.minimum(ik_bone.ik_limit_max.x(), np.maximum(ik_bone.ik_limit_min.x(), x_qqs.toDegree()))
+                euler_ys = np.minimum(ik_bone.ik_limit_max.y(), np.maximum(ik_bone.ik_limit_min.y(), y_qqs.toDegree()))
+                euler_zs = np.minimum(ik_bone.ik_limit_max.z(), np.maximum(ik_bone.ik_limit_min.z(), z_qqs.toDegree()))
+
+                new_ik_qqs = MQuaternionArray.fromEulerAngles(euler_xs, euler_ys, euler_zs)
+
+            now_joint_qqs[joint_name][ridxs] = new_ik_qqs.data()
+
+            # 回転が変わったボーンの回転量を計算し直して、それ以降のグローバル位置と行列を更新する
+            for n in joint_link_idxs[joint_name]:
+                add_qs[n][ridxs] = deform_rotation_many(model, motion, link_names[n], now_fnos[ridxs], MQuaternionArray(link_qqs[n][ridxs]), \
+                                                        effect_rotations={jname: MQuaternionArray(jqq[ridxs]) for jname, jqq in now_joint_qqs.items()}).data()
+
+            if joint_link_idxs[joint_name]:
+                now_global_poses = global_poses[ridxs]
+                now_total_mats = total_mats[ridxs]
+                calc_global_pos_many_from_index([v[ridxs] for v in trans_vs], [q[ridxs] for q in add_qs], now_global_poses, now_total_mats, min(joint_link_idxs[joint_name]))
+                global_poses[ridxs] = now_global_poses
+                total_mats[ridxs] = now_total_mats
+
+        # 位置の差がほとんどない場合、そのフレームは終了
+        is_active[aidxs[diffs < 0.0001]] = False
+
+    for joint_name in now_joint_qqs.keys():
+        joint_qqs[joint_name][fidxs] = now_joint_qqs[joint_name]
+
+    return ~is_active
+
+
+# 複数のクォータニオンをまとめてローカル軸の回転量に分離(separate_local_qqと同じ)
+def separate_local_qq_many(qqs: MQuaternionArray, global_x_axis: MVector3D):
+    # ローカル座標系（ボーンベクトルが（1，0，0）になる空間）の向き
+    local_axis = MVector3D(1, 0, 0)
+
+    # グローバル座標系（Ａスタンス）からローカル座標系（ボーンベクトルが（1，0，0）になる空間）への変換
+    global2local_mat = MQuaternion.rotationTo(global_x_axis, local_axis).toMatrix4x4().data()
+    local2global_mat = MQuaternion.rotationTo(local_axis, global_x_axis).toMatrix4x4().data()
+
+    # X成分を抽出する ------------
+
+    # 入力qqでグローバル軸方向に伸ばした位置
+    qq_mats = qqs.toMatrix4x4()
+    mat_x1_vecs = calc_pos_by_matrix_many(qq_mats, np.tile(global_x_axis.data(), (len(qqs), 1)))
+
+    # YZの回転量（自身のねじれを無視する）
+    yz_qqs = MQuaternionArray.rotationTo(global_x_axis, mat_x1_vecs)
+    yz_mats = yz_qqs.toMatrix4x4()
+
+    # 除去されたX成分を求める
+    x_qqs = MQuaternionArray.fromMatrix4x4(np.matmul(qq_mats, np.linalg.inv(yz_mats)))
+
+    # YZ回転からZ成分を抽出する --------------
+
+    # グローバル軸の回転量からローカルの回転量に変換して、ローカル軸方向に伸ばす
+    mat_z1_vecs = calc_pos_by_matrix_many(np.matmul(yz_mats, global2local_mat), np.tile(local_axis.data(), (len(qqs), 1)))
+    # Z方向の移動量を潰す
+    mat_z1_vecs[:, 2] = 0
+
+    # ローカル軸からZを潰した移動への回転量
+    local_z_qqs = MQuaternionArray.rotationTo(local_axis, mat_z1_vecs)
+
+    # ボーンローカル座標系の回転をグローバル座標系の回転に戻す
+    z_qqs = MQuaternionArray.fromMatrix4x4(np.matmul(local_z_qqs.toMatrix4x4(), local2global_mat))
+
+    # YZ回転からY成分だけ取り出す -----------
+
+    mat_y2_qqs = MQuaternionArray.fromMatrix4x4(np.matmul(yz_mats, np.linalg.inv(z_qqs.toMatrix4x4())))
+
+    # X成分の捻れが混入したので、XY回転からYZ回転を取り出すことでXキャンセルをかける。
+    mat_y3_vecs = calc_pos_by_matrix_many(mat_y2_qqs.toMatrix4x4(), np.tile(global_x_axis.data(), (len(qqs), 1)))
+
+    y_qqs = MQuaternionArray.rotationTo(global_x_axis, mat_y3_vecs)
+
+    return x_qqs, y_qqs, z_qqs, yz_qqs
+
+
 # クォータニオンをローカル軸の回転量に分離
 def separate_local_qq(fno: int, bone_name: str, qq: MQuaternion, global_x_axis: MVector3D):
     # ローカル座標系（ボーンベクトルが（1，0，0）になる空間）の向き
@@ -177,13 +561,13 @@ def separate_local_qq(fno: int, bone_name: str, qq: MQuaternion, global_x_axis:
 
 
 # 正面向きの情報を含むグローバル位置
-def calc_front_global_pos(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, direction_limit_links=None):
+def calc_front_global_pos(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, direction_limit_links=None, is_cache=False):
 
     # グローバル位置
-    global_3ds = org_center_global_3ds = calc_global_pos(model, links, motion, fno, limit_links)
+    global_3ds = org_center_global_3ds = calc_global_pos(model, links, motion, fno, limit_links, is_cache=is_cache)
 
     # 指定ボーンまでの向いている回転量（回転のみの制限がかかっている場合、それを優先）
-    direction_qq = calc_direction_qq(model, links, motion, fno, (limit_links if not direction_limit_links else direction_limit_links))
+    direction_qq = calc_direction_qq(model, links, motion, fno, (limit_links if not direction_limit_links else direction_limit_links), is_cache=is_cache)
 
     # 正面向きのグローバル位置
     front_global_3ds = calc_global_pos_by_direction(direction_qq.inverted(), org_center_global_3ds)
@@ -192,7 +576,172 @@ def calc_front_global_pos(model: PmxModel, links: BoneLinks, motion: VmdMotion,
 
 
 # グローバル位置算出
-def calc_global_pos(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, return_matrix=False, is_local_x=False):
+# is_cache: キャッシュを使う(キーフレの登録・値の代入でモーションの更新バージョンが変わるので、古い結果は使われない。
+#           位置・回転をsetX等で直接変更した場合は、代入し直すか、キーフレのtouch()を呼ぶこと)
+# is_deform_cache: 回転量だけキャッシュを使う(条件はis_cacheと同じ)
+def calc_global_pos(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, return_matrix=False, is_local_x=False, is_cache=False, \
+                    is_deform_cache=False):
+    if is_cache:
+        return calc_global_pos_cache(model, links, motion, fno, limit_links, return_matrix, is_local_x)
+
+    trans_vs, add_qs = calc_relative_position_rotation(model, links, motion, fno, limit_links, is_cache=is_deform_cache)
+
+    total_mats = {}
+    global_3ds_dic = OrderedDict()
+
+    # 親から順に掛け合わせた行列
+    parent_mat = None
+
+    for n, (lname, v, q) in enumerate(zip(links.all().keys(), trans_vs, add_qs)):
+        # 行列を生成
+        mat = MMatrix4x4()
+        # 初期化
+        mat.setToIdentity()
+        # 移動
+        mat.translate(v)
+        # 回転
+        mat.rotate(q)
+
+        if n == 0:
+            total_mat = MMatrix4x4()
+            total_mat.setToIdentity()
+        else:
+            total_mat = parent_mat.copy()
+
+        # 自分は、位置だけ掛ける
+        global_3ds_dic[lname] = total_mat * v
+
+        # 最後の行列をかけ算する
+        total_mat *= mat
+        # 子のために、親までの行列を保持する
+        parent_mat = mat.copy() if n == 0 else total_mat.copy()
+
+        # ローカル軸の向きを調整する
+        if n > 0 and is_local_x:
+            total_mat *= calc_local_x_matrix(model, links, lname)
+
+        total_mats[lname] = total_mat
+
+    if return_matrix:
+        # 行列も返す場合
+        return global_3ds_dic, total_mats
+
+    return global_3ds_dic
+
+
+# キャッシュを使ったグローバル位置算出
+# キーはモデル(ボーン辞書の更新バージョン含む)・リンク・モーションの更新バージョン・フレーム番号。モーションが更新されればバージョンが変わるので、古い結果は使われない
+def calc_global_pos_cache(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, return_matrix=False, is_local_x=False):
+    cache_key = (id(model), model.digest, model.bones.version, links.cache_key(), tuple(limit_links.all().keys()) if limit_links else None, \
+                 is_local_x, id(motion), motion.version, fno)
+
+    cache_poses = pose_cache.get(cache_key)
+    if cache_poses is None:
+        global_3ds_dic, total_mats = calc_global_pos(model, links, motion, fno, limit_links, return_matrix=True, is_local_x=is_local_x, is_deform_cache=True)
+        cache_poses = (np.array([[v.data() for v in global_3ds_dic.values()]]), np.array([[m.data() for m in total_mats.values()]]))
+        pose_cache.put(cache_key, cache_poses)
+
+    # 呼び出し元で書き換えられても良いよう、毎回新しいインスタンスで返す
+    global_3ds_dic, total_mats = get_global_pos_dic(links, cache_poses[0], cache_poses[1], 0)
+
+    if return_matrix:
+        # 行列も返す場合
+        return global_3ds_dic, total_mats
+
+    return global_3ds_dic
+
+
+# 複数フレームのグローバル位置算出
+# 戻り値はグローバル位置の配列(フレーム数×ボーン数×3)。return_matrixの場合、行列の配列(フレーム数×ボーン数×4×4)も返す
+# ボーンの並び順はlinksの順番
+def calc_global_pos_many(model: PmxModel, links: BoneLinks, motion: VmdMotion, fnos, limit_links=None, return_matrix=False, is_local_x=False):
+    fnos = np.asarray(fnos, dtype=np.int64).reshape(-1)
+    trans_vs, add_qs = calc_relative_position_rotation_many(model, links, motion, fnos, limit_links)
+
+    global_poses = np.zeros((len(fnos), links.size(), 3), dtype=np.float64)
+    total_mats = np.zeros((len(fnos), links.size(), 4, 4), dtype=np.float64)
+    calc_global_pos_many_from_index([v.data() for v in trans_vs], [q.data() for q in add_qs], global_poses, total_mats, 0)
+
+    if is_local_x:
+        for n, lname in enumerate(links.all().keys()):
+            # ローカル軸の向きを調整する
+            if n > 0:
+                total_mats[:, n] = np.matmul(total_mats[:, n], calc_local_x_matrix(model, links, lname).data())
+
+    if return_matrix:
+        # 行列も返す場合
+        return global_poses, total_mats
+
+    return global_poses
+
+
+# 指定INDEX以降のボーンについて、複数フレームのグローバル位置と行列を計算し直す
+# trans_vs, add_qs: リンク順の相対位置(フレーム数×3)と回転(フレーム数×4)の配列のリスト
+# global_poses, total_mats: グローバル位置(フレーム数×ボーン数×3)と行列(フレーム数×ボーン数×4×4)。指定INDEX以降を上書きする
+def calc_global_pos_many_from_index(trans_vs: list, add_qs: list, global_poses: np.ndarray, total_mats: np.ndarray, start_idx: int):
+    for n in range(start_idx, len(trans_vs)):
+        # 親から順に掛け合わせた行列
+        parent_mats = total_mats[:, n - 1] if n > 0 else np.tile(np.eye(4), (len(global_poses), 1, 1))
+
+        # 移動してから回転する行列
+        mats = np.tile(np.eye(4), (len(global_poses), 1, 1))
+        mats[:, :3, 3] = trans_vs[n]
+        mats = np.matmul(mats, MQuaternionArray(add_qs[n]).toMatrix4x4())
+
+        # 自分は、位置だけ掛ける
+        global_poses[:, n] = calc_pos_by_matrix_many(parent_mats, trans_vs[n])
+
+        # 最後の行列をかけ算する
+        total_mats[:, n] = np.matmul(parent_mats, mats)
+
+
+# calc_global_pos_manyの結果から、指定フレームINDEX分をcalc_global_posと同じ形式で取り出す
+def get_global_pos_dic(links: BoneLinks, global_poses: np.ndarray, total_mats: np.ndarray, fidx: int):
+    global_3ds_dic = OrderedDict()
+    total_mats_dic = {}
+
+    for n, lname in enumerate(links.all().keys()):
+        global_3ds_dic[lname] = MVector3D(global_poses[fidx, n])
+        if total_mats is not None:
+            total_mats_dic[lname] = MMatrix4x4(total_mats[fidx, n])
+
+    return global_3ds_dic, total_mats_dic
+
+
+# 行列の配列(N×4×4)で位置の配列(N×3)を変換する(MMatrix4x4 * MVector3D と同じ)
+def calc_pos_by_matrix_many(mats: np.ndarray, poses: np.ndarray):
+    data_sum = np.einsum('nij,nj->ni', mats[:, :, :3], poses) + mats[:, :, 3]
+    ws = data_sum[:, 3:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(ws == 1.0, data_sum[:, :3], np.where(ws == 0.0, 0.0, data_sum[:, :3] / ws))
+
+
+# ローカル軸の向きの行列
+def calc_local_x_matrix(model: PmxModel, links: BoneLinks, lname: str):
+    # ボーン自身にローカル軸が設定されているか
+    local_x_matrix = MMatrix4x4()
+    local_x_matrix.setToIdentity()
+
+    local_axis_qq = MQuaternion()
+
+    if model.bones[lname].local_x_vector == MVector3D():
+        # ローカル軸が設定されていない場合、計算
+
+        # 自身から親を引いた軸の向き
+        local_axis = model.bones[lname].position - links.get(lname, offset=-1).position
+        local_axis_qq = MQuaternion.fromDirection(local_axis.normalized(), MVector3D(0, 0, 1))
+    else:
+        # ローカル軸が設定されている場合、その値を採用
+        local_axis_qq = MQuaternion.fromDirection(model.bones[lname].local_x_vector.normalized(), MVector3D(0, 0, 1))
+    
+    local_x_matrix.rotate(local_axis_qq)
+
+    return local_x_matrix
+
+
+# グローバル位置算出(各ボーン毎に親からの行列を全部掛け直す元々の処理。calc_global_posとの比較用)
+def calc_global_pos_org(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, return_matrix=False, is_local_x=False):
     trans_vs = calc_relative_position(model, links, motion, fno, limit_links)
     add_qs = calc_relative_rotation(model, links, motion, fno, limit_links)
 
@@ -284,6 +833,67 @@ def calc_global_pos_by_direction(direction_qq: MQuaternion, target_pos_3ds_dic:
     return direction_pos_dic
 
 
+# 各ボーンの相対位置と相対回転情報(キーフレの補間はボーン毎に1回だけ行う)
+def calc_relative_position_rotation(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, is_cache=False):
+    trans_vs = []
+    add_qs = []
+
+    for link_idx, link_bone_name in enumerate(links.all()):
+        link_bone = links.get(link_bone_name)
+
+        if not limit_links or (limit_links and limit_links.get(link_bone_name)):
+            # 上限リンクがある倍、ボーンが存在している場合のみ、モーション内のキー情報を取得
+            fill_bf = motion.calc_bf(link_bone.name, fno, is_readonly=True)
+        else:
+            # 上限リンクでボーンがない場合、ボーンは初期値
+            fill_bf = VmdBoneFrame(fno=fno)
+            fill_bf.set_name(link_bone_name)
+
+        # 位置
+        if link_idx == 0:
+            # 一番親は、グローバル座標を考慮
+            trans_vs.append(link_bone.position + fill_bf.position)
+        else:
+            # 位置：自身から親の位置を引いた相対位置
+            trans_vs.append(link_bone.position + fill_bf.position - links.get(link_bone_name, offset=-1).position)
+
+        # 実際の回転量を計算
+        add_qs.append(deform_rotation(model, motion, fill_bf, is_cache=is_cache))
+
+    return trans_vs, add_qs
+
+
+# 複数フレームの各ボーンの相対位置と相対回転情報
+# 戻り値はボーン毎の位置(MVector3DArray)と回転(MQuaternionArray)のリスト
+def calc_relative_position_rotation_many(model: PmxModel, links: BoneLinks, motion: VmdMotion, fnos: np.ndarray, limit_links=None):
+    trans_vs = []
+    add_qs = []
+
+    for link_idx, link_bone_name in enumerate(links.all()):
+        link_bone = links.get(link_bone_name)
+
+        if not limit_links or (limit_links and limit_links.get(link_bone_name)):
+            # 上限リンクがある倍、ボーンが存在している場合のみ、モーション内のキー情報を取得
+            positions, rotations = motion.calc_bf_many(link_bone.name, fnos)
+        else:
+            # 上限リンクでボーンがない場合、ボーンは初期値
+            positions = np.zeros((len(fnos), 3), dtype=np.float64)
+            rotations = np.tile(np.array([1, 0, 0, 0], dtype=np.float64), (len(fnos), 1))
+
+        # 位置
+        if link_idx == 0:
+            # 一番親は、グローバル座標を考慮
+            trans_vs.append(link_bone.position + MVector3DArray(positions))
+        else:
+            # 位置：自身から親の位置を引いた相対位置
+            trans_vs.append(link_bone.position + MVector3DArray(positions) - links.get(link_bone_name, offset=-1).position)
+
+        # 実際の回転量を計算
+        add_qs.append(deform_rotation_many(model, motion, link_bone.name, fnos, MQuaternionArray(rotations)))
+
+    return trans_vs, add_qs
+
+
 # 各ボーンの相対位置情報
 def calc_relative_position(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None):
     trans_vs = []
@@ -293,7 +903,7 @@ def calc_relative_position(model: PmxModel, links: BoneLinks, motion: VmdMotion,
 
         if not limit_links or (limit_links and limit_links.get(link_bone_name)):
             # 上限リンクがある倍、ボーンが存在している場合のみ、モーション内のキー情報を取得
-            fill_bf = motion.calc_bf(link_bone.name, fno)
+            fill_bf = motion.calc_bf(link_bone.name, fno, is_readonly=True)
         else:
             # 上限リンクでボーンがない場合、ボーンは初期値
             fill_bf = VmdBoneFrame(fno=fno)
@@ -311,7 +921,7 @@ def calc_relative_position(model: PmxModel, links: BoneLinks, motion: VmdMotion,
 
 
 # 各ボーンの相対回転情報
-def calc_relative_rotation(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None):
+def calc_relative_rotation(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, is_cache=False):
     add_qs = []
 
     for link_idx, link_bone_name in enumerate(links.all()):
@@ -319,14 +929,14 @@ def calc_relative_rotation(model: PmxModel, links: BoneLinks, motion: VmdMotion,
 
         if not limit_links or (limit_links and limit_links.get(link_bone_name)):
             # 上限リンクがある場合、ボーンが存在している場合のみ、モーション内のキー情報を取得
-            fill_bf = motion.calc_bf(link_bone.name, fno)
+            fill_bf = motion.calc_bf(link_bone.name, fno, is_readonly=True)
         else:
             # 上限リンクでボーンがない場合、ボーンは初期値
             fill_bf = VmdBoneFrame(fno=fno)
             fill_bf.set_name(link_bone_name)
         
         # 実際の回転量を計算
-        rot = deform_rotation(model, motion, fill_bf)
+        rot = deform_rotation(model, motion, fill_bf, is_cache=is_cache)
 
         add_qs.append(rot)
 
@@ -334,69 +944,158 @@ def calc_relative_rotation(model: PmxModel, links: BoneLinks, motion: VmdMotion,
 
 
 # 指定ボーンの実際の回転情報
-def deform_rotation(model: PmxModel, motion: VmdMotion, bf: VmdBoneFrame):
-    if bf.name not in model.bones:
+# effect_rotations: モーションに登録する前の回転量(key:ボーン名)。指定されたボーンは、モーションの回転量の代わりに使う
+# is_cache: キャッシュを使う(付与親のキーフレが更新されると別のキーになる。条件はcalc_global_posと同じ)
+def deform_rotation(model: PmxModel, motion: VmdMotion, bf: VmdBoneFrame, effect_rotations=None, is_cache=False):
+    skeleton = model.get_skeleton()
+    bidx = skeleton.index(bf.name)
+    if bidx < 0:
         return MQuaternion()
 
-    bone = model.bones[bf.name]
-    rot = bf.rotation.normalized().copy()
+    effect_rotations = effect_rotations or {}
+    rot = effect_rotations.get(bf.name, bf.rotation).normalized().copy()
+    effect_ids, effect_factors = skeleton.get_effect_chain(bf.name)
+
+    cache_key = None
+    if is_cache and not effect_rotations and (skeleton.has_fixed_axes[bidx] or len(effect_ids) > 0):
+        # 軸制限・付与親がある場合のみキャッシュする
+        cache_key = get_deform_cache_key(model, skeleton, motion, bf.name, bf.fno, bf.rotation.scalar(), bf.rotation.x(), bf.rotation.y(), bf.rotation.z())
+        cache_qq = deform_cache.get(cache_key)
+        if cache_qq is not None:
+            return MQuaternion(*cache_qq)
+
+    if skeleton.has_fixed_axes[bidx]:
+        fixed_x = skeleton.fixed_axes[bidx, 0]
 
-    if bone.fixed_axis != MVector3D():
         # 回転角度を求める
         if rot != MQuaternion():
             # 回転補正
-            if "右" in bone.name and rot.x() > 0 and bone.fixed_axis.x() <= 0:
+            if skeleton.is_rights[bidx] and rot.x() > 0 and fixed_x <= 0:
                 rot.setX(rot.x() * -1)
                 rot.setScalar(rot.scalar() * -1)
-            elif "左" in bone.name and rot.x() < 0 and bone.fixed_axis.x() >= 0:
+            elif skeleton.is_lefts[bidx] and rot.x() < 0 and fixed_x >= 0:
                 rot.setX(rot.x() * -1)
                 rot.setScalar(rot.scalar() * -1)
             # 回転補正（コロン式ミクさん等軸反転パターン）
-            elif "右" in bone.name and rot.x() < 0 and bone.fixed_axis.x() > 0:
+            elif skeleton.is_rights[bidx] and rot.x() < 0 and fixed_x > 0:
                 rot.setX(rot.x() * -1)
                 rot.setScalar(rot.scalar() * -1)
-            elif "左" in bone.name and rot.x() > 0 and bone.fixed_axis.x() < 0:
+            elif skeleton.is_lefts[bidx] and rot.x() > 0 and fixed_x < 0:
                 rot.setX(rot.x() * -1)
                 rot.setScalar(rot.scalar() * -1)
             
             rot.normalize()
         
         # 軸固定の場合、回転を制限する
-        rot = MQuaternion.fromAxisAndAngle(bone.fixed_axis, rot.toDegree())
+        rot = MQuaternion.fromAxisAndAngle(MVector3D(skeleton.fixed_axes[bidx]), rot.toDegree())
     
-    if bone.getExternalRotationFlag() and bone.effect_index in model.bone_indexes:
-        
-        effect_parent_bone = bone
-        effect_bone = model.bones[model.bone_indexes[bone.effect_index]]
-        cnt = 0
-
-        while cnt < 100:
-            # 付与親が取得できたら、該当する付与親の回転を取得する
-            effect_bf = motion.calc_bf(effect_bone.name, bf.fno)
-
-            # 自身の回転量に付与親の回転量を付与率を加味して付与する
-            if effect_parent_bone.effect_factor < 0:
-                # マイナス付与の場合、逆回転
-                rot = rot * (effect_bf.rotation * abs(effect_parent_bone.effect_factor)).inverted()
-            else:
-                rot = rot * (effect_bf.rotation * effect_parent_bone.effect_factor)
+    for effect_idx, effect_factor in zip(effect_ids, effect_factors):
+        # 付与親が取得できたら、該当する付与親の回転を取得する
+        effect_bone_name = skeleton.names[effect_idx]
+        effect_qq = effect_rotations[effect_bone_name] if effect_bone_name in effect_rotations else motion.calc_bf(effect_bone_name, bf.fno, is_readonly=True).rotation
+        effect_factor = float(effect_factor)
+
+        # 自身の回転量に付与親の回転量を付与率を加味して付与する
+        if effect_factor < 0:
+            # マイナス付与の場合、逆回転
+            rot = rot * (effect_qq * abs(effect_factor)).inverted()
+        else:
+            rot = rot * (effect_qq * effect_factor)
 
-            if effect_bone.getExternalRotationFlag() and effect_bone.effect_index in model.bone_indexes:
-                # 付与親の親として現在のeffectboneを保持
-                effect_parent_bone = effect_bone
-                # 付与親置き換え
-                effect_bone = model.bones[model.bone_indexes[effect_bone.effect_index]]
-            else:
-                break
+    if cache_key:
+        deform_cache.put(cache_key, (rot.scalar(), rot.x(), rot.y(), rot.z()))
 
-            cnt += 1
+    return rot
+
+
+# 回転量キャッシュのキー
+# 付与親のボーンモーションのいずれかが更新されるか、ボーン自身の回転量が変わると別のキーになる
+def get_deform_cache_key(model: PmxModel, skeleton, motion: VmdMotion, bone_name: str, fno: int, w: float, x: float, y: float, z: float):
+    effect_versions = tuple(motion.bones.raw_get(skeleton.names[effect_idx]).version if skeleton.names[effect_idx] in motion.bones else 0 \
+                            for effect_idx in skeleton.get_effect_ids(bone_name))
+
+    return (id(model), model.digest, id(skeleton), id(motion), effect_versions, bone_name, fno, float(w), float(x), float(y), float(z))
+
+
+# 指定ボーンの全キーフレの実際の回転情報を一度に計算する
+# fnos: 計算するフレーム番号(未指定の場合、ボーンのキーフレ)
+# is_cache: 計算結果をdeform_rotationのキャッシュに登録する(条件はdeform_rotationと同じ)
+# 戻り値はフレーム番号の配列と、回転量(MQuaternionArray)
+def deform_rotation_track(model: PmxModel, motion: VmdMotion, bone_name: str, fnos=None, is_cache=False):
+    if fnos is None:
+        fnos = motion.get_bone_fnos(bone_name)
+    fnos = np.asarray(fnos, dtype=np.int64).reshape(-1)
+
+    _, rotations = motion.calc_bf_many(bone_name, fnos)
+    deform_qqs = deform_rotation_many(model, motion, bone_name, fnos, MQuaternionArray(rotations))
+
+    skeleton = model.get_skeleton()
+    bidx = skeleton.index(bone_name)
+    if is_cache and bidx >= 0 and (skeleton.has_fixed_axes[bidx] or len(skeleton.get_effect_ids(bone_name)) > 0):
+        for fno, rotation, deform_qq in zip(fnos, rotations, deform_qqs.data()):
+            deform_cache.put(get_deform_cache_key(model, skeleton, motion, bone_name, int(fno), *rotation), tuple(deform_qq))
+
+    return fnos, deform_qqs
+
+
+# 指定ボーンの複数フレームの実際の回転情報(deform_rotationと同じ)
+# effect_rotations: モーションに登録する前の付与親の回転量(key:ボーン名, value:fnosと同じ長さのMQuaternionArray)
+def deform_rotation_many(model: PmxModel, motion: VmdMotion, bone_name: str, fnos: np.ndarray, rotations: MQuaternionArray, effect_rotations=None):
+    skeleton = model.get_skeleton()
+    bidx = skeleton.index(bone_name)
+    if bidx < 0:
+        return MQuaternionArray(np.tile(np.array([1, 0, 0, 0], dtype=np.float64), (len(rotations), 1)))
+
+    rot = rotations.normalized()
+
+    if skeleton.has_fixed_axes[bidx]:
+        rot_data = rot.data()
+        # 回転がある場合のみ補正
+        rot_mask = rot != MQuaternion()
+        fixed_x = skeleton.fixed_axes[bidx, 0]
+
+        # 回転補正
+        flip_mask = np.zeros(len(rot_data), dtype=np.bool_)
+        if skeleton.is_rights[bidx]:
+            flip_mask |= (rot_data[:, 1] > 0) & (fixed_x <= 0)
+        if skeleton.is_lefts[bidx]:
+            flip_mask |= (rot_data[:, 1] < 0) & (fixed_x >= 0)
+        # 回転補正（コロン式ミクさん等軸反転パターン）
+        if skeleton.is_rights[bidx]:
+            flip_mask |= (rot_data[:, 1] < 0) & (fixed_x > 0)
+        if skeleton.is_lefts[bidx]:
+            flip_mask |= (rot_data[:, 1] > 0) & (fixed_x < 0)
+
+        flip_mask &= rot_mask
+        rot_data[flip_mask, 0] *= -1
+        rot_data[flip_mask, 1] *= -1
+        rot_data[rot_mask] /= np.linalg.norm(rot_data[rot_mask], ord=2, axis=1)[:, np.newaxis]
+
+        # 軸固定の場合、回転を制限する
+        rot = MQuaternionArray.fromAxisAndAngle(MVector3D(skeleton.fixed_axes[bidx]), rot.toDegree())
+
+    for effect_idx, effect_factor in zip(*skeleton.get_effect_chain(bone_name)):
+        # 付与親が取得できたら、該当する付与親の回転を取得する
+        effect_bone_name = skeleton.names[effect_idx]
+        if effect_rotations and effect_bone_name in effect_rotations:
+            effect_qq = effect_rotations[effect_bone_name]
+        else:
+            effect_qq = MQuaternionArray(motion.calc_bf_many(effect_bone_name, fnos)[1])
+        effect_factor = float(effect_factor)
+
+        # 自身の回転量に付与親の回転量を付与率を加味して付与する
+        if effect_factor < 0:
+            # マイナス付与の場合、逆回転
+            rot = rot * (effect_qq * abs(effect_factor)).inverted()
+        else:
+            rot = rot * (effect_qq * effect_factor)
 
     return rot
 
 
 # 指定されたボーンまでの回転量
-def calc_direction_qq(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None):
-    add_qs = calc_relative_rotation(model, links, motion, fno, limit_links)
+def calc_direction_qq(model: PmxModel, links: BoneLinks, motion: VmdMotion, fno: int, limit_links=None, is_cache=False):
+    add_qs = calc_relative_rotation(model, links, motion, fno, limit_links, is_cache=is_cache)
 
     total_qq = MQuaternion()
     for qq in add_qs:
@@ -2,7 +2,10 @@
 #
 import numpy as np
 import _pickle as cPickle
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import os
+import tempfile
 import unittest
 import sys
 import pathlib
@@ -13,15 +16,15 @@ sys.path.append(str(current_dir) + '/../')
 sys.path.append(str(current_dir) + '/../src/')
 
 from mmd.PmxReader import PmxReader # noqa
-from mmd.VmdReader import VmdReader # noqa
+from mmd.VmdReader import VmdReader, BONE_FRAME_DTYPE # noqa
 from mmd.VmdWriter import VmdWriter # noqa
 from mmd.PmxData import PmxModel, Vertex, Material, Bone, Morph, DisplaySlot, RigidBody, Joint # noqa
-from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame # noqa
+from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdBoneTrack, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame # noqa
 from module.MMath import MRect, MVector2D, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
 from module.MOptions import MOptionsDataSet # noqa
 from module.MParams import BoneLinks # noqa
-from utils import MBezierUtils, MServiceUtils # noqa
-from utils.MException import SizingException # noqa
+from utils import MBezierUtils, MServiceUtils, MFileUtils # noqa
+from utils.MException import SizingException, MParseException # noqa
 from utils.MLogger import MLogger # noqa
 
 logger = MLogger(__name__, level=1)
@@ -93,6 +96,98 @@ class PmxDataTest(unittest.TestCase):
         links = pmx_data.create_link_2_top_one("右手首")
         self.assertEqual(len(links.all()), 4)
 
+    def test_get_skeleton_01(self):
+        pmx_data = PmxModel()
+        # 子が親より先に登録されている場合も、親から順に並べる
+        for bone_idx, (bone_name, position, parent_index, flag, kwargs) in enumerate([
+                ("右ひざ", MVector3D(-1, 5, 0), 2, 0x001A, {}),
+                ("センター", MVector3D(0, 8, 0), -1, 0x001E, {}),
+                ("右足", MVector3D(-1, 10, 0), 1, 0x001A, {}),
+                ("右足首", MVector3D(-1, 1, 0), 0, 0x001A, {}),
+                ("右足ＩＫ", MVector3D(-1, 1, 0), 1, 0x003E, {"ik": Bone.Ik(3, 40, 2, [Bone.IkLink(0, 1, MVector3D(-3.14, 0, 0), MVector3D(-0.01, 0, 0)), Bone.IkLink(2, 0)])}),
+                ("右足D", MVector3D(-1, 10, 0), 1, 0x011A, {"effect_index": 2, "effect_factor": 1}),
+                ("右足捩", MVector3D(-1, 8, 0), 2, 0x041A, {"fixed_axis": MVector3D(0, -1, 0)})]):
+            bone = Bone(bone_name, bone_name, position, parent_index, 0, flag, **kwargs)
+            bone.index = bone_idx
+            pmx_data.bones[bone_name] = bone
+            pmx_data.bone_indexes[bone_idx] = bone_name
+
+        skeleton = pmx_data.get_skeleton()
+        print(skeleton.names)
+
+        self.assertEqual(["センター", "右足", "右ひざ", "右足首", "右足ＩＫ", "右足D", "右足捩"], skeleton.names)
+        self.assertEqual([-1, 0, 1, 2, 0, 0, 1], skeleton.parent_ids.tolist())
+        self.assertTrue(np.allclose([[0, 8, 0], [-1, 2, 0], [0, -5, 0], [0, -4, 0], [-1, -7, 0], [-1, 2, 0], [0, -2, 0]], skeleton.offsets))
+        self.assertEqual([-1, -1, -1, -1, -1, 1, -1], skeleton.effect_ids.tolist())
+        self.assertEqual([False, False, False, False, False, False, True], skeleton.has_fixed_axes.tolist())
+        self.assertEqual([0, 1, 2, 3], skeleton.get_parent_ids("右足首").tolist())
+        self.assertEqual([2, 1], skeleton.get_ik_link_ids("右足ＩＫ").tolist())
+        self.assertEqual([3], skeleton.ik_target_ids.tolist())
+        self.assertEqual([True, False], skeleton.ik_link_limit_flags.tolist())
+
+        for bone_name in pmx_data.bones.keys():
+            self.assertTrue(np.allclose(pmx_data.get_local_x_axis(bone_name).data(), skeleton.get_local_x_axis(bone_name).data()))
+
+        # ボーンが増えたら作り直す
+        self.assertIs(skeleton, pmx_data.get_skeleton())
+        pmx_data.bones["右つま先"] = Bone("右つま先", "右つま先", MVector3D(-1, 0, -1), 3, 0, 0)
+        pmx_data.bones["右つま先"].index = len(pmx_data.bone_indexes)
+        pmx_data.bone_indexes[pmx_data.bones["右つま先"].index] = "右つま先"
+        self.assertEqual(3, pmx_data.get_skeleton().parent_ids[pmx_data.get_skeleton().index("右つま先")])
+
+        # ボーン数が同じでも、ボーンが変更されたら作り直す
+        skeleton = pmx_data.get_skeleton()
+        self.assertIs(skeleton, pmx_data.get_skeleton())
+        pmx_data.bones["右足捩"].fixed_axis = MVector3D()
+        self.assertIsNot(skeleton, pmx_data.get_skeleton())
+        self.assertFalse(np.any(pmx_data.get_skeleton().has_fixed_axes))
+
+        skeleton = pmx_data.get_skeleton()
+        pmx_data.bones["右ひざ"].position = MVector3D(-1, 6, 0)
+        self.assertIsNot(skeleton, pmx_data.get_skeleton())
+        self.assertTrue(np.allclose([0, -4, 0], pmx_data.get_skeleton().offsets[pmx_data.get_skeleton().index("右ひざ")]))
+
+        # 複製したボーンの変更は、元のモデルに影響しない
+        skeleton = pmx_data.get_skeleton()
+        copy_bone = pmx_data.bones["右ひざ"].copy()
+        copy_bone.position = MVector3D(-1, 7, 0)
+        self.assertIs(skeleton, pmx_data.get_skeleton())
+
+        # 複製したモデルも、ボーンの変更で作り直す
+        copy_data = cPickle.loads(cPickle.dumps(pmx_data, -1))
+        copy_skeleton = copy_data.get_skeleton()
+        copy_data.bones["右ひざ"].position = MVector3D(-1, 7, 0)
+        self.assertIsNot(copy_skeleton, copy_data.get_skeleton())
+        self.assertIs(skeleton, pmx_data.get_skeleton())
+
+    def test_morph_offsets_lazy_01(self):
+        loaded_names = []
+
+        def load_offsets(morph):
+            loaded_names.append(morph.name)
+            morph.offsets = [Morph.VertexMorphOffset(3, MVector3D(1, 2, 3))]
+
+        morph = Morph("あ", "a", 3, 1)
+        morph.offsets_loader = load_offsets
+
+        # 最初に参照した時だけ読み込む
+        self.assertEqual([], loaded_names)
+        self.assertEqual(3, morph.offsets[0].vertex_index)
+        self.assertEqual(1, len(morph.offsets))
+        self.assertEqual(["あ"], loaded_names)
+        self.assertIsNone(morph.offsets_loader)
+
+        # 読み込み前に設定した場合は、読み込まない
+        morph = Morph("い", "i", 3, 1)
+        morph.offsets_loader = load_offsets
+        morph.offsets = []
+        self.assertEqual([], morph.offsets)
+        self.assertEqual(["あ"], loaded_names)
+
+        # 読み込み済みのオフセットは複製できる
+        copy_morph = cPickle.loads(cPickle.dumps(Morph("う", "u", 3, 1, [Morph.VertexMorphOffset(5, MVector3D(1, 0, 0))]), -1))
+        self.assertEqual(5, copy_morph.offsets[0].vertex_index)
+
 
 class VmdDataTest(unittest.TestCase):
 
@@ -634,6 +729,611 @@ class VmdDataTest(unittest.TestCase):
                 raise e
 
 
+    def test_get_bone_fnos_01(self):
+        motion = VmdMotion()
+        for fno in [30, 0, 20, 10]:
+            bf = VmdBoneFrame(fno)
+            bf.set_name("右腕")
+            bf.key = (fno != 20)
+            motion.append_bone_frame(bf)
+
+        self.assertEqual([0, 10, 20, 30], motion.bones["右腕"].fnos)
+        self.assertEqual([0, 10, 20, 30], motion.get_bone_fnos("右腕"))
+        self.assertEqual([0, 10, 30], motion.get_bone_fnos("右腕", is_key=True))
+        self.assertEqual([10, 20], motion.get_bone_fnos("右腕", start_fno=5, end_fno=25))
+
+        # 直接の登録・削除でもインデックスが維持される
+        motion.bones["右腕"][15] = motion.calc_bf("右腕", 15)
+        del motion.bones["右腕"][0]
+        self.assertEqual([10, 15, 20, 30], motion.bones["右腕"].fnos)
+
+        # 普通の辞書で登録してもインデックスが生成される
+        motion.bones["左腕"] = {5: VmdBoneFrame(5)}
+        motion.bones["左腕"][1] = VmdBoneFrame(1)
+        self.assertEqual([1, 5], motion.bones["左腕"].fnos)
+        self.assertEqual([1, 5, 10, 15, 20, 30], motion.get_bone_fnos("右腕", "左腕"))
+
+    def test_get_bone_prev_next_fno_01(self):
+        motion = VmdMotion()
+        motion.last_motion_frame = 30
+        for fno in [0, 10, 20, 30]:
+            bf = VmdBoneFrame(fno)
+            bf.set_name("右腕")
+            bf.key = (fno != 20)
+            bf.position = MVector3D(fno, 0, 0)
+            motion.append_bone_frame(bf)
+
+        self.assertEqual((10, 20), motion.get_bone_prev_next_fno("右腕", fno=15))
+        self.assertEqual((10, 30), motion.get_bone_prev_next_fno("右腕", fno=15, is_key=True))
+        self.assertEqual((10, 30), motion.get_bone_prev_next_fno("右腕", fno=20))
+        self.assertEqual((-1, 0), motion.get_bone_prev_next_fno("右腕", fno=-1))
+        self.assertEqual((30, 31), motion.get_bone_prev_next_fno("右腕", fno=40))
+
+        bf = motion.calc_bf("右腕", 5)
+        self.assertAlmostEqual(bf.position.x(), 5, delta=0.01)
+        bf = motion.calc_bf("右腕", 40)
+        self.assertAlmostEqual(bf.position.x(), 30, delta=0.01)
+
+    def test_bone_track_01(self):
+        motion = VmdMotion()
+        motion.last_motion_frame = 30
+        for fno in [0, 10, 20, 30]:
+            bf = VmdBoneFrame(fno)
+            bf.set_name("右腕")
+            bf.key = (fno != 20)
+            bf.position = MVector3D(fno, 1, 0)
+            bf.rotation = MQuaternion.fromEulerAngles(0, fno, 0)
+            bf.org_interpolation = [fno] * 64
+            motion.append_bone_frame(bf)
+
+        track_motion = motion.copy()
+        track_motion.to_bone_tracks()
+        self.assertTrue(isinstance(track_motion.bones["右腕"], VmdBoneTrack))
+
+        # まとめて生成したトラックは、1キーずつ登録したトラックと同じ
+        inserted_track = VmdBoneTrack("右腕")
+        for fno in [30, 0, 20, 10]:
+            inserted_track[fno] = motion.bones["右腕"][fno]
+        for array_name in ["fnos", "positions", "rotations", "org_positions", "org_rotations", "interpolations", "org_interpolations", "key_flags", "read_flags"]:
+            self.assertTrue(np.array_equal(getattr(inserted_track, array_name), getattr(track_motion.bones["右腕"], array_name)))
+        self.assertEqual([0, 10, 30], track_motion.get_bone_fnos("右腕", is_key=True))
+        self.assertEqual((10, 30), track_motion.get_bone_prev_next_fno("右腕", fno=15, is_key=True))
+
+        for fno in [0, 5, 15, 30, 40]:
+            bf = motion.calc_bf("右腕", fno)
+            track_bf = track_motion.calc_bf("右腕", fno)
+            print(fno, bf, track_bf)
+            self.assertAlmostEqual(bf.position.x(), track_bf.position.x(), delta=0.0001)
+            self.assertAlmostEqual(bf.rotation.toEulerAngles().y(), track_bf.rotation.toEulerAngles().y(), delta=0.0001)
+
+        # 参照したキーフレへの代入がトラックに反映される(位置・回転は複製なので、直接の変更は反映されない)
+        bf = track_motion.bones["右腕"][10]
+        self.assertEqual([10] * 64, bf.org_interpolation)
+        version = track_motion.bones["右腕"].version
+        bf.position.setX(50)
+        bf.rotation.setScalar(0)
+        self.assertEqual(10, track_motion.bones["右腕"].positions[1][0])
+        self.assertEqual(version, track_motion.bones["右腕"].version)
+        bf.position = MVector3D(100, 1, 0)
+        bf.key = False
+        self.assertEqual(100, track_motion.bones["右腕"].positions[1][0])
+        self.assertNotEqual(version, track_motion.bones["右腕"].version)
+        self.assertEqual([0, 30], track_motion.get_bone_fnos("右腕", is_key=True))
+
+        # 補間キーの登録・削除
+        track_motion.regist_bf(track_motion.calc_bf("右腕", 25), "右腕", 25)
+        del track_motion.bones["右腕"][0]
+        self.assertEqual([10, 20, 25, 30], track_motion.bones["右腕"].fnos.tolist())
+
+        # 辞書に戻しても値が維持される
+        copy_motion = cPickle.loads(cPickle.dumps(track_motion, -1))
+        copy_motion.to_bone_frames()
+        self.assertEqual([10, 20, 25, 30], copy_motion.get_bone_fnos("右腕"))
+        self.assertEqual(100, copy_motion.bones["右腕"][10].position.x())
+        self.assertEqual(tuple([30] * 64), copy_motion.bones["右腕"][30].org_interpolation)
+
+    def test_calc_bf_many_01(self):
+        motion = VmdMotion()
+        for fno, degree in [(0, 0), (10, 90), (30, -45)]:
+            bf = VmdBoneFrame(fno)
+            bf.set_name("右腕")
+            bf.key = True
+            bf.position = MVector3D(fno, degree, 0)
+            bf.rotation = MQuaternion.fromEulerAngles(0, degree, 0)
+            interpolation = list(bf.interpolation)
+            interpolation[MBezierUtils.R_x1_idxs[3]] = 60
+            interpolation[MBezierUtils.MY_y2_idxs[3]] = 10
+            bf.interpolation = interpolation
+            motion.append_bone_frame(bf)
+
+        fnos = list(range(-5, 40))
+        positions, rotations = motion.calc_bf_many("右腕", fnos)
+        print(positions[:5], rotations[:5])
+
+        for n, fno in enumerate(fnos):
+            bf = motion.calc_bf("右腕", fno)
+            self.assertTrue(np.array_equal(bf.position.data(), positions[n]))
+            self.assertTrue(np.array_equal([bf.rotation.scalar(), bf.rotation.x(), bf.rotation.y(), bf.rotation.z()], rotations[n]))
+
+        # 存在しないボーンは初期値
+        positions, rotations = motion.calc_bf_many("左腕", [0, 10])
+        self.assertTrue(np.array_equal([[0, 0, 0], [0, 0, 0]], positions))
+        self.assertTrue(np.array_equal([[1, 0, 0, 0], [1, 0, 0, 0]], rotations))
+
+    def test_shared_bones_01(self):
+        motion = VmdMotion()
+        for fno in [0, 10, 30]:
+            bf = VmdBoneFrame(fno)
+            bf.set_name("右腕")
+            bf.key = True
+            bf.position = MVector3D(fno, 1, 0)
+            bf.rotation = MQuaternion.fromEulerAngles(0, fno, 0)
+            motion.append_bone_frame(bf)
+
+        shared_bones = motion.share_bones()
+        try:
+            # プロセス間では共有メモリ名と配置だけを受け渡す
+            shared_motion = VmdMotion()
+            shared_motion.attach_shared_bones(cPickle.loads(cPickle.dumps(shared_bones, -1)))
+            track = shared_motion.bones["右腕"]
+            self.assertIsNotNone(track.shared)
+            self.assertFalse(track.positions.flags.writeable)
+
+            for fno in [0, 5, 15, 30]:
+                bf = motion.calc_bf("右腕", fno)
+                shared_bf = shared_motion.calc_bf("右腕", fno)
+                print(fno, bf, shared_bf)
+                self.assertAlmostEqual(bf.position.x(), shared_bf.position.x(), delta=0.0001)
+                self.assertAlmostEqual(bf.rotation.toEulerAngles().y(), shared_bf.rotation.toEulerAngles().y(), delta=0.0001)
+
+            # 書き込んだトラックだけ自前の配列になり、共有メモリは変わらない
+            shared_motion.regist_bf(shared_motion.calc_bf("右腕", 20), "右腕", 20)
+            self.assertIsNone(track.shared)
+            self.assertEqual([0, 10, 20, 30], track.fnos.tolist())
+            self.assertEqual([0, 10, 30], shared_bones.attach()["右腕"].fnos.tolist())
+
+            del shared_motion, track
+        finally:
+            shared_bones.close()
+            shared_bones.unlink()
+
+    def test_motion_copy_01(self):
+        motion = VmdMotion()
+        for bone_name in ["右腕", "左腕"]:
+            for fno in [0, 10]:
+                bf = VmdBoneFrame(fno)
+                bf.set_name(bone_name)
+                bf.key = True
+                bf.position = MVector3D(fno, 1, 0)
+                motion.append_bone_frame(bf)
+
+        copy_motion = motion.copy()
+        # コピー直後はキーフレを共有している
+        self.assertTrue(dict(motion.bones.raw_items())["右腕"] is dict(copy_motion.bones.raw_items())["右腕"])
+
+        # 参照するだけでは複製しない
+        copy_motion.calc_bf("右腕", 5)
+        copy_motion.calc_bf("右腕", 10, is_readonly=True)
+        copy_motion.calc_bf_many("右腕", [0, 5, 10])
+        copy_motion.get_bone_fnos("右腕", "左腕", is_key=True)
+        copy_motion.get_bone_prev_next_fno("右腕", fno=5)
+        copy_motion.get_bone_frames()
+        self.assertTrue(dict(motion.bones.raw_items())["右腕"] is dict(copy_motion.bones.raw_items())["右腕"])
+
+        # 変更したボーンだけ複製され、元のモーションには影響しない
+        copy_motion.bones["右腕"][10].position.setX(100)
+        print(motion.bones["右腕"][10], copy_motion.bones["右腕"][10])
+        self.assertEqual(10, motion.bones["右腕"][10].position.x())
+        self.assertEqual(100, copy_motion.bones["右腕"][10].position.x())
+        self.assertTrue(dict(motion.bones.raw_items())["左腕"] is dict(copy_motion.bones.raw_items())["左腕"])
+
+        # 片方が複製した後は、もう片方は複製せずにそのまま使う
+        frames = dict(motion.bones.raw_items())["右腕"]
+        self.assertTrue(motion.bones["右腕"] is frames)
+
+        # dict()でまとめて取り出した場合も、共有中のボーンは複製される
+        copy_motion = motion.copy()
+        copy_bones = dict(copy_motion.bones)
+        self.assertFalse(copy_bones["左腕"] is dict(motion.bones.raw_items())["左腕"])
+
+        # 複数スレッドから同時に参照しても、複製は一度だけ行われる
+        copy_motion = motion.copy()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: copy_motion.bones["左腕"], range(32)))
+        self.assertEqual(1, len(set(id(frames) for frames in results)))
+        self.assertFalse(results[0] is dict(motion.bones.raw_items())["左腕"])
+
+    def test_motion_version_01(self):
+        motion = VmdMotion()
+        for fno in [0, 10]:
+            bf = VmdBoneFrame(fno)
+            bf.set_name("右腕")
+            bf.key = True
+            motion.append_bone_frame(bf)
+
+        # キーフレへの代入でモーションの更新バージョンが変わる
+        bf = motion.bones["右腕"][10]
+        for attr_name, value in [("rotation", MQuaternion.fromEulerAngles(0, 30, 0)), ("key", False), ("avoidance", MVector3D(1, 0, 0))]:
+            version = motion.version
+            setattr(bf, attr_name, value)
+            print(attr_name, version, motion.version)
+            self.assertNotEqual(version, motion.version)
+
+        # 複製先のキーフレを変更しても、元のモーションのバージョンは変わらない
+        copy_motion = motion.copy()
+        version = motion.version
+        copy_version = copy_motion.version
+        copy_motion.bones["右腕"][0].rotation = MQuaternion.fromEulerAngles(0, 60, 0)
+        self.assertEqual(version, motion.version)
+        self.assertNotEqual(copy_version, copy_motion.version)
+
+        # 参照だけではバージョンは変わらず、保存しても登録先は引き継がない
+        version = motion.version
+        motion.calc_bf("右腕", 5)
+        self.assertEqual(version, motion.version)
+        copy_bf = cPickle.loads(cPickle.dumps(bf, -1))
+        self.assertIsNone(copy_bf.owner)
+        copy_bf.rotation = MQuaternion()
+        self.assertEqual(version, motion.version)
+
+    def test_bone_frame_01(self):
+        bf1 = VmdBoneFrame(0)
+        bf2 = VmdBoneFrame(10)
+        interpolation = list(bf1.interpolation)
+        interpolation[MBezierUtils.R_x1_idxs[3]] = 60
+        bf1.interpolation = interpolation
+        bf2.interpolation = list(interpolation)
+
+        # 同じ補間曲線は同じタプルを共有し、直接は変更できない
+        self.assertTrue(bf1.interpolation is bf2.interpolation)
+        self.assertEqual(60, bf1.interpolation[MBezierUtils.R_x1_idxs[3]])
+        with self.assertRaises(TypeError):
+            bf1.interpolation[0] = 0
+        self.assertFalse(hasattr(bf1, "__dict__"))
+
+        # オリジナルは値で保持して、参照された時に生成する
+        bf1.position = MVector3D(1, 2, 3)
+        bf1.set_org_values((1, 2, 3), (1, 0, 0, 0))
+        bf1.position.setX(10)
+        copy_bf = bf1.copy()
+        print(bf1, copy_bf.org_position)
+        self.assertEqual(1, copy_bf.org_position.x())
+        self.assertEqual(10, copy_bf.position.x())
+        self.assertTrue(copy_bf.interpolation is bf1.interpolation)
+
+        copy_bf = cPickle.loads(cPickle.dumps(bf1, -1))
+        self.assertTrue(copy_bf.interpolation is bf1.interpolation)
+
+    def test_vmd_read_01(self):
+        motion = VmdMotion()
+        for fno in [10, 0, 10]:
+            bf = VmdBoneFrame(fno)
+            bf.set_name("右腕")
+            bf.key = True
+            bf.position = MVector3D(fno, 1, 0)
+            bf.rotation = MQuaternion.fromEulerAngles(0, fno, 0)
+            motion.bones.setdefault("右腕", {})
+            motion.bones["右腕"][fno] = bf
+        for fno in [0, 5]:
+            mf = VmdMorphFrame(fno)
+            mf.set_name("あ")
+            mf.ratio = fno / 10
+            motion.morphs.setdefault("あ", {})[fno] = mf
+
+        rep_model = PmxModel()
+        rep_model.name = "test"
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            vmd_path = os.path.join(dir_path, "test.vmd")
+            VmdWriter(MOptionsDataSet(motion, None, rep_model, vmd_path, 0, 0, [], None, 0, [])).write()
+
+            for is_track in [False, True]:
+                read_motion = VmdReader(vmd_path, is_track=is_track).read_data()
+                print(is_track, read_motion.bones["右腕"][10], read_motion.morphs["あ"][5])
+
+                self.assertEqual([0, 10], read_motion.get_bone_fnos("右腕"))
+                self.assertEqual(10, read_motion.last_motion_frame)
+                self.assertAlmostEqual(10, read_motion.bones["右腕"][10].position.x(), delta=0.0001)
+                self.assertAlmostEqual(10, read_motion.bones["右腕"][10].rotation.toEulerAngles().y(), delta=0.0001)
+                self.assertEqual(b"\x89E\x98r".ljust(15, b"\x00"), read_motion.bones["右腕"][10].bname)
+                self.assertTrue(read_motion.bones["右腕"][10].read)
+                self.assertEqual([0, 5], sorted(read_motion.morphs["あ"].keys()))
+                self.assertAlmostEqual(0.5, read_motion.morphs["あ"][5].ratio, delta=0.0001)
+
+    def test_vmd_read_lazy_01(self):
+        motion = VmdMotion()
+        for bone_name in ["右腕", "左腕"]:
+            for fno in [0, 10]:
+                bf = VmdBoneFrame(fno)
+                bf.set_name(bone_name)
+                bf.key = True
+                bf.rotation = MQuaternion.fromEulerAngles(0, fno, 0)
+                motion.bones.setdefault(bone_name, {})[fno] = bf
+
+        rep_model = PmxModel()
+        rep_model.name = "test"
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            vmd_path = os.path.join(dir_path, "test.vmd")
+            VmdWriter(MOptionsDataSet(motion, None, rep_model, vmd_path, 0, 0, [], None, 0, [])).write()
+
+            read_motion = VmdReader(vmd_path).read_data()
+
+            lazy_reader = VmdReader(vmd_path, is_lazy=True)
+            digest = lazy_reader.hexdigest()
+            lazy_motion = lazy_reader.read_data()
+            print(digest, lazy_motion.bones.lazy_loaders.keys())
+
+            # ハッシュ値は通常の読み込みと同じ
+            self.assertEqual(read_motion.digest, digest)
+            self.assertEqual(read_motion.digest, lazy_motion.digest)
+            self.assertEqual(10, lazy_motion.last_motion_frame)
+
+            # 参照したボーンだけ読み込まれる
+            self.assertEqual(["右腕", "左腕"], list(lazy_motion.bones.keys()))
+            self.assertEqual(2, len(lazy_motion.bones.lazy_loaders))
+            copy_motion = lazy_motion.copy()
+            self.assertEqual([0, 10], lazy_motion.get_bone_fnos("右腕"))
+            self.assertEqual(["左腕"], list(lazy_motion.bones.lazy_loaders.keys()))
+            self.assertEqual(2, len(copy_motion.bones.lazy_loaders))
+            self.assertAlmostEqual(10, lazy_motion.bones["右腕"][10].rotation.toEulerAngles().y(), delta=0.0001)
+
+            # 全件参照した場合は、通常の読み込みと同じ
+            for bone_name, frames in copy_motion.bones.items():
+                self.assertEqual(read_motion.bones[bone_name][10].rotation, frames[10].rotation)
+            self.assertEqual(0, len(copy_motion.bones.lazy_loaders))
+            del lazy_motion, copy_motion
+
+    def test_read_digest_01(self):
+        motion = VmdMotion()
+        bf = VmdBoneFrame(0)
+        bf.set_name("右腕")
+        bf.key = True
+        motion.bones["右腕"] = {0: bf}
+
+        rep_model = PmxModel()
+        rep_model.name = "test"
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            vmd_path = os.path.join(dir_path, "test.vmd")
+            VmdWriter(MOptionsDataSet(motion, None, rep_model, vmd_path, 0, 0, [], None, 0, [])).write()
+            file_stat = MFileUtils.get_file_stat(vmd_path)
+
+            with open(vmd_path, "rb") as f:
+                digest = MFileUtils.calc_digest(f.read(), vmd_path)
+
+            # ハッシュ値は読み込みと同じバッファから計算し、読み込み前後で変わらない
+            reader = VmdReader(vmd_path)
+            self.assertEqual(digest, reader.hexdigest())
+            read_motion = reader.read_data()
+            print(digest, file_stat)
+            self.assertEqual(digest, read_motion.digest)
+            self.assertEqual(file_stat, MFileUtils.get_file_stat(vmd_path))
+
+            # 内容が変わった場合は、ハッシュ値もファイルの状態も変わる
+            bf.fno = 10
+            VmdWriter(MOptionsDataSet(motion, None, rep_model, vmd_path, 0, 0, [], None, 0, [])).write()
+            os.utime(vmd_path, ns=(file_stat[2] + 10 ** 9, file_stat[2] + 10 ** 9))
+            self.assertNotEqual(digest, VmdReader(vmd_path).hexdigest())
+            self.assertNotEqual(file_stat, MFileUtils.get_file_stat(vmd_path))
+            del reader
+
+    def test_read_pmx_cache_01(self):
+        pmx_path = str(current_dir) + "/../archive/debug_bone6.pmx"
+        model = PmxReader(pmx_path).read_data()
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            # 初回は解析してキャッシュに保存、2回目はキャッシュから復元する
+            reader = PmxReader(pmx_path, cache_dir=dir_path)
+            self.assertIsNone(reader.read_cache())
+            reader.read_data()
+            cache_path = reader.get_cache_path()
+            self.assertTrue(os.path.exists(cache_path))
+
+            cached_model = PmxReader(pmx_path, cache_dir=dir_path).read_data()
+            print(cache_path, os.path.getsize(cache_path))
+
+            self.assertEqual(model.digest, cached_model.digest)
+            self.assertEqual(list(model.vertices.keys()), list(cached_model.vertices.keys()))
+            for bone_idx, vertices in model.vertices.items():
+                for v, cv in zip(vertices, cached_model.vertices[bone_idx]):
+                    self.assertEqual(v.index, cv.index)
+                    self.assertTrue(np.array_equal(v.position.data(), cv.position.data()))
+                    self.assertTrue(np.array_equal(v.normal.data(), cv.normal.data()))
+                    self.assertEqual(v.uv, cv.uv)
+                    self.assertEqual(type(v.deform), type(cv.deform))
+                    self.assertEqual(v.deform.get_idx_list(), cv.deform.get_idx_list())
+            self.assertEqual(list(model.bones.keys()), list(cached_model.bones.keys()))
+            for bone_name, bone in model.bones.items():
+                self.assertTrue(np.array_equal(bone.position.data(), cached_model.bones[bone_name].position.data()))
+                self.assertEqual(bone.len, cached_model.bones[bone_name].len)
+            self.assertTrue(np.array_equal(model.head_top_vertex.position.data(), cached_model.head_top_vertex.position.data()))
+            self.assertEqual(model.can_arm_sizing, cached_model.can_arm_sizing)
+            self.assertEqual(list(model.morphs.keys()), list(cached_model.morphs.keys()))
+
+            # 形式の違うキャッシュは破棄して、解析し直す
+            with open(cache_path, "r+b") as f:
+                f.write(b"PMXCACHE\xff\xff\xff\xff")
+            self.assertIsNone(PmxReader(pmx_path, cache_dir=dir_path).read_cache())
+            self.assertFalse(os.path.exists(cache_path))
+            PmxReader(pmx_path, cache_dir=dir_path).read_data()
+            self.assertTrue(os.path.exists(cache_path))
+
+            # 上限サイズを超えたら、最終使用日時が古いものから削除する
+            os.utime(cache_path, ns=(0, 0))
+            unchecked_reader = PmxReader(pmx_path, is_check=False, cache_dir=dir_path, cache_max_bytes=os.path.getsize(cache_path) + 1)
+            unchecked_reader.read_data()
+            self.assertFalse(os.path.exists(cache_path))
+            self.assertTrue(os.path.exists(unchecked_reader.get_cache_path()))
+
+    def test_read_pmx_lazy_01(self):
+        pmx_path = str(current_dir) + "/../archive/debug_bone6.pmx"
+        model = PmxReader(pmx_path).read_data()
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            lazy_path = os.path.join(dir_path, "lazy.pmx")
+            with open(pmx_path, "rb") as fin, open(lazy_path, "wb") as fout:
+                fout.write(fin.read())
+
+            # サイジングで使うセクションだけ読み込み、残りは位置だけ覚えておく
+            lazy_model = PmxReader(lazy_path, is_lazy=True).read_data()
+            print(list(lazy_model.lazy_loaders.keys()))
+            self.assertEqual(["indices", "textures", "materials", "morph_offsets", "joints"], list(lazy_model.lazy_loaders.keys()))
+            self.assertEqual(0, len(lazy_model.indices))
+            self.assertEqual(0, len(lazy_model.materials))
+            self.assertEqual(list(model.bones.keys()), list(lazy_model.bones.keys()))
+            self.assertEqual(list(model.rigidbodies.keys()), list(lazy_model.rigidbodies.keys()))
+            self.assertEqual(list(model.display_slots.keys()), list(lazy_model.display_slots.keys()))
+            self.assertTrue(np.array_equal(model.head_top_vertex.position.data(), lazy_model.head_top_vertex.position.data()))
+            self.assertEqual(model.can_arm_sizing, lazy_model.can_arm_sizing)
+            self.assertTrue(all(morph.offsets_loader for morph in lazy_model.morphs.values()))
+
+            # 後から読み込んだセクションは、まとめて読み込んだ場合と同じ(プロセス間で受け渡した後でも読み込める)
+            copied_model = cPickle.loads(cPickle.dumps(lazy_model, -1))
+            lazy_model.load_sections("materials")
+            self.assertEqual(["indices", "textures", "morph_offsets", "joints"], list(lazy_model.lazy_loaders.keys()))
+            copied_model.load_sections()
+            self.assertEqual(0, len(copied_model.lazy_loaders))
+            for m in [lazy_model, copied_model]:
+                self.assertEqual(list(model.materials.keys()), list(m.materials.keys()))
+                self.assertEqual(model.material_indexes, m.material_indexes)
+                self.assertEqual([mv.vertex_count for mv in model.materials.values()], [mv.vertex_count for mv in m.materials.values()])
+            self.assertEqual(model.indices, copied_model.indices)
+            self.assertEqual(model.textures, copied_model.textures)
+            self.assertEqual(list(model.joints.keys()), list(copied_model.joints.keys()))
+
+            # モーフのオフセットは、セクションを読み込まなくても最初に参照した時に読み込む
+            for morph_name, morph in model.morphs.items():
+                self.assertEqual(self.get_morph_offset_values(morph), self.get_morph_offset_values(lazy_model.morphs[morph_name]))
+                self.assertIsNone(lazy_model.morphs[morph_name].offsets_loader)
+
+            # 読み込み後にファイルが変わった場合は、読み込まない
+            file_stat = MFileUtils.get_file_stat(lazy_path)
+            os.utime(lazy_path, ns=(file_stat[2] + 10 ** 9, file_stat[2] + 10 ** 9))
+            with self.assertRaises(MParseException):
+                lazy_model.load_sections("indices")
+            self.assertIn("indices", lazy_model.lazy_loaders)
+
+            # キャッシュは内容だけで引くので、別の場所にある同じモデルでも使い、後読みは今のファイルから行う
+            cache_dir = os.path.join(dir_path, "cache")
+            PmxReader(pmx_path, cache_dir=cache_dir, is_lazy=True).read_data()
+            cached_model = PmxReader(lazy_path, cache_dir=cache_dir, is_lazy=True).read_data()
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+            self.assertEqual(lazy_path, cached_model.path)
+            self.assertEqual(PmxReader(lazy_path).hexdigest(), cached_model.digest)
+            self.assertNotEqual(model.digest, cached_model.digest)
+            for morph_name, morph in model.morphs.items():
+                self.assertEqual(self.get_morph_offset_values(morph), self.get_morph_offset_values(cached_model.morphs[morph_name]))
+            cached_model.load_sections()
+            self.assertEqual(list(model.materials.keys()), list(cached_model.materials.keys()))
+            self.assertEqual(model.indices, cached_model.indices)
+
+    # モーフのオフセットの比較用の値
+    def get_morph_offset_values(self, morph: Morph):
+        return [[v.data().tolist() if hasattr(v, "data") else v for v in offset.__dict__.values()] for offset in morph.offsets]
+
+    def test_vmd_write_02(self):
+        motion = VmdMotion()
+        # 不正な回転は、1件ずつ書き込んでいた時と同じく、NaN・無限大を0、Scalarが0なら1にしてから正規化する
+        rotations = [MQuaternion(0, 0, 0, 0), MQuaternion(np.nan, 0, 0, 0), MQuaternion(0, 0, 1, 0), MQuaternion(1, np.inf, 0, 0)]
+        for fno, rotation in enumerate(rotations):
+            bf = VmdBoneFrame(fno)
+            bf.set_name("右腕")
+            bf.key = True
+            bf.rotation = rotation
+            motion.bones.setdefault("右腕", {})[fno] = bf
+
+        rep_model = PmxModel()
+        rep_model.name = "test"
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            vmd_path = os.path.join(dir_path, "test.vmd")
+            VmdWriter(MOptionsDataSet(motion, None, rep_model, vmd_path, 0, 0, [], None, 0, [])).write()
+
+            reader = VmdReader(vmd_path)
+            reader.open_buffer()
+            reader.offset = 54
+            records = reader.read_records(BONE_FRAME_DTYPE, 4)
+            # 最終キーが先頭
+            rotations = records["rotation"][np.argsort(records["fno"])].tolist()
+            print(rotations)
+            del records
+            reader.buffer = None
+
+            self.assertTrue(np.allclose([0, 0, 0, 1], rotations[0]))
+            self.assertTrue(np.allclose([0, 0, 0, 1], rotations[1]))
+            self.assertTrue(np.allclose([0, 0.70710677, 0, 0.70710677], rotations[2]))
+            self.assertTrue(np.allclose([0, 0, 0, 1], rotations[3]))
+
+    def test_vmd_write_01(self):
+        motion = VmdMotion()
+        for bone_name in ["右腕", "左腕", "頭頂"]:
+            for fno in [5, 0, 10]:
+                bf = VmdBoneFrame(fno)
+                bf.set_name(bone_name)
+                # 5Fは登録対象外
+                bf.key = fno != 5
+                bf.rotation = MQuaternion.fromEulerAngles(0, fno, 0) * 2
+                bf.interpolation = [200] + [20] * 63
+                motion.bones.setdefault(bone_name, {})[fno] = bf
+        motion.bones["左腕"] = VmdBoneTrack.from_arrays("左腕", [0, 3], [[1, 2, 3], [0, 0, 0]], [[1, 0, 0, 0], [1, 0, 0, 0]], [[20] * 64, [20] * 64])
+        light = VmdLightFrame()
+        light.fno = 3
+        light.color = MVector3D(0.5, 0.5, 0.5)
+        motion.lights.append(light)
+        shadow = VmdShadowFrame()
+        shadow.fno = 4
+        shadow.type = 1
+        shadow.distance = 0.25
+        motion.shadows.append(shadow)
+        show_ik = VmdShowIkFrame()
+        show_ik.fno = 2
+        show_ik.show = 1
+        show_ik.ik = [VmdInfoIk(b"\x89E\x91\xab\x82h\x82j", 1)]
+        motion.showiks.append(show_ik)
+
+        rep_model = PmxModel()
+        rep_model.name = "test"
+
+        with tempfile.TemporaryDirectory() as dir_path:
+            vmd_path = os.path.join(dir_path, "test.vmd")
+            VmdWriter(MOptionsDataSet(motion, None, rep_model, vmd_path, 0, 0, [], None, 0, [])).write()
+
+            # 各ボーンの最終キーが先頭に並ぶ
+            reader = VmdReader(vmd_path)
+            reader.read_data()
+            reader.open_buffer()
+            reader.offset = 54
+            records = reader.read_records(BONE_FRAME_DTYPE, 4)
+            print(records["name"], records["fno"])
+            self.assertEqual([10, 3, 0, 0], records["fno"].tolist())
+            self.assertEqual(127, records["interpolation"][0][0])
+            self.assertAlmostEqual(1, np.linalg.norm(records["rotation"][0]), delta=0.0001)
+            del records
+
+            read_motion = VmdReader(vmd_path).read_data()
+            print(read_motion.bones.keys(), read_motion.lights[0].color, read_motion.shadows[0].distance, read_motion.showiks[0].ik[0].name)
+
+            # サイジング用ボーンと登録対象外のキーは出力しない
+            self.assertEqual(["右腕", "左腕"], list(read_motion.bones.keys()))
+            self.assertEqual([0, 10], read_motion.get_bone_fnos("右腕"))
+            self.assertAlmostEqual(10, read_motion.bones["右腕"][10].rotation.toEulerAngles().y(), delta=0.0001)
+            self.assertEqual(MVector3D(1, 2, 3), read_motion.bones["左腕"][0].position)
+            self.assertEqual(3, read_motion.lights[0].fno)
+            self.assertAlmostEqual(0.5, read_motion.lights[0].color.y(), delta=0.0001)
+            self.assertEqual(1, read_motion.shadows[0].type)
+            self.assertAlmostEqual(0.25, read_motion.shadows[0].distance, delta=0.0001)
+            self.assertEqual(1, read_motion.ik_cnt)
+            self.assertEqual(b"\x89E\x91\xab\x82h\x82j".ljust(20, b"\x00"), read_motion.showiks[0].ik[0].name)
+
+            # 書き込みながら解放した場合も、同じ内容になる
+            release_vmd_path = os.path.join(dir_path, "release.vmd")
+            VmdWriter(MOptionsDataSet(motion, None, rep_model, release_vmd_path, 0, 0, [], None, 0, [])).write(is_release=True)
+            self.assertEqual(["頭頂"], list(motion.bones.keys()))
+            with open(vmd_path, "rb") as f, open(release_vmd_path, "rb") as rf:
+                self.assertEqual(f.read(), rf.read())
+
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -12,7 +12,7 @@ current_dir = pathlib.Path(__file__).resolve().parent
 sys.path.append(str(current_dir) + '/../')
 sys.path.append(str(current_dir) + '/../src/')
 
-from module.MMath import MRect, MVector2D, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
+from module.MMath import MRect, MVector2D, MVector3D, MVector4D, MQuaternion, MQuaternionArray, MVector3DArray, MMatrix4x4 # noqa
 from utils.MLogger import MLogger # noqa
 
 logger = MLogger(__name__, level=1)
@@ -79,3 +79,59 @@ class MMathTest(unittest.TestCase):
 
         rot = initial.inverted() * orientation
         print(rot.toEulerAngles())
+
+    def test_MQuaternionArray_01(self):
+        qqs = [MQuaternion.fromEulerAngles(10, 20, 30), MQuaternion.fromEulerAngles(-60, 120, 0), MQuaternion.fromEulerAngles(0, 0, 170)]
+        from_qq = MQuaternion.fromEulerAngles(4.444088972232067, -131.68893846184505, 6.602773293502102)
+        to_qq = MQuaternion.fromEulerAngles(-0.0, 90.0, -90.0)
+
+        qq_array = MQuaternionArray(qqs)
+        rot_array = from_qq.inverted() * qq_array * to_qq
+        print(rot_array)
+
+        for n, qq in enumerate(qqs):
+            rot = from_qq.inverted() * qq * to_qq
+            self.assertTrue(np.allclose(rot.data().components, rot_array.data()[n]))
+            self.assertTrue(np.allclose(qq.inverted().data().components, qq_array.inverted().data()[n]))
+            self.assertTrue(np.allclose(qq.toEulerAngles4MMD().data(), qq_array.toEulerAngles4MMD()[n]))
+            self.assertAlmostEqual(qq.toDegree(), qq_array.toDegree()[n], delta=0.000001)
+
+            slerp_qq = MQuaternion.slerp(qq, to_qq, 0.3)
+            self.assertTrue(np.allclose(slerp_qq.data().components, MQuaternionArray.slerp(qq_array, to_qq, 0.3).data()[n]))
+
+        euler_array = MQuaternionArray.fromEulerAngles([10, -60, 0], [20, 120, 0], [30, 0, 170])
+        self.assertTrue(np.allclose(qq_array.data(), euler_array.data()))
+
+        axis_array = MQuaternionArray.fromAxisAndAngle(MVector3D(0, 1, 0), [30, 90])
+        self.assertTrue(np.allclose(MQuaternion.fromAxisAndAngle(MVector3D(0, 1, 0), 90).data().components, axis_array.data()[1]))
+
+    def test_MVector3DArray_01(self):
+        vs = [MVector3D(1, 2, 3), MVector3D(-4, 0.5, 2), MVector3D(0, 0, 0)]
+        offset = MVector3D(0.1, -0.2, 0.3)
+
+        v_array = MVector3DArray(vs)
+        print(v_array * 2 + offset)
+
+        for n, v in enumerate(vs):
+            self.assertTrue(np.allclose((v * 2 + offset).data(), (v_array * 2 + offset).data()[n]))
+            self.assertTrue(np.allclose(v.normalized().data(), v_array.normalized().data()[n]))
+            self.assertTrue(np.allclose(MVector3D.crossProduct(v, offset).data(), MVector3DArray.crossProduct(v_array, offset).data()[n]))
+            self.assertAlmostEqual(v.length(), v_array.length()[n], delta=0.000001)
+            self.assertAlmostEqual(MVector3D.dotProduct(v, offset), MVector3DArray.dotProduct(v_array, offset)[n], delta=0.000001)
+            self.assertAlmostEqual(v.distanceToPoint(offset), v_array.distanceToPoint(offset)[n], delta=0.000001)
+
+        # 配列を共有している場合、代入演算の結果が元の配列に反映される
+        data = np.array([[1, 2, 3], [4, 5, 6]], dtype=np.float64)
+        shared_array = MVector3DArray(data)
+        shared_array *= MVector3D(2, 1, 0)
+        shared_array += np.array([1, -1])
+        self.assertTrue(np.array_equal([[3, 3, 1], [7, 4, -1]], data))
+
+        # 1次元の配列は、要素数が3でも位置毎の値として扱う(ベクトルとして扱うのはMVector3Dのみ)
+        scaled_array = v_array * np.array([1, 2, 3])
+        print(scaled_array)
+        for n, v in enumerate(vs):
+            self.assertTrue(np.allclose((v * (n + 1)).data(), scaled_array.data()[n]))
+        self.assertFalse(np.allclose((v_array * MVector3D(1, 2, 3)).data(), scaled_array.data()))
+        v_array[2] = np.array([7, 8, 9])
+        self.assertTrue(np.array_equal([7, 8, 9], v_array.data()[2]))
@@ -11,17 +11,61 @@ sys.path.append(str(current_dir) + '/../src/')
 
 from mmd.PmxReader import PmxReader # noqa
 from mmd.VmdReader import VmdReader # noqa
+import random # noqa
+import numpy as np # noqa
 from mmd.PmxData import PmxModel, Vertex, Material, Bone, Morph, DisplaySlot, RigidBody, Joint # noqa
 from mmd.VmdData import VmdMotion, VmdBoneFrame, VmdCameraFrame, VmdInfoIk, VmdLightFrame, VmdMorphFrame, VmdShadowFrame, VmdShowIkFrame # noqa
 from module.MMath import MRect, MVector2D, MVector3D, MVector4D, MQuaternion, MMatrix4x4 # noqa
 from module.MOptions import MOptions # noqa
-from module.MParams import BoneLinks # noqa
+from module.MParams import BoneLinks, PoseCache # noqa
 from utils import MBezierUtils, MServiceUtils # noqa
 from utils.MLogger import MLogger # noqa
 
 logger = MLogger(__name__)
 
 
+# 検証用の腕モデル(軸制限と回転付与を含む)
+def create_arm_model():
+    model = PmxModel()
+    model.name = "arm"
+    for bone_idx, (bone_name, position, parent_index, flag, kwargs) in enumerate([
+            ("全ての親", MVector3D(0, 0, 0), -1, 0x001E, {}),
+            ("センター", MVector3D(0, 8, 0), 0, 0x001E, {}),
+            ("上半身", MVector3D(0, 12, 0), 1, 0x001A, {}),
+            ("右腕", MVector3D(-2, 14, 0.3), 2, 0x001A, {}),
+            ("右腕捩", MVector3D(-3, 13.5, 0.2), 3, 0x041A, {"fixed_axis": MVector3D(-1, -0.5, 0)}),
+            ("右ひじ", MVector3D(-4, 13, 0), 4, 0x001A, {}),
+            ("右手捩", MVector3D(-5, 12.5, 0.1), 5, 0x011A, {"effect_index": 4, "effect_factor": 0.5}),
+            ("右手首", MVector3D(-6, 12, -0.2), 6, 0x001A, {}),
+            ("右中指１", MVector3D(-7, 11.8, -0.2), 7, 0x001A, {})]):
+        bone = Bone(bone_name, bone_name, position, parent_index, 0, flag, **kwargs)
+        bone.index = bone_idx
+        model.bones[bone_name] = bone
+        model.bone_indexes[bone_idx] = bone_name
+
+    return model
+
+
+# 検証用のランダムなモーション
+def create_random_motion(model: PmxModel, seed=0, key_cnt=8, last_fno=100):
+    random.seed(seed)
+    motion = VmdMotion()
+    for bone_name in model.bones.keys():
+        for fno in random.sample(range(last_fno), key_cnt):
+            bf = VmdBoneFrame(fno)
+            bf.set_name(bone_name)
+            bf.key = True
+            bf.read = True
+            if bone_name in ["全ての親", "センター"]:
+                bf.position = MVector3D(random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1))
+            bf.rotation = MQuaternion.fromEulerAngles(random.uniform(-60, 60), random.uniform(-60, 60), random.uniform(-60, 60))
+            bf.interpolation = [random.randint(0, 127) for _ in range(64)]
+            motion.append_bone_frame(bf)
+            motion.last_motion_frame = max(motion.last_motion_frame, fno)
+
+    return motion
+
+
 class MServiceUtilsTest(unittest.TestCase):
 
     def test_calc_relative_position01(self):
@@ -376,7 +420,193 @@ class MServiceUtilsTest(unittest.TestCase):
         self.assertAlmostEqual(pos_dic["右手首"].x(), 0.56, delta=0.1)
         self.assertAlmostEqual(pos_dic["右手首"].y(), 13.83, delta=0.1)
         self.assertAlmostEqual(pos_dic["右手首"].z(), 0.23, delta=0.1)
-                
+
+    def test_calc_global_pos02(self):
+        model = create_arm_model()
+        motion = create_random_motion(model)
+        links = model.create_link_2_top_one("右中指１", is_defined=False)
+
+        for fno in range(0, 100, 7):
+            for is_local_x in [False, True]:
+                pos_dic, mat_dic = MServiceUtils.calc_global_pos(model, links, motion, fno, return_matrix=True, is_local_x=is_local_x)
+                org_pos_dic, org_mat_dic = MServiceUtils.calc_global_pos_org(model, links, motion, fno, return_matrix=True, is_local_x=is_local_x)
+                print(fno, pos_dic["右中指１"], org_pos_dic["右中指１"])
+
+                self.assertEqual(list(org_pos_dic.keys()), list(pos_dic.keys()))
+                for bone_name in org_pos_dic.keys():
+                    self.assertTrue(np.allclose(org_pos_dic[bone_name].data(), pos_dic[bone_name].data(), atol=1e-10))
+                    self.assertTrue(np.allclose(org_mat_dic[bone_name].data(), mat_dic[bone_name].data(), atol=1e-10))
+
+    def test_calc_global_pos_many01(self):
+        model = create_arm_model()
+        motion = create_random_motion(model)
+        links = model.create_link_2_top_one("右中指１", is_defined=False)
+        fnos = list(range(-3, 105, 3))
+
+        global_poses, total_mats = MServiceUtils.calc_global_pos_many(model, links, motion, fnos, return_matrix=True, is_local_x=True)
+        self.assertEqual((len(fnos), links.size(), 3), global_poses.shape)
+        self.assertEqual((len(fnos), links.size(), 4, 4), total_mats.shape)
+
+        for fidx, fno in enumerate(fnos):
+            pos_dic, mat_dic = MServiceUtils.calc_global_pos(model, links, motion, fno, return_matrix=True, is_local_x=True)
+            many_pos_dic, many_mat_dic = MServiceUtils.get_global_pos_dic(links, global_poses, total_mats, fidx)
+            print(fno, pos_dic["右中指１"], many_pos_dic["右中指１"])
+
+            for bone_name in pos_dic.keys():
+                self.assertTrue(np.allclose(pos_dic[bone_name].data(), many_pos_dic[bone_name].data(), atol=1e-10))
+                self.assertTrue(np.allclose(mat_dic[bone_name].data(), many_mat_dic[bone_name].data(), atol=1e-10))
+
+    def test_calc_global_pos_cache01(self):
+        model = create_arm_model()
+        motion = create_random_motion(model)
+        links = model.create_link_2_top_one("右中指１", is_defined=False)
+        MServiceUtils.pose_cache.clear()
+
+        pos_dic = MServiceUtils.calc_global_pos(model, links, motion, 10)
+        cache_pos_dic = MServiceUtils.calc_global_pos(model, links, motion, 10, is_cache=True)
+        self.assertEqual(1, MServiceUtils.pose_cache.misses)
+
+        # 2回目はキャッシュから取得(書き換えても、キャッシュには影響しない)
+        cache_pos_dic["右中指１"].setY(0)
+        cache_pos_dic = MServiceUtils.calc_global_pos(model, links, motion, 10, is_cache=True)
+        self.assertEqual(1, MServiceUtils.pose_cache.hits)
+        print(pos_dic["右中指１"], cache_pos_dic["右中指１"])
+
+        for bone_name in pos_dic.keys():
+            self.assertTrue(np.allclose(pos_dic[bone_name].data(), cache_pos_dic[bone_name].data()))
+
+        # キーを登録したら、バージョンが変わるので再計算
+        version = motion.version
+        bf = VmdBoneFrame(10)
+        bf.set_name("右腕")
+        bf.rotation = MQuaternion.fromEulerAngles(0, 0, 45)
+        motion.regist_bf(bf, "右腕", 10)
+        self.assertNotEqual(version, motion.version)
+
+        pos_dic = MServiceUtils.calc_global_pos(model, links, motion, 10)
+        cache_pos_dic = MServiceUtils.calc_global_pos(model, links, motion, 10, is_cache=True)
+        self.assertEqual(2, MServiceUtils.pose_cache.misses)
+
+        for bone_name in pos_dic.keys():
+            self.assertTrue(np.allclose(pos_dic[bone_name].data(), cache_pos_dic[bone_name].data()))
+
+        # 上限を超えたら古いものから削除
+        cache = PoseCache(max_size=2)
+        cache.put(1, "a")
+        cache.put(2, "b")
+        cache.get(1)
+        cache.put(3, "c")
+        self.assertEqual(2, cache.size())
+        self.assertIsNone(cache.get(2))
+        self.assertEqual("a", cache.get(1))
+
+    def test_deform_rotation_cache01(self):
+        model = create_arm_model()
+        motion = create_random_motion(model)
+        MServiceUtils.deform_cache.clear()
+
+        # 付与親は平坦な一覧で保持している
+        effect_ids, effect_factors = model.get_skeleton().get_effect_chain("右手捩")
+        self.assertEqual([model.get_skeleton().index("右腕捩")], effect_ids.tolist())
+        self.assertEqual([0.5], effect_factors.tolist())
+
+        # トラック全体を一度に計算して、キャッシュに登録する
+        fnos, deform_qqs = MServiceUtils.deform_rotation_track(model, motion, "右手捩", is_cache=True)
+        self.assertEqual(motion.get_bone_fnos("右手捩"), fnos.tolist())
+
+        for fno, deform_qq in zip(fnos, deform_qqs):
+            qq = MServiceUtils.deform_rotation(model, motion, motion.calc_bf("右手捩", fno))
+            cache_qq = MServiceUtils.deform_rotation(model, motion, motion.calc_bf("右手捩", fno), is_cache=True)
+            print(fno, qq, cache_qq)
+            self.assertAlmostEqual(0, (qq - deform_qq).length(), delta=0.000001)
+            self.assertAlmostEqual(0, (qq - cache_qq).length(), delta=0.000001)
+        self.assertEqual(len(fnos), MServiceUtils.deform_cache.hits)
+
+        # 付与親のキーを登録したら、付与親のバージョンが変わるので再計算
+        fno = int(fnos[0])
+        bf = motion.calc_bf("右腕捩", fno)
+        bf.rotation = MQuaternion.fromEulerAngles(30, 0, 0)
+        motion.regist_bf(bf, "右腕捩", fno)
+
+        qq = MServiceUtils.deform_rotation(model, motion, motion.calc_bf("右手捩", fno))
+        cache_qq = MServiceUtils.deform_rotation(model, motion, motion.calc_bf("右手捩", fno), is_cache=True)
+        self.assertEqual(len(fnos), MServiceUtils.deform_cache.hits)
+        self.assertAlmostEqual(0, (qq - cache_qq).length(), delta=0.000001)
+
+    def test_calc_IK01(self):
+        model = create_arm_model()
+        motion = VmdMotion()
+        links = model.create_link_2_top_one("右中指１", is_defined=False)
+        ik_links = BoneLinks()
+        for bone_name in ["右手首", "右ひじ"]:
+            ik_links.append(model.bones[bone_name])
+
+        # ひじから届く範囲の目標位置
+        target_pos = model.bones["右ひじ"].position + MVector3D(-1, -1, 1)
+        MServiceUtils.calc_IK(model, links, motion, 10, target_pos, ik_links, max_count=1)
+        global_3ds = MServiceUtils.calc_global_pos(model, links, motion, 10)
+        print(motion.bones["右ひじ"][10].rotation, global_3ds["右手首"])
+
+        # IKの結果がモーションに登録されていて、ひじから手首の向きが目標位置を向いている
+        self.assertTrue(motion.bones["右ひじ"][10].key)
+        self.assertAlmostEqual(1, MVector3D.dotProduct((global_3ds["右手首"] - global_3ds["右ひじ"]).normalized(), (target_pos - global_3ds["右ひじ"]).normalized()), delta=0.0001)
+
+    def test_calc_IK_many01(self):
+        model = create_arm_model()
+        links = model.create_link_2_top_one("右中指１", is_defined=False)
+        ik_links = BoneLinks()
+        for bone_name in ["右手首", "右ひじ"]:
+            ik_links.append(model.bones[bone_name])
+        ik_links.get("右ひじ").ik_limit_min = MVector3D(-90, -90, -90)
+        ik_links.get("右ひじ").ik_limit_max = MVector3D(90, 90, 90)
+
+        fnos = [0, 5, 10]
+        target_poses = [model.bones["右ひじ"].position + MVector3D(-1, -1 - fno / 10, 1) for fno in fnos]
+
+        # 1フレームずつ解いた結果(まとめて解く場合と同じく、先に全フレームのキーを登録しておく)
+        motion = VmdMotion()
+        for fno in fnos:
+            motion.regist_bf(motion.calc_bf("右ひじ", fno), "右ひじ", fno)
+        for fno, target_pos in zip(fnos, target_poses):
+            MServiceUtils.calc_IK(model, links, motion, fno, target_pos, ik_links, max_count=3)
+
+        # まとめて解いた結果
+        many_motion = VmdMotion()
+        is_converged = MServiceUtils.calc_IK_many(model, links, many_motion, fnos, np.array([v.data() for v in target_poses]), ik_links, max_count=3)
+        print(is_converged)
+
+        self.assertEqual(len(fnos), len(is_converged))
+        for fno in fnos:
+            print(fno, motion.bones["右ひじ"][fno].rotation, many_motion.bones["右ひじ"][fno].rotation)
+            self.assertTrue(many_motion.bones["右ひじ"][fno].key)
+            self.assertAlmostEqual(1, abs(MQuaternion.dotProduct(motion.bones["右ひじ"][fno].rotation, many_motion.bones["右ひじ"][fno].rotation)), delta=0.0001)
+
+    def test_calc_two_bone_IK01(self):
+        model = create_arm_model()
+        links = model.create_link_2_top_one("右中指１", is_defined=False)
+        ik_links = BoneLinks()
+        for bone_name in ["右手首", "右ひじ", "右腕"]:
+            ik_links.append(model.bones[bone_name])
+
+        # 腕から届く範囲の目標位置と、ひじを曲げる方向
+        motion = create_random_motion(model)
+        org_global_3ds = MServiceUtils.calc_global_pos(model, links, motion, 10)
+        target_pos = org_global_3ds["右腕"] + MVector3D(-3, -1.5, 1)
+        pole_pos = org_global_3ds["右腕"] + MVector3D(-2, 0, -5)
+
+        self.assertTrue(MServiceUtils.calc_two_bone_IK(model, links, motion, 10, target_pos, ik_links, pole_pos))
+        global_3ds = MServiceUtils.calc_global_pos(model, links, motion, 10)
+        print(global_3ds["右手首"], global_3ds["右ひじ"])
+
+        # 手首が目標位置にあり、ひじが指定方向に曲がっている
+        self.assertAlmostEqual(0, global_3ds["右手首"].distanceToPoint(target_pos), delta=0.0001)
+        self.assertGreater(0, global_3ds["右ひじ"].z() - (global_3ds["右腕"].z() + global_3ds["右手首"].z()) / 2)
+
+        # IK軸制限を超える場合、解析的には解かない
+        ik_links.get("右ひじ").ik_limit_min = MVector3D(-0.1, -0.1, -0.1)
+        ik_links.get("右ひじ").ik_limit_max = MVector3D(0.1, 0.1, 0.1)
+        self.assertFalse(MServiceUtils.calc_two_bone_IK(model, links, create_random_motion(model), 10, target_pos, ik_links, pole_pos))
+
 
 class MBezierUtilsTest(unittest.TestCase):
 
@@ -429,6 +659,27 @@ class MBezierUtilsTest(unittest.TestCase):
         self.assertAlmostEqual(x, 0.06, delta=0.01)
         self.assertAlmostEqual(y, 0.34, delta=0.01)
         self.assertAlmostEqual(t, 0.16, delta=0.01)
+
+    def test_MBezierUtils_evaluate_many01(self):
+        xs, ys, ts = MBezierUtils.evaluate_many([20, 104, 0, 0], [20, 63, 127, 127], [107, 13, 127, 127], [107, 111, 0, 0], \
+                                                [0, 0, 0, 0], [5, 5, 1, 0], [10, 10, 30, 30])
+        print("xs: %s" % xs)
+        print("ys: %s" % ys)
+        print("ts: %s" % ts)
+
+        for n, (x, y, t) in enumerate([(0.5, 0.5, 0.5), (0.5, 0.74, 0.61), (0.03, 0.26, 0.11), (0, 0, 0)]):
+            self.assertAlmostEqual(xs[n], x, delta=0.01)
+            self.assertAlmostEqual(ys[n], y, delta=0.01)
+            self.assertAlmostEqual(ts[n], t, delta=0.01)
+
+    def test_MBezierUtils_get_evaluate_table01(self):
+        table = MBezierUtils.get_evaluate_table(0, 127, 127, 0, 30)
+        print("table: %s" % table[:3])
+
+        self.assertEqual((31, 3), table.shape)
+        self.assertAlmostEqual(table[2][1], 0.34, delta=0.01)
+        # 同じ補間曲線は同じテーブルを使う
+        self.assertIs(table, MBezierUtils.get_evaluate_table(0, 127, 127, 0, 30))
     
     def test_round_integer(self):
         self.assertEqual(MBezierUtils.round_integer(3.56), 4)